@@ -14,17 +14,39 @@ output HTML is to be generated.
 Subsidiary modules are in tools/build.
 """
 
+import glob
+import hashlib
+import io
 import logging
 import os
-import shutil
 import sys
+import time
 
+import tools.build.bounds
+import tools.build.bundle
+import tools.build.bvh
 import tools.build.cache
+import tools.build.compress
 import tools.build.config
 import tools.build.context
 import tools.build.convertTransliteration
+import tools.build.fingerprint
 import tools.build.fileutil
+import tools.build.gltf
+import tools.build.htmlrender
+import tools.build.lod
+import tools.build.manifest
+import tools.build.modellinks
+import tools.build.packmodel
+import tools.build.pageinfo
+import tools.build.profile
+import tools.build.publish
+import tools.build.search
 import tools.build.site
+import tools.build.svgsprite
+import tools.build.textures
+import tools.build.watch
+import tools.build.worker
 import tools.build.xmltoolbox
 
 
@@ -38,25 +60,38 @@ def expandPath(ctx, path):
     return os.path.abspath(path)
 
 
-def copyElementAsset(ctx, elem):
-    """Copy a asset, represented by an XML element, to the output directory."""
-    src = expandPath(ctx, elem.attrib['src'])
-    dest = os.path.join(ctx.config.distdir, elem.attrib['dest'])
-    log.debug('Copying asset: %s -> %s', src, dest)
-    shutil.copy(src, dest)
+def schemaFiles(ctx):
+    """List all of our RelaxNG schemas. The page and site schemas include the others."""
+    schemadir = os.path.dirname(ctx.config.ngpageschema)
+    return glob.glob(os.path.join(schemadir, '*.rng'))
+
+
+def copyFile(ctx, src, dest):
+    """Publish a file to the output directory, unless it is already up to date.
+
+    See tools.build.publish for how we avoid actually copying it.
+    """
+    with ctx.profiler.span('publish', 'asset', src=src) as args:
+        ctx.publisher.publish(src, dest)
+        if ctx.profiler.enabled:
+            args['bytes'] = tools.build.profile.fileBytes([src])
+
+
+def copyAsset(ctx, asset):
+    """Copy an asset that a page refers to (a tools.build.pageinfo.AssetRef) to the output directory."""
+    src = expandPath(ctx, asset.src)
+    dest = os.path.join(ctx.config.distdir, asset.dest)
+    copyFile(ctx, src, dest)
 
 
 def copyStaticDirectoryAssets(ctx):
     log.info('Copying static assets...')
-    for item in os.listdir(ctx.config.staticdir):
-        src = os.path.join(ctx.config.staticdir, item)
-        dest = os.path.join(ctx.config.distdir, item)
-        if os.path.isdir(src):
-            log.debug('Copying directory: %s -> %s', src, dest)
-            shutil.copytree(src, dest)
-        else:
-            log.debug('Copying: %s -> %s', src, dest)
-            shutil.copy(src, dest)
+    for root, dirs, files in os.walk(ctx.config.staticdir):
+        reldir = os.path.relpath(root, ctx.config.staticdir)
+        destdir = os.path.normpath(os.path.join(ctx.config.distdir, reldir))
+        os.makedirs(destdir, exist_ok=True)
+        for f in files:
+            copyFile(ctx, os.path.join(root, f), os.path.join(destdir, f))
 
 
 def copySourceDirectoryJavascript(ctx):
@@ -67,27 +102,473 @@ def copySourceDirectoryJavascript(ctx):
 
         src = os.path.join(ctx.config.sourcedir, entry)
         dest = os.path.join(ctx.config.distdir, 'js', entry)
-        log.debug('Copying %s -> %s', src, dest)
-        shutil.copy(src, dest)
+        copyFile(ctx, src, dest)
+
+
+def publishTextures(ctx, info, model):
+    """Publish the images in a glTF model on their own, with their scaled-down variants.
+
+    They go in a directory next to the model. Returns a map of image index
+    -> URI, for the packed model and its LODs to refer to them by, or None
+    if the model's images couldn't be read, so they should be embedded.
+    """
+    textures = tools.build.textures
+    src = expandPath(ctx, model.src)
+    try:
+        with ctx.profiler.span('makeTextures', 'asset', src=src) as args:
+            made = textures.makeTextures(tools.build.gltf.Gltf.load(src), ctx.config.texturecachedir)
+            args['images'] = len(made)
+    except (OSError, tools.build.gltf.GltfError, textures.TextureError) as e:
+        log.warning("Couldn't make texture variants for %s, so embedding its images: %s",
+                    src, getattr(e, 'message', e))
+        return None
+    destdir = os.path.join(os.path.dirname(model.dest), textures.TEXTURE_DIR)
+    os.makedirs(os.path.join(ctx.config.distdir, destdir), exist_ok=True)
+    for texture in made:
+        for name, path in texture.files.items():
+            dest = os.path.join(destdir, name)
+            copyFile(ctx, path, os.path.join(ctx.config.distdir, dest))
+            if dest not in info.outputs:
+                info.outputs.append(dest)
+    return {texture.index: texture.uri for texture in made}
+
+
+def packModel(ctx, model, images=None, offset=None):
+    """Pack a glTF model into an optimised GLB file.
+
+    images and offset are as for tools.build.packmodel.ModelPacker. Returns where the
+    packed model went, relative to the dist directory, or None if the model
+    couldn't be packed.
+    """
+    src = expandPath(ctx, model.src)
+    packed = tools.build.packmodel.packedModelPath(model.dest)
+    dest = os.path.join(ctx.config.distdir, packed)
+    key = 'pack:' + dest
+    inputs = [src, tools.build.packmodel.__file__, tools.build.bounds.__file__, tools.build.gltf.__file__]
+    params = {'images': images, 'offset': formatVector(offset)}
+    if not ctx.manifest.isStale(key, inputs=inputs, outputs=[dest], params=params):
+        log.debug('Packed model up to date: %s', dest)
+        return packed
+    log.info('Packing model: %s -> %s', src, dest)
+    try:
+        with ctx.profiler.span('packModel', 'asset', src=src) as args:
+            tools.build.packmodel.packModel(src, dest, images, offset)
+            args['bytes'] = os.path.getsize(dest)
+    except tools.build.gltf.GltfError as e:
+        log.warning("Couldn't pack %s, so publishing it as it is: %s", src, e.message)
+        return None
+    ctx.manifest.record(key)
+    return packed
+
+
+def modelLods(ctx, model):
+    """List the LODs to publish for a model, finest first, relative to the dist directory.
+
+    There are none unless we've been asked for them, or if the model is
+    too small to be worth simplifying.
+    """
+    if not ctx.config.lods or os.path.splitext(model.src)[1].lower() not in ('.gltf', '.glb'):
+        return []
+    src = expandPath(ctx, model.src)
+    try:
+        levels = tools.build.lod.lodLevels(src)
+    except tools.build.gltf.GltfError as e:
+        log.warning("Couldn't read %s, so not making LODs of it: %s", src, e.message)
+        return []
+    return [tools.build.lod.lodPath(model.dest, level) for level in levels]
+
+
+def formatVector(vector):
+    """Format a vector for a page attribute (or manifest params), or None for no vector."""
+    if vector is None:
+        return None
+    return ' '.join(f'{v:.6g}' for v in vector)
+
+
+def modelGeometry(ctx, model, geometries):
+    """Load a readable glTF model, and find its centre (see tools.build.bounds).
+
+    Returns the loaded tools.build.gltf.Gltf and its centre, or None if
+    the model can't be read. geometries caches them, by model source path.
+    """
+    src = expandPath(ctx, model.src)
+    if src not in geometries:
+        try:
+            with ctx.profiler.span('modelCenter', 'asset', src=src):
+                gltfmodel = tools.build.gltf.Gltf.load(src)
+                geometries[src] = (gltfmodel, tools.build.bounds.modelCenter(gltfmodel))
+        except tools.build.gltf.GltfError as e:
+            log.warning("Couldn't find the centre of %s: %s", src, e.message)
+            geometries[src] = None
+    return geometries[src]
+
+
+def publishModel(ctx, info, model, lods, center=None):
+    """Publish a model that a page refers to, packing it if we've been asked to.
+
+    Returns the attributes to add to the page's model element. The model's
+    LODs are listed there, coarsest first, and added to lods, but aren't
+    made until we know which nodes the page links to; see publishLods.
+    With texture variants, the packed model and its LODs share images
+    published on their own, and the sizes of their variants are listed too.
+
+    center, if known, is the model's centre. The packed model and its LODs
+    have it baked in; otherwise, the offset the viewer should move the
+    model by is listed. Returns the attributes, and the offset baked into
+    the published model (see tools.build.bounds).
+    """
+    attrs = None
+    baked = None
+    packable = os.path.splitext(model.src)[1].lower() in ('.gltf', '.glb')
+    paths = modelLods(ctx, model)
+    images = None
+    if ctx.config.texturevariants and ((ctx.config.packmodels and packable) or paths):
+        images = publishTextures(ctx, info, model)
+    if ctx.config.packmodels and packable:
+        packed = packModel(ctx, model, images, center)
+        if packed:
+            info.outputs.append(packed)
+            attrs = {'packed': packed}
+            baked = center
+    if attrs is None:
+        copyAsset(ctx, model)
+        info.outputs.append(model.dest)
+    if paths:
+        info.outputs.extend(paths)
+        lods.append((model, paths, images, baked))
+        attrs = dict(attrs or {}, lods=' '.join(reversed(paths)))
+    if images:
+        attrs = dict(attrs or {}, textures=' '.join(str(size) for size in tools.build.textures.TEXTURE_SIZES))
+    if center is not None:
+        attrs = dict(attrs or {}, offset=formatVector(center if baked is None else center - baked))
+    return attrs, baked
+
+
+def publishLods(ctx, lods):
+    """Make the LODs of the models a page refers to, leaving the nodes it links to alone.
+
+    lods lists each model, with its LODs, the URIs of its images, and the
+    offset baked into it, as publishModel found them.
+    """
+    for model, paths, images, offset in lods:
+        src = expandPath(ctx, model.src)
+        dests = [os.path.join(ctx.config.distdir, path) for path in paths]
+        keepnodes = sorted({link.node for link in model.links if link.node is not None})
+        key = 'lod:' + dests[0]
+        inputs = [src, tools.build.lod.__file__, tools.build.packmodel.__file__, tools.build.bounds.__file__,
+                  tools.build.gltf.__file__]
+        params = {'keepnodes': keepnodes, 'images': images, 'offset': formatVector(offset)}
+        if not ctx.manifest.isStale(key, inputs=inputs, outputs=dests, params=params):
+            log.debug('LODs up to date: %s', src)
+            continue
+        log.info('Making %d LOD(s) of model: %s', len(dests), src)
+        try:
+            with ctx.profiler.span('makeLods', 'asset', src=src) as args:
+                args['triangles'] = tools.build.lod.makeLods(src, dests, keepnodes, images, offset)
+        except tools.build.gltf.GltfError as e:
+            log.warning("Couldn't make LODs of %s: %s", src, e.message)
+            continue
+        ctx.manifest.record(key)
 
 
-def copyAssetsMatchingElements(ctx, page, elementname):
-    for elem in page.findall('.//' + elementname):
-        copyElementAsset(ctx, elem)
+def modelNodeIndex(ctx, model, nodeindexes):
+    """Get a model's node index (see tools.build.modellinks.nodeIndex), or None if it can't be read.
+
+    nodeindexes caches them, by model source path.
+    """
+    src = expandPath(ctx, model.src)
+    if src not in nodeindexes:
+        try:
+            nodeindexes[src] = tools.build.modellinks.nodeIndex(src, ctx.manifest.fileDigest(src))
+        except tools.build.gltf.GltfError as e:
+            log.warning("Couldn't check model links: %s", e.message)
+            nodeindexes[src] = None
+    return nodeindexes[src]
+
+
+def resolveLink(ctx, info, model, link, nodeindexes):
+    """Resolve a model link to the index of the node it names.
+
+    Returns the attributes to add to the page's link element. A link that
+    doesn't resolve is a problem with the page. If the model can't be read,
+    its links are left unresolved, and the viewer finds them by name.
+    """
+    index = modelNodeIndex(ctx, model, nodeindexes)
+    if index is None:
+        return None
+    node = index.get(tools.build.modellinks.sanitizeNodeName(link.name))
+    if node is None:
+        info.problems.append(f'no node named "{link.name}" in {model.src}')
+        return None
+    link.node = node
+    return {'node': str(node)}
 
 
-def copyModelsReferencedFromPage(ctx, page):
-    log.info('Copying models for %s...', page.attrib['src'])
-    copyAssetsMatchingElements(ctx, page, 'model')
+def hitboxAttrs(ctx, model, link, placement):
+    """Describe the hitbox a resolved link refers to (see tools.build.bounds.hitboxMetadata).
 
+    placement is the loaded model, its centre, and the offset baked into
+    it. Returns the attributes to add to the page's link element, for the
+    viewer to move the camera to the hitbox with.
+    """
+    gltfmodel, center, offset = placement
+    try:
+        metadata = tools.build.bounds.hitboxMetadata(gltfmodel, link.node, center, offset)
+    except tools.build.gltf.GltfError as e:
+        log.warning("Couldn't measure hitbox %s of %s: %s", link.name, model.src, e.message)
+        return {}
+    if metadata is None:
+        return {}
+    return {name: formatVector(value) for name, value in metadata.items()}
+
+
+def publishBvhs(ctx, bvhs):
+    """Build the BVH of the hitboxes of each model a page refers to, which the viewer picks them with.
 
-def copyHieroglyphImagesReferencedFromPage(ctx, page):
-    log.info('Copying hieroglyphics for %s...', page.attrib['src'])
-    copyAssetsMatchingElements(ctx, page, 'himg')
+    bvhs lists the models, once their links are resolved, with the offsets
+    baked into them.
+    """
+    for model, offset in bvhs:
+        src = expandPath(ctx, model.src)
+        dest = os.path.join(ctx.config.distdir, tools.build.bvh.bvhPath(model.dest))
+        nodes = sorted({link.node for link in model.links if link.node is not None})
+        key = 'bvh:' + dest
+        inputs = [src, tools.build.bvh.__file__, tools.build.gltf.__file__]
+        params = {'nodes': nodes, 'offset': formatVector(offset)}
+        if not ctx.manifest.isStale(key, inputs=inputs, outputs=[dest], params=params):
+            log.debug('Hitbox BVH up to date: %s', dest)
+            continue
+        log.info('Building hitbox BVH: %s -> %s', src, dest)
+        try:
+            with ctx.profiler.span('makeBvh', 'asset', src=src) as args:
+                args['triangles'] = tools.build.bvh.makeBvh(src, dest, nodes, offset)
+        except tools.build.gltf.GltfError as e:
+            log.warning("Couldn't build a hitbox BVH for %s: %s", src, e.message)
+            continue
+        ctx.manifest.record(key)
+
+
+def publishImage(ctx, info, image, sprites):
+    """Publish a hieroglyph image that a page refers to, adding it to the page's sprite sheet if we can.
+
+    Returns the attributes to add to the page's himg element.
+    """
+    if ctx.config.sprites != 'none':
+        src = expandPath(ctx, image.src)
+        try:
+            return sprites.add(src, image.dest)
+        except (OSError, tools.build.svgsprite.SvgError) as e:
+            log.warning("Couldn't add %s to a sprite sheet, so publishing it as it is: %s",
+                        src, getattr(e, 'message', e))
+    copyAsset(ctx, image)
+    info.outputs.append(image.dest)
+    return None
+
+
+def pageAnnotator(ctx, sprites, lods, bvhs):
+    """Make an annotate function for tools.build.pageinfo.processPage.
+
+    It publishes each model and image as soon as the page refers to it,
+    and resolves model links, adding attributes that tell the XSLT about
+    the results. Images go in sprites, the page's sprite sheet, unless
+    sprites are turned off, models with LODs go in lods, and readable glTF
+    models, whose hitbox BVHs are built once their links are resolved, go
+    in bvhs. Readable glTF models are centred, and their links' hitboxes
+    described, at build time, so the viewer doesn't have to walk their
+    meshes to do it.
+    """
+    nodeindexes = {}  # model source path -> node index, or None
+    geometries = {}  # model source path -> (Gltf, centre), or None
+    placements = []  # (Gltf, centre, baked offset) of each of the page's models, or None
+
+    def annotate(info, name, attrs):
+        if name == 'model':
+            model = info.models[-1]
+            geometry = None
+            readable = (os.path.splitext(model.src)[1].lower() in ('.gltf', '.glb')
+                        and modelNodeIndex(ctx, model, nodeindexes) is not None)
+            if readable:
+                geometry = modelGeometry(ctx, model, geometries)
+            with ctx.profiler.span('publishModel', 'page', src=model.src):
+                attrs, offset = publishModel(ctx, info, model, lods, geometry and geometry[1])
+            placements.append(geometry and (geometry[0], geometry[1], offset))
+            if readable:
+                bvhs.append((model, offset))
+                path = tools.build.bvh.bvhPath(model.dest)
+                info.outputs.append(path)
+                attrs = dict(attrs or {}, bvh=path)
+            return attrs
+        if name == 'link' and info.models and info.models[-1].links:
+            model = info.models[-1]
+            link = model.links[-1]
+            attrs = resolveLink(ctx, info, model, link, nodeindexes)
+            if attrs and placements[-1]:
+                attrs.update(hitboxAttrs(ctx, model, link, placements[-1]))
+            return attrs
+        if name == 'himg':
+            attrs = publishImage(ctx, info, info.images[-1], sprites)
+            if attrs:
+                where = 'sprite' if ctx.config.sprites == 'sheet' else 'inline-sprite'
+                attrs = dict(attrs, **{where: tools.build.svgsprite.spritePath(info.src)})
+            return attrs
+        return None
+    return annotate
+
+
+def writeSprites(ctx, page, info, sprites):
+    """Write a page's sprite sheet: to the dist directory, or for inlining, to the build directory.
+
+    Inlined sheets are read by page2html.xsl, so with a worker, they're
+    sent to the worker instead.
+    """
+    if not sprites:
+        return
+    path = tools.build.svgsprite.spritePath(page)
+    if ctx.config.sprites == 'sheet':
+        info.outputs.append(path)
+        dest = os.path.join(ctx.config.distdir, path)
+    else:
+        dest = os.path.join(ctx.config.builddir, path)
+    log.debug('Writing sprite sheet (%d images): %s', len(sprites.symbols), dest)
+    with ctx.profiler.span('writeSprites', 'page', page=page) as args:
+        if ctx.worker and ctx.config.sprites == 'inline':
+            data = sprites.tobytes()
+            ctx.worker.put(dest, data, hashlib.sha256(data).hexdigest())
+        else:
+            sprites.write(dest)
+        args['images'] = len(sprites.symbols)
+
+
+def pageInputs(ctx, srcpage, info):
+    """List the files that a page's converted XML, and the assets published for it, are derived from.
+
+    info is the page's PageInfo, which tells us what assets it refers to.
+    """
+    inputs = [srcpage, tools.build.convertTransliteration.__file__, tools.build.pageinfo.__file__,
+              tools.build.modellinks.__file__, tools.build.bvh.__file__, tools.build.bounds.__file__,
+              tools.build.svgsprite.__file__]
+    if ctx.config.packmodels or ctx.config.lods:
+        inputs += [tools.build.packmodel.__file__, tools.build.gltf.__file__]
+    if ctx.config.lods:
+        inputs.append(tools.build.lod.__file__)
+    if ctx.config.texturevariants:
+        inputs.append(tools.build.textures.__file__)
+    if info:
+        inputs += [expandPath(ctx, src) for src in info.assets()]
+    return inputs
+
+
+def pageParams(ctx):
+    """The options that affect how pages are processed."""
+    return {'packmodels': ctx.config.packmodels, 'lods': ctx.config.lods,
+            'texturevariants': ctx.config.texturevariants, 'sprites': ctx.config.sprites}
+
+
+def pageInfoPath(ctx, page):
+    return os.path.join(ctx.config.builddir, os.path.splitext(page)[0] + '.info.json')
+
+
+def convertPage(ctx, page):
+    """Process a page, returning its PageInfo.
+
+    Processing is a single pass over the page XML. It converts the page's
+    transliterations, collects its PageInfo, and publishes its assets,
+    gathering its images into a sprite sheet that's written at the end,
+    along with the LODs and hitbox BVHs of its models. With a worker, the converted XML
+    goes straight to the worker instead of to the build directory.
+    """
+    srcpage = os.path.join(ctx.config.sourcedir, page)
+    destpage = os.path.join(ctx.config.builddir, page)
+    sprites = tools.build.svgsprite.SpriteSheet()
+    lods = []
+    bvhs = []
+    annotate = pageAnnotator(ctx, sprites, lods, bvhs)
+    if ctx.worker:
+        log.info('Processing page: %s -> (worker) %s', srcpage, destpage)
+        outfile = io.BytesIO()
+        with ctx.profiler.span('convertPage', 'page', src=srcpage, bytes=os.path.getsize(srcpage)):
+            with open(srcpage) as infile:
+                info = tools.build.pageinfo.processPage(infile, outfile, src=srcpage, annotate=annotate)
+        if not info.problems:
+            writeSprites(ctx, page, info, sprites)
+            publishLods(ctx, lods)
+            publishBvhs(ctx, bvhs)
+            digest = ctx.manifest.inputsDigest(pageInputs(ctx, srcpage, info), pageParams(ctx))
+            ctx.worker.put(destpage, outfile.getvalue(), digest)
+        return info
+
+    log.info('Processing page: %s -> %s', srcpage, destpage)
+    with ctx.profiler.span('convertPage', 'page', src=srcpage, bytes=os.path.getsize(srcpage)):
+        with open(destpage, 'w') as outfile:
+            with open(srcpage) as infile:
+                info = tools.build.pageinfo.processPage(infile, outfile, src=srcpage, annotate=annotate)
+    if not info.problems:
+        writeSprites(ctx, page, info, sprites)
+        publishLods(ctx, lods)
+        publishBvhs(ctx, bvhs)
+    return info
+
+
+def processPage(ctx, page):
+    """Process a page, unless nothing it depends on has changed since the last build.
+
+    Returns the page's PageInfo. Unchanged pages aren't even parsed: we
+    reuse the PageInfo that the last build saved in the build directory.
+    """
+    srcpage = os.path.join(ctx.config.sourcedir, page)
+    infopath = pageInfoPath(ctx, page)
+    key = 'page:' + srcpage
+    previous = tools.build.pageinfo.PageInfo.load(infopath)
+    if previous:
+        outputs = [infopath] + [os.path.join(ctx.config.distdir, p) for p in previous.outputs]
+        if not ctx.worker:
+            outputs.append(os.path.join(ctx.config.builddir, page))
+        inputs = pageInputs(ctx, srcpage, previous)
+        if not ctx.manifest.isStale(key, inputs=inputs, outputs=outputs, params=pageParams(ctx)):
+            log.debug('Page up to date: %s', srcpage)
+            return previous
+
+    info = convertPage(ctx, page)
+    if not info.problems:
+        info.save(infopath)
+        # The page may refer to different assets now, so check it again to
+        # record the digest of what it depends on now.
+        ctx.manifest.isStale(key, inputs=pageInputs(ctx, srcpage, info), params=pageParams(ctx))
+        ctx.manifest.record(key)
+    return info
+
+
+def processPages(ctx):
+    """Process every page, publishing the assets they refer to.
+
+    Problems found in the pages are collected and raised together as a
+    PageError.
+    """
+    log.info('Processing pages...')
+    os.makedirs(ctx.config.modelsdestdir, exist_ok=True)
+    os.makedirs(ctx.config.imgdestdir, exist_ok=True)
+    ctx.pages = {}
+    problems = []
+    for page in tools.build.site.getPages(ctx):
+        with ctx.profiler.span('processPage', 'page', page=page):
+            info = processPage(ctx, page)
+        ctx.pages[page] = info
+        problems.extend((info.src, problem) for problem in info.problems)
+    if problems:
+        raise tools.build.pageinfo.PageError(problems)
+
+
+def referencedAssets(ctx):
+    """List the source paths of all the assets referenced from our pages."""
+    return [expandPath(ctx, src) for info in ctx.pages.values() for src in info.assets()]
 
 
 def copyAssets(ctx):
-    """Copy all assets to the output directory."""
+    """Copy the static assets to the output directory.
+
+    The assets that pages refer to are published as the pages are
+    processed; see processPages.
+    """
     # Most of our assets can just be copied over wholesale from
     # the static directory.
     copyStaticDirectoryAssets(ctx)
@@ -96,75 +577,459 @@ def copyAssets(ctx):
     # Scoop those up and copy them over.
     copySourceDirectoryJavascript(ctx)
 
-    # Don't copy stuff from the assets directory wholesale.
-    # Just copy whatever is referenced from the pages.
-    os.makedirs(ctx.config.modelsdestdir, exist_ok=True)
-    os.makedirs(ctx.config.imgdestdir, exist_ok=True)
-    for pagepath in tools.build.site.getPagePaths(ctx, ctx.config.sourcedir):
-        page = ctx.cache.load(pagepath)
-        copyModelsReferencedFromPage(ctx, page)
-        copyHieroglyphImagesReferencedFromPage(ctx, page)
 
+# The scripts that make up the viewer's bundle (relative to the dist
+# directory), in the order they depend on each other.
+JS_BUNDLE = [
+    'js/three.min.js',
+    'js/loaders/GLTFLoader.js',
+    'js/controls/OrbitControls.js',
+    'js/main.js',
+    'js/page.js',
+]
+JS_BUNDLE_DEST = 'js/viewer.js'
 
-def convertTransliteration(src, dest):
-    """Convert transliterations from MdC to Unicode."""
-    log.info("Converting transliterations: %s -> %s", src, dest)
-    with open(dest, 'w') as outfile:
+CSS_SRC = 'css/viewer.css'
+CSS_DEST = 'css/viewer.min.css'
+
+# The shared assets that the site index, and every page, refer to (see
+# local:asset in the stylesheets).
+INDEX_ASSETS = ['js/search.js', tools.build.search.SEARCH_DIR + '/' + tools.build.search.INDEX_NAME]
+PAGE_ASSETS = [CSS_DEST, JS_BUNDLE_DEST]
+
+
+def bundleAssets(ctx):
+    """Bundle and minify the viewer's scripts, and minify its stylesheet, for pages to refer to.
+
+    The scripts are concatenated into a single bundle, with a source map
+    that refers back to the copies of the originals in the dist directory.
+    """
+    distdir = ctx.config.distdir
+    sources = [os.path.join(distdir, path) for path in JS_BUNDLE]
+    dest = os.path.join(distdir, JS_BUNDLE_DEST)
+    outputs = [dest, dest + '.map']
+    key = 'bundle:' + dest
+    if ctx.manifest.isStale(key, inputs=sources + [tools.build.bundle.__file__], outputs=outputs):
+        log.info('Bundling scripts: %s', dest)
+        with ctx.profiler.span('bundleJs', 'asset', bytes=tools.build.profile.fileBytes(sources)) as args:
+            args['outbytes'] = tools.build.bundle.bundleJs(sources, dest, distdir)
+        ctx.manifest.record(key)
+    else:
+        log.debug('Script bundle up to date: %s', dest)
+
+    src = os.path.join(distdir, CSS_SRC)
+    dest = os.path.join(distdir, CSS_DEST)
+    key = 'minify:' + dest
+    if ctx.manifest.isStale(key, inputs=[src, tools.build.bundle.__file__], outputs=[dest]):
+        log.info('Minifying stylesheet: %s', dest)
+        with ctx.profiler.span('minifyCss', 'asset', bytes=os.path.getsize(src)) as args:
+            args['outbytes'] = tools.build.bundle.minifyCssFile(src, dest)
+        ctx.manifest.record(key)
+    else:
+        log.debug('Minified stylesheet up to date: %s', dest)
+
+
+def searchIndexDir(ctx):
+    return os.path.join(ctx.config.distdir, tools.build.search.SEARCH_DIR)
+
+
+def buildSearchIndex(ctx):
+    """Build the site's full-text search index (see tools.build.search), unless no page has changed."""
+    destdir = searchIndexDir(ctx)
+    srcpages = [os.path.join(ctx.config.sourcedir, page) for page in ctx.pages]
+    inputs = [ctx.config.srcsitexml, tools.build.search.__file__,
+              tools.build.convertTransliteration.__file__] + srcpages
+    if not ctx.manifest.isStale('search', inputs=inputs, outputs=tools.build.search.indexFiles(destdir)):
+        log.info('Search index is up to date.')
+        return
+    log.info('Building search index...')
+    with ctx.profiler.span('buildSearchIndex') as args:
+        pages = [(info.dest, info.name, ctx.cache.load(src)) for src, info in zip(srcpages, ctx.pages.values())]
+        index, shards = tools.build.search.buildIndex(pages)
+        tools.build.search.writeIndex(destdir, index, shards)
+        args['documents'] = len(index['docs'])
+        args['shards'] = len(shards)
+    log.info('Indexed %d document(s) in %d shard(s)', len(index['docs']), len(shards))
+    ctx.manifest.record('search')
+
+
+def fingerprintAssets(ctx):
+    """Publish a content-hashed copy of each asset in the output directory, for pages to refer to.
+
+    The copies are listed in the asset manifest, which page2html.xsl reads.
+    Without --fingerprint, there's no asset manifest, and any copies from
+    earlier builds are removed. The search index's shards are left alone:
+    they're named by their contents already.
+    """
+    fingerprint = tools.build.fingerprint
+    distdir = ctx.config.distdir
+    previous = fingerprint.loadManifest(ctx.config.assetmanifest)
+    assets = {}
+    if ctx.config.fingerprint:
+        log.info('Fingerprinting assets...')
+        # The first of the index files is the index itself, which refers to the shards.
+        shards = {os.path.relpath(path, distdir).replace(os.sep, '/')
+                  for path in tools.build.search.indexFiles(searchIndexDir(ctx))[1:]}
+        paths = fingerprint.assetFiles(distdir, exclude=set(previous.values()) | shards)
+        # Assets that refer to other assets go last, so that their
+        # references can be rewritten to the others' fingerprinted copies.
+        for path in sorted(paths, key=fingerprint.isRewritable):
+            src = os.path.join(distdir, path)
+            if fingerprint.isRewritable(path):
+                data, digest = fingerprint.rewriteAsset(src, path, assets)
+                assets[path] = fingerprint.fingerprintedPath(path, digest)
+                dest = os.path.join(distdir, assets[path])
+                if not os.path.exists(dest):
+                    tools.build.fileutil.writeFile(dest, data)
+            else:
+                assets[path] = fingerprint.fingerprintedPath(path, ctx.manifest.fileDigest(src))
+                copyFile(ctx, src, os.path.join(distdir, assets[path]))
+
+    for path in set(previous.values()) - set(assets.values()):
+        for stale in [path, tools.build.compress.compressedPath(path)]:
+            if os.path.exists(os.path.join(distdir, stale)):
+                log.debug('Removing old fingerprinted asset: %s', stale)
+                os.unlink(os.path.join(distdir, stale))
+    if assets:
+        fingerprint.saveManifest(ctx.config.assetmanifest, assets)
+    elif os.path.exists(ctx.config.assetmanifest):
+        os.unlink(ctx.config.assetmanifest)
+
+
+def htmlParams(ctx, info, assets, shared):
+    """The options that affect a page's HTML.
+
+    These are the options that affect how pages are processed, and the
+    fingerprinted names of the assets the page refers to: its own, and
+    those that every page shares.
+    """
+    params = pageParams(ctx)
+    params['assets'] = dict(shared, **{p: assets[p] for p in info.outputs if p in assets})
+    params['renderer'] = ctx.config.htmlrenderer
+    return params
+
+
+def htmlTools(ctx, stylesheet):
+    """List the tools that render HTML with the given stylesheet, for the renderer we're using."""
+    inputs = []
+    if ctx.config.htmlrenderer != 'python':
+        inputs += [ctx.config.buildsitejarpath, stylesheet]
+    if ctx.config.htmlrenderer != 'xslt':
+        inputs.append(tools.build.htmlrender.__file__)
+    return inputs
+
+
+def renderHtml(ctx, stylesheet, src, assets):
+    """Render the HTML that the given stylesheet makes of src (converted XML in the build directory) in Python.
+
+    See tools.build.htmlrender. assets is the asset manifest.
+    """
+    def load(path):
+        return ctx.cache.load(os.path.join(ctx.config.builddir, path))
+
+    if stylesheet == ctx.config.site2html:
+        return tools.build.htmlrender.renderSite(ctx.cache.load(src), assets, load)
+    return tools.build.htmlrender.renderPage(ctx.cache.load(src), assets, load)
+
+
+def renderHtmlFiles(ctx, jobs, assets):
+    """Render HTML in Python rather than with BuildSite: jobs lists each (stylesheet, src, dest)."""
+    for stylesheet, src, dest in jobs:
+        log.info('Rendering: %s -> %s', src, dest)
+        with ctx.profiler.span('render', 'html', src=src, dest=dest):
+            html = renderHtml(ctx, stylesheet, src, assets)
+            tools.build.fileutil.writeFile(dest, html.encode('utf-8'))
+
+
+def compareRenderers(ctx, jobs, assets):
+    """Check that the Python renderer makes the same HTML as BuildSite just did, for each of jobs.
+
+    Differences are collected and raised together as a RenderMismatch.
+    """
+    log.info('Comparing the HTML of %d file(s) with the Python renderer...', len(jobs))
+    mismatches = {}
+    for stylesheet, src, dest in jobs:
+        with ctx.profiler.span('compareHtml', 'html', src=src, dest=dest):
+            with open(dest, encoding='utf-8') as f:
+                expected = f.read()
+            diff = tools.build.htmlrender.compareHtml(
+                expected, renderHtml(ctx, stylesheet, src, assets), fromfile=dest + ' (xslt)',
+                tofile=dest + ' (python)')
+        if diff:
+            mismatches[dest] = diff
+    if mismatches:
+        raise tools.build.htmlrender.RenderMismatch(mismatches)
+    log.info('The Python renderer agrees with BuildSite.')
+
+
+def transliterationInputs(src):
+    """List the files that the site's converted XML is derived from."""
+    return [src, tools.build.convertTransliteration.__file__]
+
+
+def sendTransliteration(ctx, src, dest):
+    """Convert transliterations from MdC to Unicode, handing the result to the BuildSite worker.
+
+    The worker uses it in place of the file at dest, which isn't written.
+    """
+    digest = ctx.manifest.inputsDigest(transliterationInputs(src))
+    if ctx.worker.hasDocument(dest, digest):
+        log.debug("Transliterations up to date in worker: %s", dest)
+        return
+    log.info("Converting transliterations: %s -> (worker) %s", src, dest)
+    outfile = io.StringIO()
+    with ctx.profiler.span('convertTransliteration', 'site', src=src, bytes=os.path.getsize(src)):
         with open(src) as infile:
             tools.build.convertTransliteration.transform(infile, outfile)
+    ctx.worker.put(dest, outfile.getvalue().encode('utf-8'), digest)
+
+
+def sendPages(ctx, pages):
+    """Make sure the BuildSite worker has the current converted XML for the given pages.
+
+    Pages processed by this build have already been sent, but the worker
+    may have been (re)started since others were.
+    """
+    for page in pages:
+        srcpage = os.path.join(ctx.config.sourcedir, page)
+        destpage = os.path.join(ctx.config.builddir, page)
+        digest = ctx.manifest.inputsDigest(pageInputs(ctx, srcpage, ctx.pages[page]), pageParams(ctx))
+        if not ctx.worker.hasDocument(destpage, digest):
+            convertPage(ctx, page)
+
+
+def convertTransliteration(ctx, src, dest):
+    """Convert transliterations from MdC to Unicode."""
+    key = 'convert:' + src
+    inputs = transliterationInputs(src)
+    if not ctx.manifest.isStale(key, inputs=inputs, outputs=[dest]):
+        log.debug("Transliterations up to date: %s", dest)
+        return
+    log.info("Converting transliterations: %s -> %s", src, dest)
+    with ctx.profiler.span('convertTransliteration', 'site', src=src, bytes=os.path.getsize(src)):
+        with open(dest, 'w') as outfile:
+            with open(src) as infile:
+                tools.build.convertTransliteration.transform(infile, outfile)
+    ctx.manifest.record(key)
 
 
 def convertTransliterations(ctx):
+    """Convert the transliterations in the site XML. Pages are converted by processPages."""
+    if ctx.worker:
+        # The converted XML goes straight to the worker, if and when we
+        # need to transform it. See transformSite.
+        return
     log.info("Converting transliterations from MdC to Unicode...")
-    convertTransliteration(src=ctx.config.srcsitexml, dest=ctx.config.buildsitexml)
-    for page in tools.build.site.getPages(ctx):
+    convertTransliteration(ctx, src=ctx.config.srcsitexml, dest=ctx.config.buildsitexml)
+
+
+def transformSite(ctx):
+    """Generate HTML for the site index, and for each page whose inputs changed.
+
+    The site index lists the name of every page, so it is regenerated
+    whenever any page changes.
+    """
+    pagetools = htmlTools(ctx, ctx.config.page2html)
+    assets = tools.build.fingerprint.loadManifest(ctx.config.assetmanifest)
+    shared = {p: assets[p] for p in PAGE_ASSETS if p in assets}
+    stalepages = {}
+    for page, info in ctx.pages.items():
         srcpage = os.path.join(ctx.config.sourcedir, page)
-        destpage = os.path.join(ctx.config.builddir, page)
-        convertTransliteration(src=srcpage, dest=destpage)
+        dest = os.path.join(ctx.config.distdir, info.dest)
+        inputs = pageInputs(ctx, srcpage, info) + pagetools
+        params = htmlParams(ctx, info, assets, shared)
+        if ctx.manifest.isStale('html:' + page, inputs=inputs, outputs=[dest], params=params):
+            stalepages[page] = dest
+
+    srcpages = list(tools.build.site.getSitePages(ctx))
+    indexinputs = transliterationInputs(ctx.config.srcsitexml) + srcpages
+    indexinputs += htmlTools(ctx, ctx.config.site2html)
+    indexparams = {'renderer': ctx.config.htmlrenderer,
+                   'assets': {p: assets[p] for p in INDEX_ASSETS if p in assets}}
+    if not ctx.manifest.isStale('html:index', inputs=indexinputs, outputs=[ctx.config.distindexhtml],
+                                params=indexparams):
+        if not stalepages:
+            log.info('Site HTML is up to date.')
+            return
+
+    jobs = [(ctx.config.site2html, ctx.config.buildsitexml, ctx.config.distindexhtml)]
+    jobs += [(ctx.config.page2html, os.path.join(ctx.config.builddir, page), dest)
+             for page, dest in stalepages.items()]
+    if ctx.config.htmlrenderer == 'python':
+        renderHtmlFiles(ctx, jobs, assets)
+    elif ctx.worker:
+        sendTransliteration(ctx, src=ctx.config.srcsitexml, dest=ctx.config.buildsitexml)
+        sendPages(ctx, stalepages)
+        ctx.worker.transformMany(jobs)
+    else:
+        ctx.toolbox.transformSite(pages=list(stalepages))
+    if ctx.config.htmlrenderer == 'compare':
+        compareRenderers(ctx, jobs, assets)
+    ctx.manifest.record('html:index')
+    for page in stalepages:
+        ctx.manifest.record('html:' + page)
+
+
+def compressDist(ctx):
+    """Write gzipped copies of the text and model files in the output directory, for the web server.
+
+    Only files that changed since the last build are compressed again.
+    """
+    log.info('Compressing output...')
+    stale = []
+    for path in tools.build.compress.compressibleFiles(ctx.config.distdir):
+        if ctx.manifest.isStale('gzip:' + path, inputs=[path, tools.build.compress.__file__]):
+            stale.append(path)
+    with ctx.profiler.span('compressFiles', files=len(stale)) as args:
+        results = tools.build.compress.compressFiles(stale)
+        args['bytes'] = sum(size for size, _ in results.values())
+    for path in stale:
+        ctx.manifest.record('gzip:' + path)
+
+    compressed = [(size, gzsize) for size, gzsize in results.values() if gzsize is not None]
+    log.info('Compressed %d of %d changed file(s): %s -> %s', len(compressed), len(stale),
+             tools.build.publish.formatBytes(sum(size for size, _ in compressed)),
+             tools.build.publish.formatBytes(sum(gzsize for _, gzsize in compressed)))
+
+
+def uncompressDist(ctx):
+    """Delete the gzipped copies that an earlier build with --compress left in the output directory.
+
+    Incremental builds keep the output of the last build, and the copies
+    would otherwise be published as they are, however the files change.
+    """
+    removed = tools.build.compress.removeCompressedFiles(ctx.config.distdir)
+    if removed:
+        log.info('Removed %d gzipped file(s) left by an earlier build with --compress', removed)
+    ctx.manifest.forget('gzip:')
 
 
 def buildSite(ctx):
     """Build the entire site.
 
     Assumes the site XML has been preprocessed.
-    Assets are copied to the output directory wholesale.
-    Transliterations are converted to Unicode.
-    Finally, HTML is generated from the site XML.
+    Static assets are copied to the output directory wholesale, and the
+    viewer's scripts and stylesheet are bundled and minified.
+    Each page is processed in a single pass, which converts its
+    transliterations to Unicode and publishes the assets it refers to.
+    The pages' texts are indexed for searching.
+    With --fingerprint, content-hashed copies of the assets are published
+    for the pages to refer to.
+    Then HTML is generated from the site XML.
     We use XSLT as defined by site2html.xsl to do the transformation.
+    Finally, with --compress, gzipped copies of the output are written
+    for the web server; without it, any left by an earlier build are
+    removed.
+
+    For incremental builds, each of these steps is skipped for the files
+    whose inputs haven't changed since the last build.
     """
-    copyAssets(ctx)
-    convertTransliterations(ctx)
-    ctx.toolbox.transformSite()
+    if ctx.worker:
+        ctx.worker.ensureCurrent()
+    ctx.publisher.reset()
+    with ctx.profiler.span('copyAssets'):
+        copyAssets(ctx)
+    with ctx.profiler.span('bundleAssets'):
+        bundleAssets(ctx)
+    with ctx.profiler.span('processPages'):
+        processPages(ctx)
+    buildSearchIndex(ctx)
+    with ctx.profiler.span('fingerprintAssets'):
+        fingerprintAssets(ctx)
+    ctx.publisher.logStats()
+    if ctx.worker:
+        # The worker reads the asset manifest, so restart it if that changed.
+        ctx.worker.ensureCurrent()
+    with ctx.profiler.span('convertTransliterations'):
+        convertTransliterations(ctx)
+    with ctx.profiler.span('transformSite'):
+        transformSite(ctx)
+    if ctx.config.compress:
+        with ctx.profiler.span('compressDist'):
+            compressDist(ctx)
+    else:
+        uncompressDist(ctx)
 
 
-def preprocessPage(ctx, page):
-    log.info('Preprocessing page: %s', page)
-    if ctx.config.validate:
-        ctx.toolbox.validate(page)
-        ctx.toolbox.validateNGSchema(schema=ctx.config.ngpageschema, target=page)
+def validateXml(ctx, targetsBySchema):
+    """Validate XML files against their RelaxNG schemas.
+
+    targetsBySchema maps each schema to the files that should be validated
+    against it. Each schema's files are validated together, skipping those
+    which (along with the schemas) are unchanged since the last build.
+    All validation errors are collected and raised together as a
+    ValidationError.
+    """
+    schemas = schemaFiles(ctx)
+    failures = {}
+    for schema, targets in targetsBySchema.items():
+        stale = [t for t in targets if ctx.manifest.isStale('validate:' + t, inputs=[t] + schemas)]
+        if not stale:
+            log.debug('Already validated against %s', schema)
+            continue
+        log.info('Validating %d file(s) against %s...', len(stale), schema)
+        with ctx.profiler.span('validate', schema=schema, files=len(stale)):
+            invalid = ctx.toolbox.validateNGSchemaBatch(schema=schema, targets=stale)
+        failures.update(invalid)
+        for target in stale:
+            if target not in invalid:
+                ctx.manifest.record('validate:' + target)
+
+    if failures:
+        raise tools.build.xmltoolbox.ValidationError(failures)
 
 
 def preprocessSite(ctx):
     log.info('Preprocessing site XML...')
     if ctx.config.validate:
-        ctx.toolbox.validate(ctx.config.srcsitexml)
-        ctx.toolbox.validateNGSchema(schema=ctx.config.ngsiteschema, target=ctx.config.srcsitexml)
-
-    for page in tools.build.site.getSitePages(ctx):
-        preprocessPage(ctx, page)
+        validateXml(ctx, {
+            ctx.config.ngsiteschema: [ctx.config.srcsitexml],
+            ctx.config.ngpageschema: list(tools.build.site.getSitePages(ctx)),
+        })
 
 
 def prepareDistDir(ctx):
-    """Clean the output directory, or create it if it doesn't exist."""
+    """Clean the staging directory that the build writes to, or create it if it doesn't exist.
+
+    Incremental builds keep the output of the previous build. The dist
+    directory itself is left alone until publishDist.
+    """
     if not os.path.exists(ctx.config.distdir):
-        log.info('Creating dist directory: %s', ctx.config.distdir)
+        log.info('Creating staging directory: %s', ctx.config.distdir)
         os.makedirs(ctx.config.distdir, exist_ok=True)
         return
 
-    log.info('Cleaning dist directory: %s', ctx.config.distdir)
+    if ctx.config.incremental:
+        log.info('Incremental build; keeping staging directory: %s', ctx.config.distdir)
+        return
+
+    log.info('Cleaning staging directory: %s', ctx.config.distdir)
     tools.build.fileutil.cleanDirectory(ctx.config.distdir)
 
 
+def publishDist(ctx):
+    """Publish the build output from the staging directory to the dist directory.
+
+    Only files that changed are written, each replaced atomically, and
+    files the build no longer makes are removed, so whatever is serving the
+    dist directory never sees it half-built. See tools.build.publish.
+    """
+    # Anything not in the staging directory is removed from the dist
+    # directory, so make sure that the build really wrote its output there.
+    if not os.path.exists(ctx.config.distindexhtml):
+        raise tools.build.publish.PublishError(
+            f'{ctx.config.distindexhtml} is missing, so not publishing {ctx.config.distdir} to '
+            f'{ctx.config.publishdir}.')
+    log.info('Publishing %s to %s...', ctx.config.distdir, ctx.config.publishdir)
+    # Symbolic links into the staging directory would change along with
+    # it, before they're published.
+    mode = 'auto' if ctx.config.linkmode == 'symlink' else ctx.config.linkmode
+    publisher = tools.build.publish.AssetPublisher(digest=ctx.manifest.fileDigest, mode=mode)
+    added, updated, removed = publisher.sync(ctx.config.distdir, ctx.config.publishdir)
+    log.info('Published %s: %d file(s) added, %d updated, %d removed',
+             ctx.config.publishdir, added, updated, removed)
+
+
 def prepareBuildDir(ctx):
     """Clean the intermediate build directory, or create it if it doesn't exist."""
     if not os.path.exists(ctx.config.builddir):
@@ -173,6 +1038,79 @@ def prepareBuildDir(ctx):
         return
 
 
+def build(ctx):
+    """Run the build, returning an exit status for build.py.
+
+    With --profile, also write out and summarise a profile of the build.
+    """
+    ctx.profiler.reset()
+    try:
+        with ctx.profiler.span('build'):
+            try:
+                with ctx.profiler.span('preprocessSite'):
+                    preprocessSite(ctx)
+                with ctx.profiler.span('prepareDistDir'):
+                    prepareDistDir(ctx)
+                buildSite(ctx)
+            except (tools.build.xmltoolbox.ValidationError, tools.build.pageinfo.PageError,
+                    tools.build.bundle.MinifyError, tools.build.htmlrender.RenderMismatch) as e:
+                log.error(e.message)
+                return 1
+            with ctx.profiler.span('saveManifest'):
+                ctx.manifest.save()
+            with ctx.profiler.span('publishDist'):
+                try:
+                    publishDist(ctx)
+                except tools.build.publish.PublishError as e:
+                    log.error(e.message)
+                    return 1
+        ctx.cache.logStats()
+        return 0
+    finally:
+        if ctx.profiler.enabled:
+            ctx.profiler.writeTrace(ctx.config.profiletrace)
+            ctx.profiler.logSummary()
+
+
+def watch(ctx):
+    """Build, then rebuild whatever is affected each time our inputs change.
+
+    Each rebuild is incremental, so e.g. editing a page only redoes that
+    page (and the site index), editing a stylesheet only regenerates HTML,
+    and editing CSS only copies that file. Runs until interrupted.
+    """
+    watcher = tools.build.watch.Watcher()
+    dirs = [
+        ctx.config.sourcedir,
+        ctx.config.staticdir,
+        ctx.config.stylesheetdir,
+        os.path.dirname(ctx.config.ngpageschema),
+    ]
+    files = [ctx.config.buildsitejarpath]
+    try:
+        while True:
+            start = time.monotonic()
+            try:
+                if build(ctx) == 0:
+                    log.info('Build finished in %.2fs.', time.monotonic() - start)
+            except Exception:
+                log.exception('Build failed')
+            ctx.config.incremental = True
+
+            try:
+                files = [ctx.config.buildsitejarpath] + referencedAssets(ctx)
+            except Exception as e:
+                log.warning("Couldn't update the list of referenced assets: %s", e)
+            watcher.setPaths(dirs, files)
+
+            log.info('Watching for changes. Press Ctrl-C to stop.')
+            changed = watcher.wait()
+            log.info('Changed: %s', ', '.join(sorted(changed)))
+    except KeyboardInterrupt:
+        log.info('Stopped watching.')
+        return 0
+
+
 def main(args):
     # Script is assumed to live in the root of the project
     # directory.
@@ -181,15 +1119,33 @@ def main(args):
         os.chdir(rootdir)
     config = tools.build.config.getConfig(args)
     if config.verbose:
-        log.setLevel(logging.DEBUG)
-    cache = tools.build.cache.XMLDocumentCache()
-    toolbox = tools.build.xmltoolbox.XMLToolbox(config)
-    ctx = tools.build.context.Context(config=config, cache=cache, toolbox=toolbox)
+        logging.getLogger().setLevel(logging.DEBUG)
+    cache = tools.build.cache.XMLDocumentCache(diskdir=config.xmlcachedir if config.persistxmlcache else None)
+    profiler = tools.build.profile.Profiler(enabled=config.profile)
+    toolbox = tools.build.xmltoolbox.XMLToolbox(config, profiler=profiler)
+    manifest = tools.build.manifest.BuildManifest(config.buildmanifest)
+    publisher = tools.build.publish.AssetPublisher(digest=manifest.fileDigest, mode=config.linkmode)
+    worker = tools.build.worker.BuildSiteWorker(config, profiler=profiler) if config.worker else None
+    ctx = tools.build.context.Context(
+        config=config, cache=cache, toolbox=toolbox, manifest=manifest, publisher=publisher, worker=worker,
+        profiler=profiler
+    )
     prepareBuildDir(ctx)
-    preprocessSite(ctx)
-    prepareDistDir(ctx)
-    buildSite(ctx)
-    return 0
+    manifest.load()
+    if not config.incremental:
+        # A full build redoes everything, but still records what it did,
+        # so that the next incremental build has something to go on.
+        manifest.reset()
+    try:
+        if config.watch:
+            return watch(ctx)
+        return build(ctx)
+    except tools.build.worker.WorkerError as e:
+        log.error(e.message)
+        return 1
+    finally:
+        if worker:
+            worker.stop()
 
 
 if __name__ == '__main__':
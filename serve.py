@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+serve.py serves the built site from the dist directory, for testing.
+
+Like nginx with gzip_static, it sends the gzipped copy of a file that
+build.py --compress wrote next to it (e.g. js/main.js.gz for js/main.js)
+to browsers that accept gzip, so you can check the site as it will be
+served.
+"""
+
+import argparse
+import email.utils
+import functools
+import http.server
+import logging
+import os
+import sys
+
+import tools.build.config
+
+logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='%(levelname)s: %(message)s')
+log = logging.getLogger('serve')
+
+
+def acceptsGzip(header):
+    """Check an Accept-Encoding header for gzip (that isn't ruled out with q=0)."""
+    for part in (header or '').split(','):
+        coding, _, params = part.partition(';')
+        if coding.strip().lower() == 'gzip':
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+class PrecompressedHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves files, preferring their precompressed .gz siblings."""
+
+    extensions_map = dict(http.server.SimpleHTTPRequestHandler.extensions_map, **{
+        '.gltf': 'model/gltf+json',
+        '.glb': 'model/gltf-binary',
+        '.js': 'application/javascript',
+        '.svg': 'image/svg+xml',
+        '.woff': 'font/woff',
+    })
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and self.path.split('?', 1)[0].endswith('/'):
+            path = os.path.join(path, 'index.html')
+        gzpath = path + '.gz'
+        if not (os.path.isfile(path) and os.path.isfile(gzpath)
+                and acceptsGzip(self.headers.get('Accept-Encoding'))):
+            return super(PrecompressedHandler, self).send_head()
+
+        f = open(gzpath, 'rb')
+        try:
+            st = os.fstat(f.fileno())
+            self.send_response(200)
+            self.send_header('Content-Type', self.guess_type(path))
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(st.st_size))
+            self.send_header('Last-Modified', email.utils.formatdate(st.st_mtime, usegmt=True))
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return f
+        except Exception:
+            f.close()
+            raise
+
+
+def main(args):
+    # Script is assumed to live in the root of the project
+    # directory.
+    rootdir = os.path.dirname(args[0])
+    if rootdir and rootdir != '.':
+        os.chdir(rootdir)
+    config = tools.build.config.loadConfigFromFile('build_config.xml')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--distdir', default=config.distdir, help='the directory to serve')
+    parser.add_argument('--bind', default='localhost', help='the address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='the port to listen on')
+    ns = parser.parse_args(args[1:])
+
+    handler = functools.partial(PrecompressedHandler, directory=ns.distdir)
+    with http.server.ThreadingHTTPServer((ns.bind, ns.port), handler) as server:
+        log.info('Serving %s at http://%s:%d/ (press Ctrl-C to stop)', ns.distdir, ns.bind, ns.port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    rv = main(sys.argv)
+    sys.exit(rv)
@@ -62,6 +62,15 @@ function ModelViewer() {
 
   this.sceneObjects = [];
 
+  this.modelScene = null;
+  this.hitboxes = null; // {bvh, objects}, once we can pick hitboxes with a HitboxBVH
+
+  // We only draw the scene when something changes; see requestRender.
+  this.frameRequested = false;
+  this.continuous = false;
+  this.stats = null; // a FrameStats, if we're keeping them
+  this.controls.addEventListener('change', () => { this.requestRender(); });
+
   this.domElement.appendChild(this.renderer.domElement);
   window.addEventListener('resize', () => { this.resize(); }, false);
   this.resize();
@@ -92,55 +101,152 @@ ModelViewer.prototype.render = function render() {
   this.renderer.render(this.scene, this.camera);
 };
 
+// ModelViewer.drawFrame updates and draws the scene, timing it if we're
+// keeping frame stats.
+ModelViewer.prototype.drawFrame = function drawFrame() {
+  const start = performance.now();
+  this.update();
+  this.render();
+  if (this.stats) {
+    this.stats.record(performance.now() - start, this.renderer.info);
+  }
+};
+
+// ModelViewer.requestRender asks for the scene to be drawn in the next
+// animation frame. Nothing is drawn unless something asks: the controls do
+// whenever they move the camera (and, while damping, each update moves it
+// again, which asks for another frame), as does anything that changes the
+// scene or the selection, and resizing. So an idle viewer costs nothing.
+ModelViewer.prototype.requestRender = function requestRender() {
+  if (this.frameRequested || this.continuous) {
+    return;
+  }
+  this.frameRequested = true;
+  requestAnimationFrame(() => {
+    this.frameRequested = false;
+    this.drawFrame();
+  });
+};
+
+// ModelViewer.runContinuously draws the scene on every animation frame,
+// whether or not anything changed, as the viewer always used to. It's
+// useful for comparison when measuring.
+ModelViewer.prototype.runContinuously = function runContinuously() {
+  this.continuous = true;
+  const self = this;
+  (function gameLoop() {
+    requestAnimationFrame(gameLoop);
+    self.drawFrame();
+  }());
+};
+
+// FrameStats keeps rolling statistics about the frames the viewer draws
+// (how long each took to update and draw, on the CPU, and what the last
+// one drew, from renderer.info), and shows them over the viewer.
+function FrameStats(viewer) {
+  this.frames = 0;
+  this.times = [];
+  this.calls = 0;
+  this.triangles = 0;
+  this.domElement = document.createElement('div');
+  this.domElement.id = 'viewer-stats';
+  viewer.domElement.appendChild(this.domElement);
+  this.show();
+}
+
+// How many frames the rolling statistics cover.
+FrameStats.WINDOW = 60;
+
+FrameStats.prototype.record = function record(ms, info) {
+  this.frames += 1;
+  this.times.push(ms);
+  if (this.times.length > FrameStats.WINDOW) {
+    this.times.shift();
+  }
+  this.calls = info.render.calls;
+  this.triangles = info.render.triangles;
+  this.show();
+};
+
+// FrameStats.summary returns the statistics, for showing or for scripts
+// that measure the viewer (see ModelController.run).
+FrameStats.prototype.summary = function summary() {
+  const total = this.times.reduce((a, b) => a + b, 0);
+  return {
+    frames: this.frames,
+    meanMs: this.times.length ? total / this.times.length : 0,
+    maxMs: this.times.length ? Math.max(...this.times) : 0,
+    calls: this.calls,
+    triangles: this.triangles,
+  };
+};
+
+FrameStats.prototype.show = function show() {
+  const s = this.summary();
+  this.domElement.textContent = `frames ${s.frames}\n`
+    + `frame ${s.meanMs.toFixed(2)} ms (max ${s.maxMs.toFixed(2)})\n`
+    + `calls ${s.calls}\ntriangles ${s.triangles}`;
+};
+
+// ModelViewer.chooseTextureSize picks which of the given sizes of texture
+// variants (see tools/build/textures.py) to load: the smallest that covers
+// the viewer, in device pixels, that the GPU can take. It returns null, for
+// the original images, if there are no variants, or none are big enough.
+ModelViewer.prototype.chooseTextureSize = function chooseTextureSize(sizes) {
+  const maxSize = this.renderer.capabilities.maxTextureSize;
+  const wanted = Math.max(this.getWidth(), this.getHeight()) * (window.devicePixelRatio || 1);
+  const usable = sizes.filter((size) => size <= maxSize).sort((a, b) => a - b);
+  const size = usable.find((s) => s >= wanted);
+  if (size) {
+    return size;
+  }
+  // Nothing's big enough, so the originals are best, unless the GPU can't
+  // take the biggest variants, in which case it can't take the originals.
+  if (usable.length && usable.length < sizes.length) {
+    return usable[usable.length - 1];
+  }
+  return null;
+};
+
 // centerModel ensures that the given scene, which is assumed to represent a
 // single model, is centered around the origin.
 function centerModel(scene) {
-  // Compute the bounding box of the scene.
-  // Unfortunately, arbitrary Object3D objects don't
-  // know their bounding box, but anything with geometry
-  // (i.e. a Mesh) can compute one.
-  const bbox = new THREE.Box3();
-  scene.traverse((child) => {
-    if (child.geometry) {
-      child.geometry.computeBoundingBox();
-      bbox.union(child.geometry.boundingBox);
-    }
-  });
+  // Compute the bounding box of the scene in world space. We can't just
+  // combine the bounding boxes of each geometry, because those are in each
+  // mesh's own coordinates: packed models (see tools/build/packmodel.py)
+  // store quantized positions, and rely on node transforms to scale them.
+  scene.updateMatrixWorld(true);
+  const bbox = new THREE.Box3().setFromObject(scene);
 
   // Figure out where the center of the bounding box is,
-  // and translate everything in the reverse direction,
+  // and translate the whole scene in the reverse direction,
   // so that the origin will become the center.
   const center = new THREE.Vector3();
   bbox.getCenter(center);
-  const axis = center.clone().negate().normalize();
-  const distance = center.length();
-
-  // NOTE: It so happens that our model has a single node
-  // and mesh, which are transformed to a single Scene
-  // and Group in the three.js scene graph. In theory,
-  // then, it should suffice to translate the group, or
-  // maybe even the scene. I choose instead to translate
-  // the individual objects I measured above, so as to
-  // minimize my assumptions of the structure of the
-  // scene graph.
-  scene.traverse((child) => {
-    if (child.geometry) {
-      child.translateOnAxis(axis, distance);
-    }
-  });
+  scene.position.sub(center);
+  scene.updateMatrixWorld(true);
 }
 
 // ModelViewer.setModel adds the given model, expected as a scene object, to
 // the viewer's scene graph. The given scene is added as a child of the
-// viewer's scene.
-ModelViewer.prototype.setModel = function setModel(modelScene) {
-  centerModel(modelScene);
+// viewer's scene. offset, if given, is how far to move the model to centre
+// it, which the build worked out (see tools/build/bounds.py); otherwise, we
+// work it out from the model's vertices.
+ModelViewer.prototype.setModel = function setModel(modelScene, offset) {
+  if (offset) {
+    modelScene.position.fromArray(offset).negate();
+    modelScene.updateMatrixWorld(true);
+  } else {
+    centerModel(modelScene);
+  }
+  this.modelScene = modelScene;
   modelScene.traverse((child) => {
     if (child instanceof THREE.Mesh) {
       this.sceneObjects.push(child);
     }
   });
   this.scene.add(modelScene);
+  this.requestRender();
 };
 
 // ModelViewer.resize handles a resize of the browser window. The WebGL display
@@ -151,10 +257,13 @@ ModelViewer.prototype.resize = function resize() {
   this.camera.aspect = newwidth / newheight;
   this.camera.updateProjectionMatrix();
   this.renderer.setSize(newwidth, newheight);
+  this.requestRender();
 };
 
 // ModelViewer.intersectObject returns the object identified by a mouse
-// click, if any.
+// click, if any, and the face of it that was clicked. Once we have a BVH of
+// the model's hitboxes, we only look for those; until then, we look at
+// everything in the scene.
 ModelViewer.prototype.intersectObject = function intersectObject(mouseDownEvent) {
   // Convert mouse event coordinates to coordinates from the top-
   // left corner of our canvas.
@@ -179,6 +288,9 @@ ModelViewer.prototype.intersectObject = function intersectObject(mouseDownEvent)
 
   const raycaster = new THREE.Raycaster();
   raycaster.setFromCamera(mouse, this.camera);
+  if (this.hitboxes) {
+    return this.intersectHitbox(raycaster.ray);
+  }
   const intersects = raycaster.intersectObject(this.scene, true);
   var firstintersect = {
     "object":null,
@@ -191,6 +303,150 @@ ModelViewer.prototype.intersectObject = function intersectObject(mouseDownEvent)
   return firstintersect
 };
 
+// ModelViewer.intersectHitbox finds the hitbox that the given ray (in world
+// space) hits first, using the model's HitboxBVH. It returns the same as
+// intersectObject, with the face's normal in world space.
+ModelViewer.prototype.intersectHitbox = function intersectHitbox(ray) {
+  // The BVH is in the model's own space, which the viewer has moved.
+  const matrix = this.modelScene.matrixWorld;
+  const inverse = new THREE.Matrix4().getInverse(matrix);
+  const hit = this.hitboxes.bvh.intersectRay(ray.clone().applyMatrix4(inverse));
+  if (!hit) {
+    return { object: null, face: null };
+  }
+  return {
+    object: this.hitboxes.objects.get(hit.node) || null,
+    face: { normal: hit.normal.transformDirection(matrix) },
+  };
+};
+
+// HitboxBVH is a bounding volume hierarchy over the triangles of a model's
+// hitboxes, which the build makes, so that we can find which hitbox a ray
+// hits without testing every triangle in the model. See tools/build/bvh.py
+// for the format of the buffer it's read from.
+function HitboxBVH(buffer) {
+  const header = new Uint32Array(buffer, 0, 4);
+  if (header[0] !== HitboxBVH.MAGIC || header[1] !== HitboxBVH.VERSION) {
+    throw new Error('not a hitbox BVH, or not one we understand');
+  }
+  const nodeCount = header[2];
+  const triangleCount = header[3];
+  let offset = header.byteLength;
+  this.bounds = new Float32Array(buffer, offset, nodeCount * 6);
+  offset += this.bounds.byteLength;
+  this.nodes = new Int32Array(buffer, offset, nodeCount * 2);
+  offset += this.nodes.byteLength;
+  this.triangles = new Float32Array(buffer, offset, triangleCount * 9);
+  offset += this.triangles.byteLength;
+  this.triangleNodes = new Uint32Array(buffer, offset, triangleCount);
+}
+
+HitboxBVH.MAGIC = 0x31485642; // 'BVH1'
+HitboxBVH.VERSION = 1;
+
+// HitboxBVH.intersectBox returns the distance along the ray (given by its
+// origin and the reciprocal of its direction) at which it enters the given
+// node's bounds, or Infinity if it misses them.
+HitboxBVH.prototype.intersectBox = function intersectBox(node, origin, inverseDir) {
+  const b = this.bounds;
+  let tmin = 0;
+  let tmax = Infinity;
+  for (let axis = 0; axis < 3; axis += 1) {
+    let t0 = (b[node * 6 + axis] - origin[axis]) * inverseDir[axis];
+    let t1 = (b[node * 6 + 3 + axis] - origin[axis]) * inverseDir[axis];
+    if (t0 > t1) {
+      [t0, t1] = [t1, t0];
+    }
+    tmin = Math.max(tmin, t0);
+    tmax = Math.min(tmax, t1);
+    if (tmin > tmax) {
+      return Infinity;
+    }
+  }
+  return tmin;
+};
+
+// HitboxBVH.intersectTriangle returns the distance along the ray at which it
+// hits the given triangle, from either side, or Infinity if it misses it
+// (Moller and Trumbore's algorithm).
+HitboxBVH.prototype.intersectTriangle = function intersectTriangle(tri, origin, dir) {
+  const v = this.triangles;
+  const i = tri * 9;
+  const e1x = v[i + 3] - v[i]; const e1y = v[i + 4] - v[i + 1]; const e1z = v[i + 5] - v[i + 2];
+  const e2x = v[i + 6] - v[i]; const e2y = v[i + 7] - v[i + 1]; const e2z = v[i + 8] - v[i + 2];
+  const px = dir[1] * e2z - dir[2] * e2y;
+  const py = dir[2] * e2x - dir[0] * e2z;
+  const pz = dir[0] * e2y - dir[1] * e2x;
+  const det = e1x * px + e1y * py + e1z * pz;
+  if (Math.abs(det) < 1e-12) {
+    return Infinity;
+  }
+  const tx = origin[0] - v[i]; const ty = origin[1] - v[i + 1]; const tz = origin[2] - v[i + 2];
+  const u = (tx * px + ty * py + tz * pz) / det;
+  if (u < 0 || u > 1) {
+    return Infinity;
+  }
+  const qx = ty * e1z - tz * e1y;
+  const qy = tz * e1x - tx * e1z;
+  const qz = tx * e1y - ty * e1x;
+  const w = (dir[0] * qx + dir[1] * qy + dir[2] * qz) / det;
+  if (w < 0 || u + w > 1) {
+    return Infinity;
+  }
+  const t = (e2x * qx + e2y * qy + e2z * qz) / det;
+  return t >= 0 ? t : Infinity;
+};
+
+// HitboxBVH.intersectRay finds the first triangle the given ray (a THREE.Ray,
+// in the model's space) hits. It returns the hitbox node it belongs to, the
+// distance along the ray, and the triangle's normal, or null if it hits
+// none. Nodes are visited nearest first, and skipped once they're further
+// away than the nearest hit so far.
+HitboxBVH.prototype.intersectRay = function intersectRay(ray) {
+  if (!this.nodes.length) {
+    return null;
+  }
+  const origin = ray.origin.toArray();
+  const dir = ray.direction.toArray();
+  const inverseDir = dir.map((d) => 1 / d);
+  let best = Infinity;
+  let bestTriangle = -1;
+  const stack = [[0, this.intersectBox(0, origin, inverseDir)]];
+  while (stack.length) {
+    const [node, entry] = stack.pop();
+    if (entry < best) {
+      const offset = this.nodes[node * 2];
+      const count = this.nodes[node * 2 + 1];
+      if (count > 0) {
+        for (let tri = offset; tri < offset + count; tri += 1) {
+          const t = this.intersectTriangle(tri, origin, dir);
+          if (t < best) {
+            best = t;
+            bestTriangle = tri;
+          }
+        }
+      } else {
+        const left = [node + 1, this.intersectBox(node + 1, origin, inverseDir)];
+        const right = [offset, this.intersectBox(offset, origin, inverseDir)];
+        // Push the further child first, so that we visit the nearer first.
+        if (left[1] < right[1]) {
+          stack.push(right, left);
+        } else {
+          stack.push(left, right);
+        }
+      }
+    }
+  }
+  if (bestTriangle < 0) {
+    return null;
+  }
+  const v = this.triangles.subarray(bestTriangle * 9, bestTriangle * 9 + 9);
+  const a = new THREE.Vector3(v[0], v[1], v[2]);
+  const normal = new THREE.Vector3(v[3], v[4], v[5]).sub(a)
+    .cross(new THREE.Vector3(v[6], v[7], v[8]).sub(a)).normalize();
+  return { node: this.triangleNodes[bestTriangle], distance: best, normal };
+};
+
 // fixupModelLink munges an incoming model link to make sure that a valid
 // reference to a GLTF object becomes a valid reference to the corresponding
 // Three.js object. In particular, it attempts to do the same munging of GLTF
@@ -200,6 +456,13 @@ function fixupModelLink(link) {
   return {
     name: THREE.PropertyBinding.sanitizeNodeName(link.name),
     ref: link.ref,
+    node: link.node, // the index of the GLTF node, if the build resolved it
+    // The bounds of the node's hitbox, their center, and the way it faces,
+    // in the model's own space, if the build worked them out.
+    min: link.min,
+    max: link.max,
+    center: link.center,
+    normal: link.normal,
   };
 }
 
@@ -211,6 +474,19 @@ function ModelLinkSelector(modelLinks) {
   this.modelLinks = modelLinks.map(fixupModelLink);
   this.selection = null; // the currently-selected object
   this.selectedDiv = null; // the currently-selected annotation
+
+  // Index the links by object name and by text ID, so that we can look
+  // them up quickly when something is clicked.
+  this.linksByName = new Map();
+  this.linksByRef = new Map();
+  this.modelLinks.forEach((link) => {
+    if (!this.linksByName.has(link.name)) {
+      this.linksByName.set(link.name, link);
+    }
+    if (!this.linksByRef.has(link.ref)) {
+      this.linksByRef.set(link.ref, link);
+    }
+  });
 }
 
 // ModelLinkSelector.clearSelection clears the currently-selected object,
@@ -240,87 +516,167 @@ ModelLinkSelector.prototype.select = function select(link) {
   }
 };
 
+// ModelLinkSelector.findLinkedObjects returns a Promise that resolves to the
+// object each link refers to, in the loaded GLTF model (or undefined, if
+// there isn't one). The build tells us the index of each link's node, so we
+// can ask the loader for it directly. Links without an index (e.g. if the
+// build couldn't read the model) are found by name.
+ModelLinkSelector.prototype.findLinkedObjects = function findLinkedObjects(gltf) {
+  let objectsByName = null;
+  return Promise.all(this.modelLinks.map((link) => {
+    if (link.node !== undefined) {
+      return gltf.parser.getDependency('node', link.node);
+    }
+    if (!objectsByName) {
+      objectsByName = new Map();
+      gltf.scene.traverse((child) => { objectsByName.set(child.name, child); });
+    }
+    return objectsByName.get(link.name);
+  }));
+};
+
 // ModelLinkSelector.initLinks makes transparent and hides all of the regions
 // in the model that have links associated with them, so that their initial
-// state is deselected.
-ModelLinkSelector.prototype.initLinks = function initLinks(modelScene) {
-  const foundLinks = {};
-  modelScene.traverse((child) => {
-    for (let i = 0; i < this.modelLinks.length; i += 1) {
-      if (this.modelLinks[i].name === child.name) {
-        foundLinks[child.name] = this.modelLinks[i];
-        // Remember this model object so we can quickly select it
-        // if someone clicks on a link in the text section.
-        this.modelLinks[i].obj = child;
-        // Clone the material to ensure each hitbox has its own
-        // independently-controllable opacity. Otherwise, multiple
-        // hitboxes may get highlighted when one gets selected.
-        child.material = child.material.clone();
-        child.material.transparent = true;
-        child.material.opacity = 0.0;
+// state is deselected. It returns a Promise that resolves once that's done.
+ModelLinkSelector.prototype.initLinks = function initLinks(gltf) {
+  return this.findLinkedObjects(gltf).then((objects) => {
+    objects.forEach((obj, i) => {
+      const link = this.modelLinks[i];
+      if (!obj) {
+        console.warn('Broken link: ', link);
+        return;
       }
-    }
+      // Remember this model object so we can quickly select it
+      // if someone clicks on a link in the text section.
+      link.obj = obj;
+      // Clone the material to ensure each hitbox has its own
+      // independently-controllable opacity. Otherwise, multiple
+      // hitboxes may get highlighted when one gets selected.
+      obj.material = obj.material.clone();
+      obj.material.transparent = true;
+      obj.material.opacity = 0.0;
+    });
   });
-  for (let i = 0; i < this.modelLinks.length; i += 1) {
-    if (!Object.prototype.hasOwnProperty.call(foundLinks, this.modelLinks[i].name)) {
-      console.warn('Broken link: ', this.modelLinks[i]);
-    }
-  }
 };
 
 ModelLinkSelector.prototype.findLinkByModelObj = function findLinkByModelObj(obj) {
   if (!obj) {
     return null;
   }
-  for (let i = 0; i < this.modelLinks.length; i += 1) {
-    if (this.modelLinks[i].obj.name === obj.name) {
-      return this.modelLinks[i];
-    }
-  }
-  return null;
+  return this.linksByName.get(obj.name) || null;
 };
 
 ModelLinkSelector.prototype.findLinkByRef = function findLinkByRef(textId) {
-  for (let i = 0; i < this.modelLinks.length; i += 1) {
-    if (this.modelLinks[i].ref === textId) {
-      return this.modelLinks[i];
-    }
-  }
-  return null;
+  return this.linksByRef.get(textId) || null;
 };
 
-// ModelController manages a model and its viewer.
-function ModelController(modelName, modelLinks) {
+// textureVariantURL rewrites the URL of an image that the build published on
+// its own (see tools/build/textures.py) to that of its variant of the given
+// size. Other URLs are returned as they are.
+function textureVariantURL(url, size) {
+  return url.replace(/((?:^|\/)textures\/[0-9a-f]+)(\.\w+)$/, `$1.${size}$2`);
+}
+
+// primitiveMeshes returns the meshes that draw the primitives of a GLTF
+// node's mesh, given the object GLTFLoader made of the node. A mesh with one
+// primitive is the node's object itself; for more, GLTFLoader makes a group
+// whose first children are the primitives' meshes.
+function primitiveMeshes(gltf, nodeIndex, obj) {
+  const nodeDef = gltf.parser.json.nodes[nodeIndex];
+  if (nodeDef.mesh === undefined) {
+    return [];
+  }
+  if (obj.isMesh) {
+    return [obj];
+  }
+  const count = gltf.parser.json.meshes[nodeDef.mesh].primitives.length;
+  return obj.children.slice(0, count).filter((child) => child.isMesh);
+}
+
+// ModelController manages a model and its viewer. modelLods lists simplified
+// levels of detail of the model (see tools/build/lod.py), coarsest first.
+// The coarsest is shown as soon as it loads, and each finer one replaces it
+// as it arrives, ending with the model itself. textureSizes lists the sizes
+// of the variants of the model's textures, if the build made any,
+// bvhName is the URL of the HitboxBVH of the model's hitboxes, if any, and
+// modelOffset is how far to move the model to centre it, if the build
+// knows (see ModelViewer.setModel).
+function ModelController(modelName, modelLinks, modelLods, textureSizes, bvhName, modelOffset) {
 
   this.loadingScreen = new LoadingScreen();
+  this.modelOffset = modelOffset || null;
   this.viewer = new ModelViewer();
+  this.textureSize = this.viewer.chooseTextureSize(textureSizes || []);
   this.selector = new ModelLinkSelector(modelLinks);
   this.viewer.domElement.addEventListener('click', (e) => { this.onViewerClick(e); }, false);
-  this.loadModel(modelName).then((modelScene) => {
-    this.selector.initLinks(modelScene);
-  }).catch((error) => {
-    console.error('Error loading model: ', error);
-  });
+  const models = (modelLods || []).concat([modelName]);
+  const linksReady = this.loadModel(models[0]).then((gltf) => this.selector.initLinks(gltf).then(() => gltf));
+  if (bvhName) {
+    this.loadHitboxes(bvhName, linksReady);
+  }
+  linksReady
+    .then((gltf) => {
+      this.viewer.requestRender();
+      return this.refineModel(gltf, models.slice(1));
+    })
+    .catch((error) => {
+      console.error('Error loading model: ', error);
+    });
   const textToModelLinks = document.getElementsByClassName('model-link');
   for (let i = 0; i < textToModelLinks.length; i += 1) {
     textToModelLinks[i].addEventListener('click', (e) => { this.onTextLinkClick(e); }, false);
   }
 }
 
+// ModelController.loadHitboxes fetches the HitboxBVH at the given URL, and
+// once linksReady resolves (when the links have found their objects), has
+// the viewer pick hitboxes with it. If it can't be loaded, the viewer goes
+// on picking from the whole scene.
+ModelController.prototype.loadHitboxes = function loadHitboxes(bvhName, linksReady) {
+  const bvhReady = fetch(bvhName).then((response) => {
+    if (!response.ok) {
+      throw new Error(`${response.status} ${response.statusText}`);
+    }
+    return response.arrayBuffer();
+  }).then((buffer) => new HitboxBVH(buffer));
+  Promise.all([bvhReady, linksReady]).then(([bvh]) => {
+    const objects = new Map();
+    this.selector.modelLinks.forEach((link) => {
+      if (link.obj && link.node !== undefined) {
+        objects.set(link.node, link.obj);
+      }
+    });
+    this.viewer.hitboxes = { bvh, objects };
+  }).catch((error) => {
+    console.warn('Error loading hitbox BVH: ', bvhName, error);
+  });
+};
+
+// ModelController.makeLoader returns a GLTF loader that loads the variants of
+// textures that we chose, if any.
+ModelController.prototype.makeLoader = function makeLoader() {
+  const manager = new THREE.LoadingManager();
+  if (this.textureSize) {
+    manager.setURLModifier((url) => textureVariantURL(url, this.textureSize));
+  }
+  return new THREE.GLTFLoader(manager);
+};
+
 // ModelController.loadModel loads a GLTF model file with the given URL, and
 // updates the global model viewer and loading screen accordingly. The loaded
 // scene is added as a child to the viewer's scene graph. loadModel returns
-// a Promise that resolves to the loaded scene, or if the loading results in
-// an error, it rejects the promise with an error.
+// a Promise that resolves to the loaded GLTF (whose scene property is the
+// loaded scene), or if the loading results in an error, it rejects the
+// promise with an error.
 ModelController.prototype.loadModel = function loadModel(modelname) {
-  const loader = new THREE.GLTFLoader();
+  const loader = this.makeLoader();
   this.loadingScreen.show();
   return new Promise((resolve, reject) => {
     loader.load(modelname,
       (object) => {
         this.loadingScreen.hide();
-        this.viewer.setModel(object.scene);
-        resolve(object.scene);
+        this.viewer.setModel(object.scene, this.modelOffset);
+        resolve(object);
       },
       (xhr) => {
         const loaded = Math.round(xhr.loaded / xhr.total * 100);
@@ -332,11 +688,76 @@ ModelController.prototype.loadModel = function loadModel(modelname) {
       });
   });
 };
-ModelController.prototype.moveCameraToFace = function moveCamera(selectedface,selection){
-  var cameralookatpoint =  new THREE.Vector3();
-  var boundingbox =  new THREE.Box3();
-  boundingbox.setFromObject(selection);
-  boundingbox.getCenter(cameralookatpoint);
+
+// ModelController.refineModel loads each of the given finer versions of the
+// displayed model in turn, in the background, swapping each one's meshes
+// into the displayed model as it arrives. The displayed model stays put, so
+// the selection, the camera and the links are unaffected. If a version
+// fails to load, we carry on with the next.
+ModelController.prototype.refineModel = function refineModel(displayed, modelnames) {
+  if (!modelnames.length) {
+    return Promise.resolve(displayed);
+  }
+  const loader = this.makeLoader();
+  return new Promise((resolve, reject) => {
+    loader.load(modelnames[0], resolve, undefined, reject);
+  }).then((finer) => this.swapMeshes(displayed, finer), (error) => {
+    console.warn('Error loading finer model: ', modelnames[0], error);
+  }).then(() => this.refineModel(displayed, modelnames.slice(1)));
+};
+
+// ModelController.swapMeshes replaces the geometry of the displayed model
+// with that of a finer version of it. Every version of a model has the same
+// nodes, so we can match them up by index. The displayed model's materials
+// are kept, since they have the same textures, and the links' hitboxes
+// aren't simplified, so their meshes are left alone.
+ModelController.prototype.swapMeshes = function swapMeshes(displayed, finer) {
+  const links = new Set(this.selector.modelLinks.map((link) => link.obj));
+  const nodes = displayed.parser.json.nodes || [];
+  return Promise.all(nodes.map((node, i) => Promise.all([
+    displayed.parser.getDependency('node', i),
+    finer.parser.getDependency('node', i),
+  ]))).then((pairs) => {
+    pairs.forEach(([obj, finerObj], i) => {
+      // Packed models fold the scale of their quantized positions into
+      // their node transforms (and undo it in their children's), which
+      // differ from version to version, so even hitboxes need these.
+      obj.position.copy(finerObj.position);
+      obj.quaternion.copy(finerObj.quaternion);
+      obj.scale.copy(finerObj.scale);
+      if (links.has(obj)) {
+        return;
+      }
+      const meshes = primitiveMeshes(displayed, i, obj);
+      const finerMeshes = primitiveMeshes(finer, i, finerObj);
+      meshes.forEach((mesh, j) => {
+        if (finerMeshes[j]) {
+          mesh.geometry.dispose();
+          mesh.geometry = finerMeshes[j].geometry;
+        }
+      });
+    });
+    finer.scene.traverse((child) => {
+      if (child.isMesh) {
+        [].concat(child.material).forEach((material) => material.dispose());
+      }
+    });
+    this.viewer.requestRender();
+  });
+};
+
+// ModelController.hitboxCenter returns the center of a link's hitbox, in
+// world space. The build works it out if it can, so that we don't have to
+// go through the hitbox's vertices.
+ModelController.prototype.hitboxCenter = function hitboxCenter(link) {
+  if (link.center) {
+    return new THREE.Vector3().fromArray(link.center).applyMatrix4(this.viewer.modelScene.matrixWorld);
+  }
+  return new THREE.Box3().setFromObject(link.obj).getCenter(new THREE.Vector3());
+};
+
+ModelController.prototype.moveCameraToFace = function moveCamera(selectedface,link){
+  var cameralookatpoint = this.hitboxCenter(link);
   var cam_altitude = this.viewer.camera.position.distanceTo(this.viewer.controls.target)
   var newnormal = (selectedface.normal.clone().multiplyScalar(cam_altitude))
   var cameramovepoint = this.viewer.controls.target.clone().add(newnormal)
@@ -344,7 +765,19 @@ ModelController.prototype.moveCameraToFace = function moveCamera(selectedface,se
   this.viewer.camera.lookAt(cameralookatpoint)
   this.viewer.controls.update()
 }
-ModelController.prototype.moveCameraToObject = function moveCamera(selection){
+// ModelController.moveCameraToObject moves the camera around the model to
+// look at a link's hitbox. If the build told us which way the hitbox faces,
+// we look at it head on; otherwise, from the direction of its center.
+ModelController.prototype.moveCameraToObject = function moveCamera(link){
+  if (link.normal) {
+    // setModel has centered the model on the origin.
+    var normal = new THREE.Vector3().fromArray(link.normal).transformDirection(this.viewer.modelScene.matrixWorld);
+    var radius = this.viewer.camera.position.length();
+    this.viewer.camera.position.copy(normal.multiplyScalar(radius));
+    this.viewer.controls.update();
+    return;
+  }
+  var selection = link.obj;
   var boundingbox = new THREE.Box3();
   boundingbox.setFromObject(selection);
   var projection_vector = new THREE.Vector3();
@@ -388,8 +821,9 @@ ModelController.prototype.onViewerClick = function onViewerClick(e) {
     const link = this.selector.findLinkByModelObj(intersectedObject["object"]);
     if (link) {
       this.selector.select(link);
-      this.moveCameraToFace(intersectedObject["face"], intersectedObject["object"]);
+      this.moveCameraToFace(intersectedObject["face"], link);
     }
+    this.viewer.requestRender();
   }
 };
 
@@ -401,17 +835,24 @@ ModelController.prototype.onTextLinkClick = function onTextLinkClick(e) {
     console.error('Error: no model link corresponding to text ID: ', textId);
     return;
   }
-  this.moveCameraToObject(link.obj)
+  this.moveCameraToObject(link)
   this.selector.select(link);
+  this.viewer.requestRender();
 };
 
-// ModelController.run starts the update/render loop for the model
-// and viewer.
+// ModelController.run starts drawing the model. The viewer draws on demand,
+// unless the page's URL says otherwise: with ?stats, it shows frame stats
+// (which scripts can read from window.viewerStats.summary()), and with
+// ?render=continuous, it draws every frame.
 ModelController.prototype.run = function run() {
-  const self = this;
-  (function gameLoop() {
-    requestAnimationFrame(gameLoop);
-    self.viewer.update();
-    self.viewer.render();
-  }());
+  const params = new URLSearchParams(window.location.search);
+  if (params.has('stats')) {
+    this.viewer.stats = new FrameStats(this.viewer);
+    window.viewerStats = this.viewer.stats;
+  }
+  if (params.get('render') === 'continuous') {
+    this.viewer.runContinuously();
+  } else {
+    this.viewer.requestRender();
+  }
 };
@@ -0,0 +1,232 @@
+/* eslint no-bitwise: "off" */
+
+// search.js searches the texts of every page, with the index the build
+// makes (see tools/build/search.py). The index is split into shards by the
+// prefixes of its terms, and each shard is only fetched once a query needs
+// it.
+
+// searchTerms splits text into the terms the index has, the same way as
+// tools/build/search.py: lower case, without accents or diacritics.
+function searchTerms(text) {
+  return text.normalize('NFD').replace(/\p{Mn}/gu, '').toLowerCase()
+    .match(/[\p{L}\p{N}]+/gu) || [];
+}
+
+// decodeShard decodes a shard of the index into a Map from each of its
+// terms to the documents it's in: an array of [document, field mask] pairs.
+function decodeShard(buffer) {
+  const header = new DataView(buffer, 0, 12);
+  if (header.getUint32(0, true) !== SearchIndex.MAGIC || header.getUint32(4, true) !== SearchIndex.VERSION) {
+    throw new Error('not a search index shard, or not one we understand');
+  }
+  const termCount = header.getUint32(8, true);
+  const bytes = new Uint8Array(buffer, 12);
+  let pos = 0;
+  const varint = () => {
+    let value = 0;
+    let scale = 1;
+    let byte;
+    do {
+      byte = bytes[pos];
+      pos += 1;
+      value += (byte & 0x7f) * scale;
+      scale *= 128;
+    } while (byte & 0x80);
+    return value;
+  };
+
+  const decoder = new TextDecoder();
+  const terms = new Map();
+  let previous = new Uint8Array(0);
+  for (let i = 0; i < termCount; i += 1) {
+    // Terms are front-coded: they start with the same bytes as the last.
+    const shared = varint();
+    const length = varint();
+    const term = new Uint8Array(shared + length);
+    term.set(previous.subarray(0, shared));
+    term.set(bytes.subarray(pos, pos + length), shared);
+    pos += length;
+    const count = varint();
+    const postings = new Array(count);
+    let doc = 0;
+    for (let j = 0; j < count; j += 1) {
+      doc += varint();
+      postings[j] = [doc, varint()];
+    }
+    terms.set(decoder.decode(term), postings);
+    previous = term;
+  }
+  return terms;
+}
+
+// SearchIndex queries the search index whose index.json is at the given URL.
+function SearchIndex(url) {
+  this.url = url;
+  this.base = url.slice(0, url.lastIndexOf('/') + 1);
+  this.index = null; // a Promise of the index.json
+  this.shards = new Map(); // prefix -> a Promise of the decoded shard
+}
+
+SearchIndex.MAGIC = 0x31584953;
+SearchIndex.VERSION = 1;
+SearchIndex.MAX_RESULTS = 50;
+
+// How much a match in each field counts for, in ranking results.
+SearchIndex.WEIGHTS = {
+  name: 8,
+  desc: 4,
+  tr: 2,
+  al: 2,
+  hi: 2,
+  description: 1,
+};
+
+function fetchOk(url) {
+  return fetch(url).then((response) => {
+    if (!response.ok) {
+      throw new Error(`${url}: ${response.status} ${response.statusText}`);
+    }
+    return response;
+  });
+}
+
+// SearchIndex.load fetches the index.json, once.
+SearchIndex.prototype.load = function load() {
+  if (!this.index) {
+    this.index = fetchOk(this.url).then((response) => response.json()).then((index) => {
+      if (index.version !== SearchIndex.VERSION) {
+        throw new Error(`search index version ${index.version}, not ${SearchIndex.VERSION}`);
+      }
+      return Object.assign(index, { prefixes: Object.keys(index.shards) });
+    });
+  }
+  return this.index;
+};
+
+// SearchIndex.loadShard fetches and decodes the shard with the given prefix,
+// once.
+SearchIndex.prototype.loadShard = function loadShard(index, prefix) {
+  if (!this.shards.has(prefix)) {
+    this.shards.set(prefix, fetchOk(this.base + index.shards[prefix])
+      .then((response) => response.arrayBuffer())
+      .then(decodeShard));
+  }
+  return this.shards.get(prefix);
+};
+
+// SearchIndex.shardsFor lists the prefixes of the shards that the given
+// term is in: the one with the longest prefix of it. If isPrefix, it's the
+// start of a term, so the shards of the terms that start with it, too.
+SearchIndex.prototype.shardsFor = function shardsFor(index, term, isPrefix) {
+  let longest = null;
+  const prefixes = [];
+  index.prefixes.forEach((prefix) => {
+    if (term.startsWith(prefix)) {
+      if (longest === null || prefix.length > longest.length) {
+        longest = prefix;
+      }
+    } else if (isPrefix && prefix.startsWith(term)) {
+      prefixes.push(prefix);
+    }
+  });
+  if (longest !== null) {
+    prefixes.push(longest);
+  }
+  return prefixes;
+};
+
+// SearchIndex.lookup resolves to a Map from each document the given term
+// (or with isPrefix, any term that starts with it) is in to the fields it's
+// in there.
+SearchIndex.prototype.lookup = function lookup(index, term, isPrefix) {
+  const shards = this.shardsFor(index, term, isPrefix).map((prefix) => this.loadShard(index, prefix));
+  return Promise.all(shards).then((decoded) => {
+    const docs = new Map();
+    const add = (postings) => {
+      postings.forEach(([doc, fields]) => docs.set(doc, (docs.get(doc) || 0) | fields));
+    };
+    decoded.forEach((terms) => {
+      if (!isPrefix) {
+        add(terms.get(term) || []);
+        return;
+      }
+      terms.forEach((postings, t) => {
+        if (t.startsWith(term)) {
+          add(postings);
+        }
+      });
+    });
+    return docs;
+  });
+};
+
+// SearchIndex.search resolves to the documents that have every word of the
+// query, best first, as { href, page, label } objects. The last word may be
+// the start of one, as it's being typed.
+SearchIndex.prototype.search = function search(query) {
+  const words = searchTerms(query);
+  if (!words.length) {
+    return Promise.resolve([]);
+  }
+  const typing = !/\s$/.test(query);
+  return this.load().then((index) => Promise.all(words.map(
+    (word, i) => this.lookup(index, word, typing && i === words.length - 1),
+  )).then((matches) => {
+    const scores = new Map();
+    matches[0].forEach((fields, doc) => {
+      if (matches.every((docs) => docs.has(doc))) {
+        scores.set(doc, matches.reduce((score, docs) => score + this.score(index, docs.get(doc)), 0));
+      }
+    });
+    return Array.from(scores.keys())
+      .sort((a, b) => scores.get(b) - scores.get(a) || a - b)
+      .slice(0, SearchIndex.MAX_RESULTS)
+      .map((doc) => {
+        const [pageNum, id, label] = index.docs[doc];
+        const page = index.pages[pageNum];
+        return { href: id ? `${page.href}#${id}` : page.href, page: page.name, label };
+      });
+  }));
+};
+
+// SearchIndex.score says how good a match in the given fields is.
+SearchIndex.prototype.score = function score(index, fields) {
+  return Object.keys(index.fields).reduce(
+    (total, field) => total + ((fields & index.fields[field]) ? (SearchIndex.WEIGHTS[field] || 1) : 0), 0,
+  );
+};
+
+// SearchBox searches the given SearchIndex as the user types in the input
+// element, listing the results in the list element.
+function SearchBox(input, list, index) {
+  this.input = input;
+  this.list = list;
+  this.index = index;
+  this.query = null; // the query whose results are wanted
+  this.input.addEventListener('input', () => { this.update(); }, false);
+}
+
+SearchBox.prototype.update = function update() {
+  const query = this.input.value;
+  this.query = query;
+  this.index.search(query).then((results) => {
+    // Results can arrive out of order; only show the latest query's.
+    if (this.query === query) {
+      this.show(results);
+    }
+  }).catch((error) => {
+    console.error('Error searching: ', error);
+  });
+};
+
+SearchBox.prototype.show = function show(results) {
+  this.list.textContent = '';
+  results.forEach((result) => {
+    const item = document.createElement('li');
+    const link = document.createElement('a');
+    link.href = result.href;
+    link.textContent = result.label && result.label !== result.page ? `${result.page}: ${result.label}` : result.page;
+    item.appendChild(link);
+    this.list.appendChild(item);
+  });
+};
@@ -0,0 +1,436 @@
+"""Benchmark how build.py scales with the size of the site.
+
+Run from the top of the repo:
+
+    python -m tools.bench.buildscale                        # 10, 100 and 500 pages
+    python -m tools.bench.buildscale --pages 1000 --frags 32
+    python -m tools.bench.buildscale --save-baseline        # record a baseline
+    python -m tools.bench.buildscale                        # ...and later compare with it
+
+Each case generates a synthetic site in the work directory, modelled on
+src/template.xml: N pages, each with M text fragments (and a model link and
+hieroglyph image for each), a given fraction of whose transliterations are
+in MdC, and dummy glTF models and SVG images to go with them. The build is
+then run on it in a fresh process, once from scratch and once again
+incrementally with nothing changed, with --profile, so that we can report
+where the time goes.
+
+By default, the external tools are stubbed out: validation always passes,
+and BuildSite writes empty HTML files. That measures our own pipeline, and
+works without Java or XML Starlet. Use --tools real to run them too.
+
+Results are compared with the baseline file, if there is one, and any
+measurement that is worse than the baseline by more than the threshold is
+reported as a regression, with a non-zero exit status. Timings depend on
+the machine, so baselines are only comparable on the machine that made them.
+"""
+
+import argparse
+import base64
+import copy
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from tools.build import gltf
+from tools.build.profile import Profiler
+
+logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='%(levelname)s: %(message)s')
+log = logging.getLogger(__name__)
+
+BASELINE_VERSION = 1
+
+# Template text fragments are grouped into texts of this many fragments.
+FRAGS_PER_TEXT = 4
+
+MDC_LETTERS = 'AaiywbpfmnrhHxXzsSqkgtTdD'
+UNICODE_LETTERS = 'ꜣꜥỉywbpfmnrhḥḫẖzsšḳkgtṯdḏ'
+
+# Build config paths that point at the repo's tools, rather than into the site.
+TOOL_PATHS = ['buildsitejarpath', 'saxonjarpath', 'stylesheetdir', 'ngsiteschema', 'ngpageschema',
+              'site2html', 'page2html', 'staticdir']
+
+# The measurements we compare with the baseline. Lower is better for all of them.
+METRICS = ['full_s', 'incremental_s', 'peak_rss_mb']
+
+# Timing differences smaller than this are noise, whatever the threshold.
+MIN_TIME_DIFFERENCE = 0.05
+
+
+def word(rng, letters):
+    return ''.join(rng.choice(letters) for _ in range(rng.randint(2, 7)))
+
+
+def transliteration(rng, mdc, nwords=12):
+    """Make up a transliteration, in MdC (with the odd suffix pronoun and restoration) or Unicode."""
+    words = []
+    for _ in range(nwords):
+        w = word(rng, MDC_LETTERS if mdc else UNICODE_LETTERS)
+        if mdc and rng.random() < 0.2:
+            w += '=f'
+        if mdc and rng.random() < 0.05:
+            w = '<' + w + '>'
+        words.append(w)
+    return ' '.join(words)
+
+
+def caseName(ns, npages, nfrags):
+    name = f'{npages}p-{nfrags}f-{ns.density:g}mdc-{ns.tools}'
+    if ns.packmodels:
+        name += '-packed'
+    return name
+
+
+def makePage(template, slug, nfrags, density, rng):
+    """Make a page from the template, with nfrags fragments, each linked to a hitbox in the model."""
+    page = copy.deepcopy(template)
+    page.set('dest', f'{slug}.html')
+    page.find('name').text = f'Synthetic coffin {slug}'
+    page.find('creator').text = 'tools.bench.buildscale'
+    page.find('description/contents/p').text = ' '.join(word(rng, 'abcdefghijklmnopqrstuvwxyz') for _ in range(80))
+    for fn in page.iter('fn'):
+        fn.text = 'A footnote.'
+
+    model = page.find('model')
+    model.set('src', f'${{assets}}/{slug}/{slug}.gltf')
+    model.set('dest', f'models/{slug}.gltf')
+    protolink = model.find('link')
+    for link in model.findall('link'):
+        model.remove(link)
+
+    texts = page.find('texts')
+    prototext = next(t for t in texts.findall('text') if t.find('frag') is not None)
+    protofrag = prototext.find('frag')
+    for text in texts.findall('text'):
+        texts.remove(text)
+
+    text = None
+    for j in range(nfrags):
+        textnum, colnum = divmod(j, FRAGS_PER_TEXT)
+        if colnum == 0:
+            text = copy.deepcopy(prototext)
+            for frag in text.findall('frag'):
+                text.remove(frag)
+            text.set('id', f'text{textnum + 1}')
+            text.find('desc').text = f'Text {textnum + 1}'
+            texts.append(text)
+
+        fragid = f'text{textnum + 1}col{colnum + 1}'
+        frag = copy.deepcopy(protofrag)
+        frag.set('id', fragid)
+        frag.find('himg').set('src', f'${{assets}}/{slug}/texts/{fragid}.svg')
+        frag.find('himg').set('dest', f'img/{slug}_{fragid}.svg')
+        frag.find('hi').text = 'A1-B1'
+        mdc = rng.random() < density
+        frag.find('al').set('encoding', 'mdc' if mdc else 'unicode')
+        frag.find('al').text = transliteration(rng, mdc)
+        frag.find('tr').text = ' '.join(word(rng, 'abcdefghijklmnopqrstuvwxyz') for _ in range(12))
+        text.append(frag)
+
+        link = copy.deepcopy(protolink)
+        link.set('name', f'hitbox_{j}')
+        link.set('ref', fragid)
+        model.append(link)
+    return page
+
+
+def writeModel(path, nfrags, triangles):
+    """Write a glTF model with a grid mesh of roughly the given size, and a box hitbox for each fragment."""
+    side = max(2, int((triangles / 2) ** 0.5) + 1)
+    u, v = np.meshgrid(np.linspace(0, 1, side), np.linspace(0, 1, side))
+    positions = np.stack([u.ravel(), np.sin(u.ravel() * 3) * 0.1, v.ravel()], axis=1).astype(np.float32)
+    quads = np.array([(r * side + c) for r in range(side - 1) for c in range(side - 1)], dtype=np.uint32)
+    indices = np.stack([quads, quads + 1, quads + side, quads + 1, quads + side + 1, quads + side], axis=1)
+
+    box = np.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], dtype=np.float32) * 0.05
+    boxindices = np.array([0, 1, 3, 0, 3, 2, 4, 6, 7, 4, 7, 5, 0, 4, 5, 0, 5, 1,
+                           2, 3, 7, 2, 7, 6, 0, 2, 6, 0, 6, 4, 1, 5, 7, 1, 7, 3], dtype=np.uint16)
+
+    writer = gltf.GltfWriter()
+    coffin = {'attributes': {'POSITION': writer.addAccessor(positions, target=gltf.ARRAY_BUFFER, minmax=True)},
+              'indices': writer.addAccessor(indices.ravel(), target=gltf.ELEMENT_ARRAY_BUFFER)}
+    hitbox = {'attributes': {'POSITION': writer.addAccessor(box, target=gltf.ARRAY_BUFFER, minmax=True)},
+              'indices': writer.addAccessor(boxindices, target=gltf.ELEMENT_ARRAY_BUFFER)}
+    nodes = [{'name': 'coffin', 'mesh': 0, 'children': list(range(1, nfrags + 1))}]
+    nodes += [{'name': f'hitbox_{j}', 'mesh': 1, 'translation': [(j % 10) / 10, 0.2, (j // 10) / 10]}
+              for j in range(nfrags)]
+
+    datauri = 'data:application/octet-stream;base64,' + base64.b64encode(writer.data).decode('ascii')
+    doc = {
+        'asset': {'version': '2.0', 'generator': 'tools.bench.buildscale'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': nodes,
+        'meshes': [{'primitives': [coffin]}, {'primitives': [hitbox]}],
+        'accessors': writer.accessors,
+        'bufferViews': writer.bufferViews,
+        'buffers': [{'uri': datauri, 'byteLength': len(writer.data)}],
+    }
+    with open(path, 'w') as f:
+        json.dump(doc, f)
+
+
+def writeSvg(path, rng):
+    paths = ''.join(f'<path d="M{rng.randint(0, 90)} {rng.randint(0, 290)} l5 5 l-5 5 z"/>' for _ in range(40))
+    with open(path, 'w') as f:
+        f.write(f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 300">{paths}</svg>\n')
+
+
+def writeBuildConfig(sitedir):
+    """Write a build_config.xml for the site, pointing at the repo's tools."""
+    doc = ET.parse('build_config.xml')
+    site = doc.getroot().find('site')
+    for e in site:
+        if e.tag in TOOL_PATHS:
+            e.text = os.path.abspath(e.text.strip())
+    site.find('assetsdir').text = os.path.join(sitedir, 'assets')
+    doc.write(os.path.join(sitedir, 'build_config.xml'), encoding='utf-8', xml_declaration=True)
+
+
+def generateSite(sitedir, npages, nfrags, density, triangles, seed=0):
+    """Generate a synthetic site in sitedir, replacing whatever was there."""
+    if os.path.exists(sitedir):
+        shutil.rmtree(sitedir)
+    rng = random.Random(seed)
+    srcdir = os.path.join(sitedir, 'src')
+    os.makedirs(srcdir)
+    writeBuildConfig(sitedir)
+    for name in os.listdir('src'):
+        if name.endswith('.js'):
+            shutil.copy(os.path.join('src', name), srcdir)
+
+    template = ET.parse(os.path.join('src', 'template.xml')).getroot()
+    site = ET.Element('site')
+    for i in range(npages):
+        slug = f'bench{i:04d}'
+        page = makePage(template, slug, nfrags, density, rng)
+        ET.ElementTree(page).write(os.path.join(srcdir, slug + '.xml'), encoding='utf-8', xml_declaration=True)
+        ET.SubElement(site, 'page', href=slug + '.xml')
+
+        assetdir = os.path.join(sitedir, 'assets', slug)
+        os.makedirs(os.path.join(assetdir, 'texts'))
+        writeModel(os.path.join(assetdir, slug + '.gltf'), nfrags, triangles)
+        for frag in page.iter('frag'):
+            writeSvg(os.path.join(assetdir, 'texts', frag.get('id') + '.svg'), rng)
+    ET.ElementTree(site).write(os.path.join(srcdir, 'site.xml'), encoding='utf-8', xml_declaration=True)
+
+
+def stubTools():
+    """Stub out Java and XML Starlet, for builds run by runBuild."""
+    from tools.build import config, xmltoolbox
+
+    class StubToolbox(xmltoolbox.XMLToolbox):
+        def __init__(self, config, profiler=None):
+            super(StubToolbox, self).__init__(config, profiler=profiler)
+            self.config = config
+
+        def validateNGSchemaBatch(self, schema, targets):
+            return {}
+
+        def supports(self, option):
+            # We stand in for a JAR built from the current sources.
+            return True
+
+        def _runBuildSite(self, cmd, cwd=None):
+            # Write empty HTML where BuildSite would, given the same arguments.
+            args = cmd[3:]
+            site = config.loadConfigFromFile(os.path.join(cwd or os.curdir, 'build_config.xml'))
+            distdir, index = site.distdir, site.distindexhtml
+            if '--distdir' in args:
+                i = args.index('--distdir')
+                index = os.path.join(args[i + 1], os.path.relpath(index, distdir))
+                distdir = args[i + 1]
+                del args[i:i + 2]
+            if '--threads' in args:
+                i = args.index('--threads')
+                del args[i:i + 2]
+            if args[:1] == ['--pages']:
+                pages = args[1:]
+            else:
+                pages = [page.get('href') for page in ET.parse(self.config.buildsitexml).getroot().iter('page')]
+            with open(index, 'w') as f:
+                f.write('<html></html>\n')
+            for page in pages:
+                _, root = next(ET.iterparse(os.path.join(self.config.builddir, page), events=['start']))
+                with open(os.path.join(distdir, root.get('dest')), 'w') as f:
+                    f.write('<html></html>\n')
+
+    xmltoolbox.XMLToolbox = StubToolbox
+    config.resolveToolLocations = lambda config: None
+    config.Config.javapath = config.Config.xmlstarletpath = ''
+
+
+def maxRssMb(who):
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+def runBuild(sitedir, incremental, tools, packmodels):
+    """Run build.py on a synthetic site, in this process. Prints a JSON summary of the run."""
+    if tools == 'stub':
+        stubTools()
+    import build
+
+    logging.getLogger().setLevel(logging.WARNING)
+    args = [os.path.join(sitedir, 'build.py'), '--profile']
+    if incremental:
+        args.append('-i')
+    if packmodels:
+        args.append('--pack-models')
+    start = time.perf_counter()
+    status = build.main(args)
+    result = {
+        'status': status,
+        'wall_s': time.perf_counter() - start,
+        'peak_rss_mb': maxRssMb(resource.RUSAGE_SELF),
+        'tools_peak_rss_mb': maxRssMb(resource.RUSAGE_CHILDREN),
+    }
+    print(json.dumps(result))
+    return status
+
+
+def measureBuild(sitedir, incremental, ns):
+    """Run a build in a fresh process, returning its summary and its profile."""
+    cmd = [sys.executable, '-m', 'tools.bench.buildscale', '--run-build', sitedir, '--tools', ns.tools]
+    if incremental:
+        cmd.append('--incremental')
+    if ns.packmodels:
+        cmd.append('--pack-models')
+    if not incremental:
+        for d in ('build', 'dist'):
+            shutil.rmtree(os.path.join(sitedir, d), ignore_errors=True)
+    output = subprocess.run(cmd, stdout=subprocess.PIPE, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    if result['status'] != 0:
+        raise RuntimeError(f'Build of {sitedir} failed; rerun it with --run-build {sitedir} to see why')
+    with open(os.path.join(sitedir, 'build', 'profile.json')) as f:
+        profiler = Profiler(enabled=True)
+        profiler.events = [e for e in json.load(f)['traceEvents'] if e['ph'] == 'X']
+    return result, profiler.summary()
+
+
+def runCase(ns, npages, nfrags):
+    name = caseName(ns, npages, nfrags)
+    sitedir = os.path.join(ns.workdir, name)
+    log.info('%s: generating site...', name)
+    generateSite(sitedir, npages, nfrags, ns.density, ns.triangles)
+
+    full = incremental = None
+    for _ in range(ns.rounds):
+        result, stages = measureBuild(sitedir, False, ns)
+        if full is None or result['wall_s'] < full[0]['wall_s']:
+            full = result, stages
+        result, _ = measureBuild(sitedir, True, ns)
+        if incremental is None or result['wall_s'] < incremental['wall_s']:
+            incremental = result
+
+    result, stages = full
+    log.info('%s: full build %.2fs (%.1f pages/s, %.0f frags/s), incremental %.2fs, peak RSS %.0f MB',
+             name, result['wall_s'], npages / result['wall_s'], npages * nfrags / result['wall_s'],
+             incremental['wall_s'], result['peak_rss_mb'])
+    for stage, count, wall, cpu, nbytes in stages[:ns.stages]:
+        log.info('    %-24s %6d %8.3fs %8.3fs cpu', stage, count, wall, cpu)
+    return name, {
+        'pages': npages,
+        'frags_per_page': nfrags,
+        'mdc_density': ns.density,
+        'full_s': round(result['wall_s'], 4),
+        'pages_per_s': round(npages / result['wall_s'], 2),
+        'frags_per_s': round(npages * nfrags / result['wall_s'], 1),
+        'incremental_s': round(incremental['wall_s'], 4),
+        'peak_rss_mb': round(result['peak_rss_mb'], 1),
+        'tools_peak_rss_mb': round(result['tools_peak_rss_mb'], 1),
+        'stages': {stage: round(wall, 4) for stage, count, wall, cpu, nbytes in stages},
+    }
+
+
+def compare(results, baseline, threshold):
+    """Compare results with a baseline, returning a list of regressions."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            log.info('%s: not in the baseline', name)
+            continue
+        for metric in METRICS:
+            old, new = baseline[name][metric], result[metric]
+            if new <= old * (1 + threshold):
+                continue
+            if metric.endswith('_s') and new - old < MIN_TIME_DIFFERENCE:
+                continue
+            regressions.append(f'{name}: {metric} {old:g} -> {new:g} (+{100 * (new / old - 1):.0f}%)')
+    return regressions
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='python -m tools.bench.buildscale')
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 100, 500], help='page counts to try')
+    parser.add_argument('--frags', type=int, nargs='+', default=[8], help='text fragments per page to try')
+    parser.add_argument('--mdc-density', dest='density', type=float, default=0.75,
+                        help='the fraction of transliterations that are in MdC')
+    parser.add_argument('--triangles', type=int, default=5000, help='roughly how many triangles each model has')
+    parser.add_argument('--tools', choices=['stub', 'real'], default='stub',
+                        help='stub out Java and XML Starlet, or run them')
+    parser.add_argument('--pack-models', dest='packmodels', action='store_true', help='build with --pack-models')
+    parser.add_argument('--rounds', type=int, default=3, help='how many times to build each site; we report the best')
+    parser.add_argument('--stages', type=int, default=8, help='how many of the slowest build steps to show')
+    parser.add_argument('--workdir', default='build/bench', help='where to generate the sites')
+    parser.add_argument('--baseline', default='build/bench/buildscale.json', help='baseline results to compare with')
+    parser.add_argument('--save-baseline', dest='savebaseline', action='store_true',
+                        help='save the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='how much worse than the baseline counts as a regression (0.2 = 20%%)')
+    parser.add_argument('--run-build', dest='runbuild', help=argparse.SUPPRESS)
+    parser.add_argument('--incremental', action='store_true', help=argparse.SUPPRESS)
+    ns = parser.parse_args(args[1:])
+
+    if ns.runbuild:
+        return runBuild(ns.runbuild, ns.incremental, ns.tools, ns.packmodels)
+
+    ns.workdir = os.path.abspath(ns.workdir)
+    results = {}
+    for npages in ns.pages:
+        for nfrags in ns.frags:
+            name, result = runCase(ns, npages, nfrags)
+            results[name] = result
+
+    status = 0
+    baseline = None
+    try:
+        with open(ns.baseline) as f:
+            data = json.load(f)
+        if data.get('version') == BASELINE_VERSION:
+            baseline = data['results']
+    except (OSError, ValueError):
+        pass
+    if baseline is not None and not ns.savebaseline:
+        regressions = compare(results, baseline, ns.threshold)
+        for regression in regressions:
+            log.error('Regression: %s', regression)
+        if not regressions:
+            log.info('No regressions against %s.', ns.baseline)
+        status = 1 if regressions else 0
+    elif not ns.savebaseline:
+        log.info('No baseline to compare with; save one with --save-baseline.')
+
+    if ns.savebaseline:
+        if baseline:
+            results = dict(baseline, **results)
+        os.makedirs(os.path.dirname(os.path.abspath(ns.baseline)), exist_ok=True)
+        with open(ns.baseline, 'w') as f:
+            json.dump({'version': BASELINE_VERSION, 'results': results}, f, indent=1)
+        log.info('Saved baseline: %s', ns.baseline)
+    return status
+
+
+if __name__ == '__main__':
+    rv = main(sys.argv)
+    sys.exit(rv)
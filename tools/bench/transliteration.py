@@ -0,0 +1,173 @@
+"""Benchmark and check the MdC -> Unicode transliteration engine.
+
+Run from the top of the repo:
+
+    python -m tools.bench.transliteration           # check, then benchmark
+    python -m tools.bench.transliteration --check   # just check
+
+The check compares convertTransliteration.mdcToUnicode with the chained
+str.replace implementation it replaced (kept here as legacyMdcToUnicode),
+for every BMP character, every pair of characters the mapping touches, and
+every transliteration in src/. The conversion is character by character, so
+that covers every input. It exits with a non-zero status on any difference.
+
+The benchmark times both implementations over the transliterations in src/,
+repeated to make a larger corpus, and times converting whole pages.
+"""
+
+import argparse
+import glob
+import io
+import itertools
+import logging
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+from tools.build import convertTransliteration
+from tools.build.convertTransliteration import mdcToUnicode
+
+logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='%(levelname)s: %(message)s')
+log = logging.getLogger(__name__)
+
+
+def legacyMdcToUnicode(string, q_kopf=True):
+    """The chained-replace implementation that MDC_TO_UNICODE replaced, verbatim."""
+
+    # lettres miniscules/lower case letters/küçük harfler
+    alef = string.replace("\u0041", "\ua723")  # A -> ꜣ
+    ayin = alef.replace("\u0061", "\ua725")  # a -> ꜥ
+    h_dot = ayin.replace("\u0048", "\u1e25")  # H -> ḥ
+    h_breve = h_dot.replace("\u0078", "\u1e2b")  # x -> ḫ
+    h_line = h_breve.replace("\u0058", "\u1e96")  # X -> ẖ
+    h_circum_below = h_line.replace("\u0056", "\u0068" + "\u032d")  # V -> 
+    shin = h_circum_below.replace("\u0053", "\u0161")  # S -> š
+    s_acute = shin.replace("\u0063", "\u015b")  # c -> ś
+    tche = s_acute.replace("\u0054", "\u1e6f")  # T -> ṯ
+    t_circum_below = tche.replace("\u0076", "\u1e71")  # v -> ṱ
+    djed = t_circum_below.replace("\u0044", "\u1e0f")  # D -> ḏ
+    # LOWER CASE YOD
+    # original: egy_yod = djed.replace("\u0069", "\u0069" + "\u0486")  # i -> i҆
+    egy_yod = djed.replace("\u0069", "\u1ec9")  # i -> ỉ
+    # END LOWEr CASE YOD
+    equal = egy_yod.replace("\u003d", "\u2e17")  # = -> ⸗
+    left_brackets = equal.replace("\u003c", "\u2329")  # < -> 〈
+    right_brackets = left_brackets.replace("\u003e", "\u232a")  # > -> 〉
+
+    if q_kopf is False:
+        kopf = right_brackets.replace("\u0071", "\u1e33")  # q -> ḳ
+        kopf_capital = kopf.replace("\u0051", "\u1e32")  # Q -> Ḳ
+    else:
+        kopf_capital = right_brackets
+
+    # LETTRES MAJUSCULES/ UPPER CASE LETTERS/ BÜYÜK HARFLER
+    h2_capital = re.sub("[\u00a1\u0040]", "\u1e24", kopf_capital)  # ¡|@ -> Ḥ
+    h3_capital = re.sub("[\u0023\u00a2]", "\u1e2a", h2_capital)  # #|¢ -> Ḫ
+    h4_capital = re.sub("[\u0024\u00a3]", "\u0048" + "\u0331", h3_capital)  # $|£ -> H̱
+    shin_capital = re.sub("[\u00a5\u005e]", "\u0160", h4_capital)  # ¥|^ -> Š
+    tche_capital = re.sub("[\u002a\u00a7]", "\u1e6e", shin_capital)  # *|§ -> Ṯ
+    djed_capital = re.sub("[\u00a9\u002b]", "\u1e0e", tche_capital)  # ©|+ -> Ḏ
+    # UPPER CASE YOD
+    # original: not handled!
+    egy_yod_capital = djed_capital.replace('\u0049', '\u1ec8')  # I -> Ỉ
+    # END UPPER CASE YOD
+    unicode_text = egy_yod_capital.replace("\u0043", "\u015a")  # C -> Ś
+
+    return unicode_text
+
+
+def corpus(sourcedir):
+    """Collect the MdC transliterations from our page XML."""
+    texts = []
+    for path in sorted(glob.glob(f'{sourcedir}/*.xml')):
+        for al in ET.parse(path).iter('al'):
+            if al.get('encoding') == 'mdc':
+                texts.append(''.join(al.itertext()))
+    return texts
+
+
+def check(texts):
+    """Compare the engine with the legacy implementation. Returns the number of differences."""
+    mapped = set()
+    for q_kopf in (True, False):
+        table = convertTransliteration.translationTable(q_kopf)
+        mapped |= {chr(k) for k in table}
+        for v in table.values():
+            mapped |= set(v)
+    mapped = sorted(mapped)
+
+    singles = (chr(c) for c in range(0x10000) if not 0xd800 <= c < 0xe000)
+    pairs = (a + b for a, b in itertools.product(mapped, repeat=2))
+    differences = 0
+    checked = 0
+    for string in itertools.chain(singles, pairs, texts):
+        for q_kopf in (True, False):
+            checked += 1
+            expected = legacyMdcToUnicode(string, q_kopf=q_kopf)
+            actual = mdcToUnicode.__wrapped__(string, q_kopf=q_kopf)
+            if actual != expected:
+                differences += 1
+                if differences <= 20:
+                    log.error('%r (q_kopf=%s): expected %r, got %r', string, q_kopf, expected, actual)
+    log.info('Checked %d conversions: %d difference(s).', checked, differences)
+    return differences
+
+
+def timeit(fn, texts, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for text in texts:
+            fn(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark(texts, sourcedir, repeat, rounds):
+    big = texts * repeat
+    nchars = sum(len(t) for t in big)
+    log.info('Corpus: %d transliterations (%d distinct), %d characters.', len(big), len(set(big)), nchars)
+
+    results = [
+        ('legacy chained replace', timeit(legacyMdcToUnicode, big, rounds)),
+        ('translation table', timeit(mdcToUnicode.__wrapped__, big, rounds)),
+    ]
+    mdcToUnicode.cache_clear()
+    results.append(('translation table + memo', timeit(mdcToUnicode, big, rounds)))
+    for name, elapsed in results:
+        log.info('%-26s %8.1f ms  %6.2f Mchar/s', name, elapsed * 1000, nchars / elapsed / 1e6)
+
+    pages = {}
+    for path in sorted(glob.glob(f'{sourcedir}/*.xml')):
+        with open(path) as f:
+            pages[path] = f.read()
+
+    def convertPages(_):
+        for data in pages.values():
+            convertTransliteration.transform(io.StringIO(data), io.StringIO())
+    elapsed = timeit(convertPages, [None] * repeat, rounds)
+    log.info('Converting %d pages x %d: %.1f ms (%.2f ms/page)',
+             len(pages), repeat, elapsed * 1000, elapsed * 1000 / (len(pages) * repeat))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='python -m tools.bench.transliteration')
+    parser.add_argument('--check', action='store_true', help='Only check equivalence; skip the benchmark')
+    parser.add_argument('--sourcedir', default='src', help='where to find page XML')
+    parser.add_argument('--repeat', type=int, default=200, help='how many times to repeat the corpus')
+    parser.add_argument('--rounds', type=int, default=5, help='how many times to time each; we report the best')
+    ns = parser.parse_args(args[1:])
+
+    texts = corpus(ns.sourcedir)
+    if check(texts):
+        return 1
+    if not ns.check:
+        benchmark(texts, ns.sourcedir, ns.repeat, ns.rounds)
+    return 0
+
+
+if __name__ == '__main__':
+    rv = main(sys.argv)
+    sys.exit(rv)
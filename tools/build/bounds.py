@@ -0,0 +1,139 @@
+"""bounds works out where a model is, and where its hitboxes are, so that the
+viewer doesn't have to walk every vertex of the model to find out.
+
+The viewer centres each model on the origin. Models that the build writes
+(packed models and their LODs) have their centre baked in, by moving their
+root nodes; for the others, the page tells the viewer how far to move the
+model. Either way, the hitbox metadata (and hitbox BVH; see bvh) is in the
+published model's space, so the viewer only has to apply the same move.
+
+For each hitbox, we record its bounds, their centre, and the direction its
+largest faces point in, away from the centre of the model: for a hitbox
+around a text, the way the text faces.
+"""
+
+import logging
+
+import numpy as np
+
+from . import gltf
+
+log = logging.getLogger(__name__)
+
+# How close (relatively) the principal axes of a hitbox's normals must be
+# for us to count them as tied.
+TIE_TOLERANCE = 0.05
+
+
+def _nodePositions(model: gltf.Gltf, node, matrix):
+    """Return the positions of a node's mesh in world space, and its triangles' vertex indices."""
+    positions = []
+    indices = []
+    count = 0
+    mesh = model.json['meshes'][model.json['nodes'][node]['mesh']]
+    for primitive in mesh['primitives']:
+        if 'POSITION' not in primitive['attributes']:
+            continue
+        points = gltf.transformPoints(matrix, model.readAccessorFloat(primitive['attributes']['POSITION']))
+        if primitive.get('mode', gltf.TRIANGLES) == gltf.TRIANGLES:
+            tris = model.readIndices(primitive)
+            indices.append(tris[:len(tris) // 3 * 3].astype(np.int64) + count)
+        positions.append(points)
+        count += len(points)
+    if not positions:
+        return np.zeros((0, 3)), np.zeros(0, dtype=np.int64)
+    return np.concatenate(positions), np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+
+
+def modelCenter(model: gltf.Gltf):
+    """Return the centre of the bounds of a model's default scene, in world space.
+
+    Like THREE.Box3.setFromObject, this goes by the model's vertices, so it
+    follows rotated nodes closely.
+    """
+    lo = np.full(3, np.inf)
+    hi = np.full(3, -np.inf)
+    for node, matrix in model.worldMatrices().items():
+        if 'mesh' not in model.json['nodes'][node]:
+            continue
+        positions, _ = _nodePositions(model, node, matrix)
+        if len(positions):
+            lo = np.minimum(lo, positions.min(axis=0))
+            hi = np.maximum(hi, positions.max(axis=0))
+    if not np.all(lo <= hi):
+        return np.zeros(3)
+    return (lo + hi) / 2
+
+
+def dominantNormal(points, tris, outward):
+    """Find the direction that most of a mesh's surface faces, along the line (not the way) it faces.
+
+    That's the principal axis of its area-weighted face normals, which for
+    a box is the normal of its largest faces. Where axes tie (as they do
+    for a cube), we take the one nearest to outward, and we pick the way
+    along it that's nearest to outward too.
+    """
+    if not len(tris):
+        return outward / (np.linalg.norm(outward) or 1)
+    triangles = points[tris.reshape(-1, 3)]
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    areas = np.linalg.norm(normals, axis=1)
+    unit = normals[areas > 0] / areas[areas > 0, None]
+    if not len(unit):
+        return outward / (np.linalg.norm(outward) or 1)
+    covariance = (unit * areas[areas > 0, None]).T @ unit
+    values, vectors = np.linalg.eigh(covariance)
+    tied = vectors[:, values >= values[-1] * (1 - TIE_TOLERANCE)]
+    normal = tied[:, np.argmax(np.abs(outward @ tied))]
+    return -normal if normal @ outward < 0 else normal
+
+
+def hitboxMetadata(model: gltf.Gltf, node, center, offset):
+    """Describe a hitbox node's mesh, for the viewer.
+
+    center is the model's centre, and offset is how far the published
+    model has been moved (see recenter), if at all, both in the source
+    model's world space. Returns the hitbox's bounds (min and max), their centre, and its
+    dominant normal, in the published model's space, or None if the node
+    has no mesh.
+    """
+    if 'mesh' not in model.json['nodes'][node]:
+        return None
+    matrices = model.worldMatrices()
+    if node not in matrices:
+        return None
+    points, tris = _nodePositions(model, node, matrices[node])
+    if not len(points):
+        return None
+    if offset is None:
+        offset = np.zeros(3)
+    lo = points.min(axis=0)
+    hi = points.max(axis=0)
+    middle = (lo + hi) / 2
+    return {
+        'min': lo - offset,
+        'max': hi - offset,
+        'center': middle - offset,
+        'normal': dominantNormal(points, tris, middle - center),
+    }
+
+
+def recenter(doc, offset):
+    """Move a model's root nodes (in its parsed JSON) by -offset."""
+    if not np.any(offset):
+        return
+    nodes = doc.get('nodes', [])
+    scenes = doc.get('scenes', [])
+    if scenes:
+        roots = {root for scene in scenes for root in scene.get('nodes', [])}
+    else:
+        children = {c for node in nodes for c in node.get('children', [])}
+        roots = set(range(len(nodes))) - children
+    for root in sorted(roots):
+        node = nodes[root]
+        if 'matrix' in node:
+            matrix = gltf.nodeMatrix(node)
+            matrix[:3, 3] -= offset
+            gltf.setNodeMatrix(node, matrix)
+        else:
+            node['translation'] = (np.array(node.get('translation', [0, 0, 0]), dtype=np.float64) - offset).tolist()
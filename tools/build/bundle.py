@@ -0,0 +1,421 @@
+"""bundle concatenates the site's scripts into a single minified bundle, with
+a source map, and minifies its CSS.
+
+The minifiers are deliberately conservative: they strip comments and
+whitespace, and nothing else, so they can't change what the code means.
+Line breaks are kept wherever automatic semicolon insertion might depend on
+them. Licence comments (/*! ... */, or mentioning @license or @preserve)
+are kept, and already minified files (*.min.js) are included as they are.
+"""
+
+import json
+import logging
+import os
+import re
+
+from .fileutil import writeFile
+
+log = logging.getLogger(__name__)
+
+# After one of these keywords, a slash starts a regular expression, not a division.
+_REGEX_KEYWORDS = {
+    'await', 'case', 'delete', 'do', 'else', 'in', 'instanceof', 'new', 'of', 'return', 'throw',
+    'typeof', 'void', 'yield',
+}
+
+# A line break after one of these can't be where a semicolon is inserted, so
+# it can go. (After anything else, we keep it rather than work out whether
+# it matters.)
+_JOINABLE = set(';{,([')
+
+_WORD = re.compile(r'[\w$\u0080-\uffff]+|\.?\d[\w.]*')
+_WHITESPACE = re.compile(r'[ \t\f\v\ufeff\u00a0]+')
+_LINE_BREAK = re.compile(r'\r\n?|\n|\u2028|\u2029')
+
+_BASE64 = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+
+class MinifyError(Exception):
+    """We couldn't make sense of a file we were asked to minify."""
+    def __init__(self, message):
+        self.message = message
+
+
+def _isWordChar(c):
+    return c.isalnum() or c in '_$' or ord(c) >= 0x80
+
+
+def _preservedComment(comment):
+    return comment.startswith('/*!') or '@license' in comment or '@preserve' in comment
+
+
+class _JsTokenizer:
+    """Splits JavaScript into tokens, noting where each one starts.
+
+    Tokens are (kind, text, line, column), where kind is 'word' (an
+    identifier, keyword or number), 'string' (including template literals
+    and regular expressions), 'punct' (a single punctuation character),
+    'comment' (a comment to keep), or 'space' or 'newline' (for whitespace
+    and discarded comments).
+    """
+
+    def __init__(self, text, name):
+        self.text = text
+        self.name = name
+        self.pos = 0
+        self.line = 0
+        self.linestart = 0
+
+    def error(self, message):
+        return MinifyError(f'{self.name}:{self.line + 1}: {message}')
+
+    def _advance(self, end):
+        """Move to end, keeping track of the line we're on."""
+        for m in _LINE_BREAK.finditer(self.text, self.pos, end):
+            self.line += 1
+            self.linestart = m.end()
+        self.pos = end
+
+    def _scanString(self, pos):
+        quote = self.text[pos]
+        i = pos + 1
+        while i < len(self.text):
+            c = self.text[i]
+            if c == '\\':
+                i += 2
+            elif c == quote:
+                return i + 1
+            elif c in '\r\n':
+                break
+            else:
+                i += 1
+        raise self.error('unterminated string')
+
+    def _scanTemplate(self, pos):
+        """Find the end of a template literal, skipping over the code in its ${...}s."""
+        i = pos + 1
+        while i < len(self.text):
+            c = self.text[i]
+            if c == '\\':
+                i += 2
+            elif c == '`':
+                return i + 1
+            elif c == '$' and self.text.startswith('{', i + 1):
+                i = self._scanBraces(i + 2)
+            else:
+                i += 1
+        raise self.error('unterminated template literal')
+
+    def _scanBraces(self, pos):
+        """Find the end of the code in a template literal's ${...}."""
+        depth = 1
+        i = pos
+        while i < len(self.text):
+            c = self.text[i]
+            if c in '\'"':
+                i = self._scanString(i)
+            elif c == '`':
+                i = self._scanTemplate(i)
+            elif self.text.startswith('/*', i):
+                i = self._scanBlockComment(i)
+            elif self.text.startswith('//', i):
+                i = self._scanLineComment(i)
+            else:
+                if c == '{':
+                    depth += 1
+                elif c == '}':
+                    depth -= 1
+                    if depth == 0:
+                        return i + 1
+                i += 1
+        raise self.error('unterminated template literal')
+
+    def _scanBlockComment(self, pos):
+        end = self.text.find('*/', pos + 2)
+        if end < 0:
+            raise self.error('unterminated comment')
+        return end + 2
+
+    def _scanLineComment(self, pos):
+        m = _LINE_BREAK.search(self.text, pos)
+        return m.start() if m else len(self.text)
+
+    def _scanRegex(self, pos):
+        i = pos + 1
+        inclass = False
+        while i < len(self.text):
+            c = self.text[i]
+            if c == '\\':
+                i += 2
+                continue
+            if c in '\r\n':
+                break
+            if c == '[':
+                inclass = True
+            elif c == ']':
+                inclass = False
+            elif c == '/' and not inclass:
+                i += 1
+                while i < len(self.text) and _isWordChar(self.text[i]):
+                    i += 1  # flags
+                return i
+            i += 1
+        raise self.error('unterminated regular expression')
+
+    def tokens(self):
+        text = self.text
+        previous = None  # the last token that wasn't space or a comment
+        while self.pos < len(text):
+            pos = self.pos
+            line, column = self.line, pos - self.linestart
+            c = text[pos]
+            m = _WHITESPACE.match(text, pos)
+            if m:
+                kind, end = 'space', m.end()
+            elif c in '\r\n\u2028\u2029':
+                kind, end = 'newline', _LINE_BREAK.match(text, pos).end()
+            elif text.startswith('/*', pos):
+                end = self._scanBlockComment(pos)
+                if _preservedComment(text[pos:end]):
+                    kind = 'comment'
+                else:
+                    kind = 'newline' if _LINE_BREAK.search(text, pos, end) else 'space'
+            elif text.startswith('//', pos):
+                kind, end = 'space', self._scanLineComment(pos)
+            elif c in '\'"':
+                kind, end = 'string', self._scanString(pos)
+            elif c == '`':
+                kind, end = 'string', self._scanTemplate(pos)
+            elif c == '/' and self._regexAllowed(previous):
+                kind, end = 'string', self._scanRegex(pos)
+            else:
+                m = _WORD.match(text, pos)
+                if m:
+                    kind, end = 'word', m.end()
+                else:
+                    kind, end = 'punct', pos + 1
+            token = (kind, text[pos:end], line, column)
+            if kind in ('word', 'string', 'punct'):
+                previous = token
+            self._advance(end)
+            yield token
+
+    @staticmethod
+    def _regexAllowed(previous):
+        """Whether a slash after the given token starts a regular expression."""
+        if previous is None:
+            return True
+        kind, text = previous[0], previous[1]
+        if kind == 'word':
+            return text in _REGEX_KEYWORDS
+        if kind == 'punct':
+            return text not in ')]}'
+        return False
+
+
+def _needsSpace(before, after):
+    """Whether two tokens would run together without a space between them."""
+    a, b = before[-1], after[0]
+    if _isWordChar(a) and _isWordChar(b):
+        return True
+    if a in '+-' and b == a:
+        return True  # a + +b, a - -b
+    if a == '/' and b in '/*':
+        return True  # a / /re/
+    if before[0].isdigit() and b == '.':
+        return True  # 1 .toString()
+    return False
+
+
+class SourceMap:
+    """Builds a version 3 source map for a generated file."""
+
+    def __init__(self, file):
+        self.file = file
+        self.sources = []
+        self.lines = [[]]  # generated line -> [(column, source, line, column)]
+
+    def addSource(self, name):
+        self.sources.append(name)
+        return len(self.sources) - 1
+
+    def add(self, genline, gencolumn, source, line, column):
+        while len(self.lines) <= genline:
+            self.lines.append([])
+        self.lines[genline].append((gencolumn, source, line, column))
+
+    @staticmethod
+    def _vlq(value):
+        value = (-value << 1) | 1 if value < 0 else value << 1
+        out = ''
+        while True:
+            digit = value & 31
+            value >>= 5
+            if value:
+                digit |= 32
+            out += _BASE64[digit]
+            if not value:
+                return out
+
+    def mappings(self):
+        lines = []
+        prevsource = prevline = prevcolumn = 0
+        for segments in self.lines:
+            prevgencolumn = 0
+            encoded = []
+            for gencolumn, source, line, column in segments:
+                encoded.append(self._vlq(gencolumn - prevgencolumn) + self._vlq(source - prevsource)
+                               + self._vlq(line - prevline) + self._vlq(column - prevcolumn))
+                prevgencolumn, prevsource, prevline, prevcolumn = gencolumn, source, line, column
+            lines.append(','.join(encoded))
+        return ';'.join(lines)
+
+    def toJson(self):
+        return json.dumps({
+            'version': 3,
+            'file': self.file,
+            'sources': self.sources,
+            'names': [],
+            'mappings': self.mappings(),
+        }, separators=(',', ':'))
+
+
+class _Output:
+    """Generated code, with a source map to go with it."""
+
+    def __init__(self, sourcemap):
+        self.parts = []
+        self.line = 0
+        self.column = 0
+        self.sourcemap = sourcemap
+        self.delta = None  # (source, line, generated column - source column) for the last mapping
+
+    def write(self, text):
+        self.parts.append(text)
+        breaks = list(_LINE_BREAK.finditer(text))
+        if breaks:
+            self.line += len(breaks)
+            self.column = len(text) - breaks[-1].end()
+        else:
+            self.column += len(text)
+
+    def map(self, source, line, column):
+        """Map the generated code that follows to the given source position.
+
+        Adjacent tokens that moved by the same amount share a mapping.
+        """
+        delta = (source, line, self.column - column)
+        if delta != self.delta or self.column == 0:
+            self.sourcemap.add(self.line, self.column, source, line, column)
+            self.delta = delta
+
+    def text(self):
+        return ''.join(self.parts)
+
+
+def _minifyJs(text, name, out, source):
+    previous = None  # the last token written
+    space = newline = False
+    for kind, token, line, column in _JsTokenizer(text, name).tokens():
+        if kind == 'space':
+            space = True
+            continue
+        if kind == 'newline':
+            newline = True
+            continue
+        if previous is not None:
+            if kind == 'comment' or previous[0] == 'comment':
+                out.write('\n')
+            elif newline and previous[1][-1] not in _JOINABLE:
+                out.write('\n')
+            elif (space or newline) and _needsSpace(previous[1], token):
+                out.write(' ')
+        out.map(source, line, column)
+        out.write(token)
+        if kind == 'string' and _LINE_BREAK.search(token):
+            out.delta = None  # the token spans lines, so the next one needs a mapping of its own
+        previous = (kind, token)
+        space = newline = False
+
+
+def _copyJs(text, out, source):
+    """Include already minified code as it is, mapping each line to itself."""
+    for line, m in enumerate(re.finditer(r'[^\r\n]*(?:\r\n?|\n|$)', text)):
+        if not m.group():
+            break
+        out.map(source, line, 0)
+        out.write(m.group())
+
+
+def minifyJs(text, name='<script>'):
+    """Minify some JavaScript, returning the minified code."""
+    out = _Output(SourceMap(name))
+    _minifyJs(text, name, out, 0)
+    return out.text()
+
+
+def bundleJs(sources, dest, sourceroot):
+    """Concatenate and minify JavaScript files into a bundle at dest, with a source map next to it.
+
+    sources are paths to the files to include, in order. The source map
+    refers to them by their paths relative to dest. Files whose names end
+    in .min.js are included as they are. Returns the size of the bundle.
+    """
+    mapname = os.path.basename(dest) + '.map'
+    sourcemap = SourceMap(os.path.basename(dest))
+    out = _Output(sourcemap)
+    for src in sources:
+        with open(src, encoding='utf-8') as f:
+            text = f.read()
+        source = sourcemap.addSource(os.path.relpath(src, os.path.dirname(dest)).replace(os.sep, '/'))
+        if src.endswith('.min.js'):
+            _copyJs(text, out, source)
+        else:
+            _minifyJs(text, os.path.relpath(src, sourceroot), out, source)
+        # Each file was a script of its own; make sure its last statement ends with it.
+        out.write('\n;\n')
+        out.delta = None
+    out.write(f'//# sourceMappingURL={mapname}\n')
+
+    data = out.text().encode('utf-8')
+    writeFile(dest, data)
+    writeFile(os.path.join(os.path.dirname(dest), mapname), sourcemap.toJson().encode('utf-8'))
+    return len(data)
+
+
+_CSS_TOKEN = re.compile(r'''("(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*'|/\*.*?\*/|\s+|[^"'/\s]+|/)''', re.S)
+
+# Whitespace next to these can always go.
+_CSS_PUNCT = set('{};,>')
+
+# Whitespace after these can go too (but not before: "a :hover" isn't "a:hover").
+_CSS_PUNCT_BEFORE = _CSS_PUNCT | {':'}
+
+
+def minifyCss(text):
+    """Minify a stylesheet, stripping comments and needless whitespace."""
+    out = []
+    space = False
+    for token in _CSS_TOKEN.findall(text):
+        if token.startswith('/*'):
+            if _preservedComment(token):
+                out.append(token)
+            else:
+                space = True
+            continue
+        if token.isspace():
+            space = True
+            continue
+        if space and out and out[-1][-1] not in _CSS_PUNCT_BEFORE and token[0] not in _CSS_PUNCT:
+            out.append(' ')
+        out.append(token)
+        space = False
+    return ''.join(out).replace(';}', '}') + '\n'
+
+
+def minifyCssFile(src, dest):
+    """Minify the stylesheet at src into dest, returning the size of the result."""
+    with open(src, encoding='utf-8') as f:
+        data = minifyCss(f.read()).encode('utf-8')
+    writeFile(dest, data)
+    return len(data)
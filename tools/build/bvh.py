@@ -0,0 +1,134 @@
+"""bvh builds a bounding volume hierarchy (BVH) over the hitboxes of a model:
+the meshes of the nodes that page links refer to. The viewer picks hitboxes
+by casting rays into it, rather than into the whole model, so picking takes
+the same (tiny) time however finely the model was scanned.
+
+The BVH is a binary tree of axis-aligned boxes, each leaf holding up to
+LEAF_SIZE triangles. It's built by splitting each box's triangles in half
+at the median of their centres, along the axis on which the centres are
+most spread out, and written as a little-endian binary sidecar file:
+
+- A header of four uint32s: MAGIC, VERSION, the number of tree nodes, and
+  the number of triangles.
+- Each node's bounds, as six float32s (min x, y, z, then max x, y, z).
+- Each node's two int32s, (offset, count). For a leaf, count triangles
+  start at offset. For the others, count is 0, the left child is the next
+  node, and the right child is the node at offset. Nodes are in depth-first
+  order, so the root is node 0.
+- Each triangle's three vertices, as nine float32s, in the order the leaves
+  refer to them.
+- Each triangle's glTF node index, as a uint32.
+
+Vertices are in the published model's world space: that of the scene
+GLTFLoader makes of it, before the viewer moves it (see bounds).
+"""
+
+import logging
+import os
+
+import numpy as np
+
+from . import gltf
+from .fileutil import writeFile
+
+log = logging.getLogger(__name__)
+
+MAGIC = 0x31485642  # b'BVH1', read as a little-endian uint32
+VERSION = 1
+
+# The most triangles in a leaf.
+LEAF_SIZE = 4
+
+
+def bvhPath(dest):
+    """Where the BVH for the hitboxes of a model published at dest goes."""
+    return os.path.splitext(dest)[0] + '.bvh'
+
+
+def hitboxTriangles(model: gltf.Gltf, nodes):
+    """Collect the triangles of the given nodes' meshes, in world space.
+
+    Returns the triangles, as an (n, 3, 3) array, and the node that each
+    came from.
+    """
+    matrices = model.worldMatrices()
+    triangles = [np.zeros((0, 3, 3))]
+    trinodes = [np.zeros(0, dtype=np.uint32)]
+    for node in nodes:
+        nodedef = model.json['nodes'][node]
+        if 'mesh' not in nodedef or node not in matrices:
+            continue
+        for primitive in model.json['meshes'][nodedef['mesh']]['primitives']:
+            if primitive.get('mode', gltf.TRIANGLES) != gltf.TRIANGLES or 'POSITION' not in primitive['attributes']:
+                continue
+            positions = gltf.transformPoints(
+                matrices[node], model.readAccessorFloat(primitive['attributes']['POSITION']))
+            indices = model.readIndices(primitive)
+            tris = positions[indices[:len(indices) // 3 * 3]].reshape(-1, 3, 3)
+            triangles.append(tris)
+            trinodes.append(np.full(len(tris), node, dtype=np.uint32))
+    return np.concatenate(triangles), np.concatenate(trinodes)
+
+
+def buildBvh(triangles):
+    """Build a BVH over triangles (an (n, 3, 3) array).
+
+    Returns the bounds of each tree node, as an (m, 6) array, each node's
+    (offset, count), as an (m, 2) array, and the order of the triangles
+    that the leaves refer to.
+    """
+    lo = triangles.min(axis=1)
+    hi = triangles.max(axis=1)
+    centres = (lo + hi) / 2
+    order = np.arange(len(triangles))
+    bounds = []
+    nodes = []
+
+    def build(start, end):
+        index = len(nodes)
+        tris = order[start:end]
+        bounds.append(np.concatenate([lo[tris].min(axis=0), hi[tris].max(axis=0)]))
+        if end - start <= LEAF_SIZE:
+            nodes.append((start, end - start))
+            return index
+        nodes.append(None)
+        spread = centres[tris].max(axis=0) - centres[tris].min(axis=0)
+        axis = int(np.argmax(spread))
+        mid = (start + end) // 2
+        order[start:end] = tris[np.argpartition(centres[tris, axis], mid - start)]
+        build(start, mid)
+        nodes[index] = (build(mid, end), 0)
+        return index
+
+    if len(triangles):
+        build(0, len(triangles))
+    return (np.array(bounds, dtype=np.float32).reshape(-1, 6),
+            np.array(nodes, dtype=np.int32).reshape(-1, 2), order)
+
+
+def bvhBytes(triangles, trinodes) -> bytes:
+    """Build a BVH over triangles, and encode it in our sidecar format."""
+    bounds, nodes, order = buildBvh(triangles)
+    header = np.array([MAGIC, VERSION, len(nodes), len(triangles)], dtype='<u4')
+    return b''.join([
+        header.tobytes(),
+        bounds.astype('<f4').tobytes(),
+        nodes.astype('<i4').tobytes(),
+        triangles[order].astype('<f4').tobytes(),
+        trinodes[order].astype('<u4').tobytes(),
+    ])
+
+
+def makeBvh(src, dest, nodes, offset=None):
+    """Build a BVH over the meshes of the given nodes of the model at src, and write it to dest.
+
+    offset is how far the published model has been moved from the source
+    (see tools.build.bounds.recenter). Returns the number of triangles in it.
+    """
+    model = gltf.Gltf.load(src)
+    triangles, trinodes = hitboxTriangles(model, sorted(set(nodes)))
+    if offset is not None:
+        triangles = triangles - np.asarray(offset, dtype=np.float64)
+    writeFile(dest, bvhBytes(triangles, trinodes))
+    log.debug('Wrote BVH %s: %d hitbox triangles', dest, len(triangles))
+    return len(triangles)
@@ -1,6 +1,12 @@
+import collections
+import hashlib
 import logging
+import os
+import pickle
 import xml.etree.ElementTree as ET
 
+from .fileutil import writeFile
+
 log = logging.getLogger(__name__)
 
 
@@ -11,25 +17,103 @@ class XMLDocumentCache:
 
     General assumption: we don't care about the document object per se. We just
     cache the root element of each document.
+
+    Each entry remembers the size and mtime of the file it was parsed from,
+    and is thrown away if the file has since changed. At most maxsize
+    documents are kept in memory, evicting the least recently used.
+
+    If diskdir is given, parsed documents are also pickled there, so that
+    later builds can skip parsing files that haven't changed.
     """
 
-    def __init__(self):
-        self.cache = {}
+    def __init__(self, maxsize=64, diskdir=None):
+        self.maxsize = maxsize
+        self.diskdir = diskdir
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.diskhits = 0
+
+    @staticmethod
+    def _fileStamp(src):
+        st = os.stat(src)
+        return (st.st_size, st.st_mtime_ns)
+
+    def _diskPath(self, src):
+        key = hashlib.sha1(os.path.abspath(src).encode('utf-8')).hexdigest()
+        return os.path.join(self.diskdir, key + '.pickle')
+
+    def _loadFromDisk(self, src, stamp):
+        if not self.diskdir:
+            return None
+        path = self._diskPath(src)
+        try:
+            with open(path, 'rb') as f:
+                diskstamp, root = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.debug('Ignoring bad XML cache entry %s: %s', path, e)
+            return None
+        if diskstamp != stamp:
+            return None
+        return root
+
+    def _saveToDisk(self, src, stamp, root):
+        if not self.diskdir:
+            return
+        os.makedirs(self.diskdir, exist_ok=True)
+        path = self._diskPath(src)
+        writeFile(path, pickle.dumps((stamp, root), protocol=pickle.HIGHEST_PROTOCOL))
+
+    def _store(self, src, stamp, root):
+        self.cache[src] = (stamp, root)
+        self.cache.move_to_end(src)
+        while len(self.cache) > self.maxsize:
+            evicted, _ = self.cache.popitem(last=False)
+            log.debug('Evicting XML from cache: %s', evicted)
 
     def load(self, src: str) -> ET.Element:
-        if src in self.cache:
-            return self.cache[src]
+        stamp = self._fileStamp(src)
+        entry = self.cache.get(src)
+        if entry is not None and entry[0] == stamp:
+            self.hits += 1
+            self.cache.move_to_end(src)
+            return entry[1]
 
+        root = self._loadFromDisk(src, stamp)
+        if root is not None:
+            self.diskhits += 1
+            self._store(src, stamp, root)
+            return root
+
+        self.misses += 1
         log.debug('Loading XML: %s', src)
         root = ET.parse(src).getroot()
         root.attrib['src'] = src  # TODO: carried over from previous build.py code; do we still need this?
+        self._store(src, stamp, root)
+        self._saveToDisk(src, stamp, root)
         return root
 
     def exists(self, src):
-        return src in self.cache
+        if src in self.cache:
+            return True
+        return bool(self.diskdir) and os.path.exists(self._diskPath(src))
 
     def remove(self, src):
-        del self.cache[src]
+        found = self.cache.pop(src, None) is not None
+        if self.diskdir and os.path.exists(self._diskPath(src)):
+            os.unlink(self._diskPath(src))
+            found = True
+        if not found:
+            raise KeyError(src)
 
     def flush(self):
-        self.cache = {}
+        self.cache = collections.OrderedDict()
+        if self.diskdir and os.path.isdir(self.diskdir):
+            for entry in os.listdir(self.diskdir):
+                if entry.endswith('.pickle'):
+                    os.unlink(os.path.join(self.diskdir, entry))
+
+    def logStats(self):
+        log.debug('XML cache: %d hits, %d from disk, %d parsed', self.hits, self.diskhits, self.misses)
@@ -0,0 +1,103 @@
+"""compress writes a precompressed copy of each text and model file in the
+output directory, next to the file itself (e.g. js/main.js.gz), so that the
+web server doesn't need to compress them on the fly.
+
+nginx serves them with gzip_static (see tools/nginx/default.conf), and so
+does serve.py. Files that are small, or that don't compress well (images
+and fonts are compressed already), are left alone.
+"""
+
+import concurrent.futures
+import gzip
+import logging
+import os
+
+from .fileutil import writeFile
+
+log = logging.getLogger(__name__)
+
+COMPRESSIBLE_EXTENSIONS = {
+    '.html', '.css', '.js', '.json', '.map', '.svg', '.xml', '.txt',
+    '.gltf', '.glb', '.bin', '.obj', '.mtl',
+}
+
+# Don't bother with files smaller than this; the saving would be lost in the noise.
+MIN_SIZE = 256
+
+# Only keep the compressed file if it's at least this much smaller.
+MIN_SAVING = 0.1
+
+
+def compressedPath(path):
+    return path + '.gz'
+
+
+def compressibleFiles(root):
+    """List the files under root that we'd like compressed copies of.
+
+    Also deletes any compressed copies whose original has gone.
+    """
+    paths = []
+    for dirpath, dirs, files in os.walk(root):
+        for f in files:
+            path = os.path.join(dirpath, f)
+            base, ext = os.path.splitext(path)
+            if ext == '.gz':
+                if os.path.splitext(base)[1].lower() in COMPRESSIBLE_EXTENSIONS and not os.path.exists(base):
+                    log.debug('Removing orphaned %s', path)
+                    os.unlink(path)
+            elif ext.lower() in COMPRESSIBLE_EXTENSIONS:
+                paths.append(path)
+    return paths
+
+
+def removeCompressedFiles(root):
+    """Delete every compressed copy under root, returning how many there were.
+
+    A build without --compress does this, so that the web server doesn't
+    go on serving copies of files that have changed since.
+    """
+    count = 0
+    for dirpath, dirs, files in os.walk(root):
+        for f in files:
+            base, ext = os.path.splitext(f)
+            if ext == '.gz' and os.path.splitext(base)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                os.unlink(os.path.join(dirpath, f))
+                count += 1
+    return count
+
+
+def compressFile(path):
+    """Write a gzipped copy of a file next to it, if it's worth it.
+
+    Returns the file's size, and the size of the compressed copy, or None
+    if there isn't one. The copy is gzipped at the highest level, with no
+    timestamp or file name in the header (so that it only changes when the
+    file does), and is given the file's modification time, so that the
+    server sends the same Last-Modified for both.
+    """
+    gzpath = compressedPath(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) >= MIN_SIZE:
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(compressed) <= len(data) * (1 - MIN_SAVING):
+            writeFile(gzpath, compressed, mtime_ns=os.stat(path).st_mtime_ns)
+            return len(data), len(compressed)
+
+    if os.path.exists(gzpath):
+        os.unlink(gzpath)
+    return len(data), None
+
+
+def compressFiles(paths):
+    """Compress many files in parallel, returning a dict of path -> compressFile's result.
+
+    zlib lets go of the GIL while it works, so threads are enough to keep
+    every core busy.
+    """
+    paths = list(paths)
+    if not paths:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+        return dict(zip(paths, executor.map(compressFile, paths)))
@@ -6,6 +6,18 @@ import xml.etree.ElementTree as ET
 
 log = logging.getLogger(__name__)
 
+# How to render HTML (--html-renderer): xslt renders with BuildSite, python
+# with tools.build.htmlrender, and compare with both, checking that they agree.
+RENDERERS = ['xslt', 'python', 'compare']
+
+# How to publish assets to the dist directory (--link-mode); see
+# tools.build.publish.AssetPublisher.
+LINK_MODES = ['auto', 'copy', 'hardlink', 'reflink', 'symlink']
+
+# How to publish each page's hieroglyph images (--sprites); none publishes
+# each image as it is, as a file of its own. See tools.build.svgsprite.
+SPRITE_MODES = ['sheet', 'inline', 'none']
+
 
 class Config:
     assetsdir: str
@@ -17,6 +29,19 @@ class Config:
     javapath: str
     validate: bool
     verbose: bool
+    incremental: bool
+    persistxmlcache: bool
+    worker: bool
+    watch: bool
+    htmlrenderer: str
+    linkmode: str
+    packmodels: bool
+    lods: bool
+    texturevariants: bool
+    sprites: str
+    compress: bool
+    fingerprint: bool
+    profile: bool
 
     stylesheetdir: str
     saxonjarpath: str
@@ -26,6 +51,14 @@ class Config:
 
     srcsitexml: str
     distsitexml: str
+    buildmanifest: str
+    profiletrace: str
+    assetmanifest: str
+    xmlcachedir: str
+    texturecachedir: str
+    stagingdir: str
+    publishdir: str
+    xsltthreads: int
 
     def loadSection(self, doc: ET.Element, section_tag: str):
         section = doc.find(section_tag)
@@ -65,7 +98,28 @@ def resolveToolLocation(config: Config, locationkey: str, toolname: str):
 
 def resolveToolLocations(config: Config):
     resolveToolLocation(config, 'xmlstarletpath', 'xmlstarlet')
-    resolveToolLocation(config, 'javapath', 'java')
+    if config.htmlrenderer == 'python':
+        # Only the XSLT needs Java.
+        config.javapath = getattr(config, 'javapath', None)
+    else:
+        resolveToolLocation(config, 'javapath', 'java')
+
+
+# The config attributes of paths in the dist directory.
+DIST_PATHS = ['distdir', 'distsitexml', 'modelsdestdir', 'imgdestdir', 'distindexhtml']
+
+
+def stageOutput(config: Config):
+    """Point the paths in the dist directory at the staging directory instead.
+
+    The build writes everything to the staging directory, and then
+    publishes what changed to the dist directory, which becomes publishdir.
+    """
+    config.publishdir = config.distdir
+    for key in DIST_PATHS:
+        relpath = os.path.relpath(getattr(config, key), config.publishdir)
+        if relpath != os.pardir and not relpath.startswith(os.pardir + os.sep):
+            setattr(config, key, os.path.normpath(os.path.join(config.stagingdir, relpath)))
 
 
 def loadConfigXml(fname: str) -> ET.Element:
@@ -90,7 +144,46 @@ def getConfig(args) -> Config:
     parser.add_argument('--builddir', help='where intermediate build output is written')
     parser.add_argument('--xmlstarletpath', help='location of XML Starlet, used for XML Include/Schema processing')
     parser.add_argument('--javapath', help='Location of Java runtime command, used for XSLT')
+    parser.add_argument('--link-mode', dest='linkmode', choices=LINK_MODES, default='auto',
+                        help='How to publish assets to the dist directory: by copy, or by some kind of link. '
+                        'auto uses reflinks or hard links where possible, and copies otherwise.')
+    parser.add_argument('--pack-models', dest='packmodels', action='store_true',
+                        help='Publish glTF models as optimised, quantized GLB files')
+    parser.add_argument('--lods', dest='lods', action='store_true',
+                        help='Publish simplified levels of detail of each glTF model too, which the viewer '
+                        'shows while the full model loads')
+    parser.add_argument('--texture-variants', dest='texturevariants', action='store_true',
+                        help='Publish the images in packed models and LODs on their own, with scaled-down '
+                        'variants for the viewer to choose from')
+    parser.add_argument('--sprites', dest='sprites', choices=SPRITE_MODES, default='sheet',
+                        help="How to publish each page's hieroglyph images: minified and merged into a sprite "
+                        'sheet for the page, minified and inlined into the page, or (none) as separate files')
+    parser.add_argument('--fingerprint', dest='fingerprint', action='store_true',
+                        help='Publish assets under content-hashed names too, and have pages refer to those, '
+                        'so that web servers can let browsers cache them for good')
+    parser.add_argument('--compress', dest='compress', action='store_true',
+                        help='Write a gzipped copy of each text and model file in the dist directory, '
+                        'for web servers to send as is')
     parser.add_argument('--no-val', dest='validate', action='store_false', help='Skip XML validation step', default=True)
+    parser.add_argument('-i', '--incremental', dest='incremental', action='store_true',
+                        help='Only rebuild what changed since the last build')
+    parser.add_argument('--xml-cache', dest='persistxmlcache', action='store_true',
+                        help='Keep parsed XML in the build directory between builds')
+    parser.add_argument('--worker', dest='worker', action='store_true',
+                        help='Run XSLT in a persistent BuildSite worker, passing it page XML in memory')
+    parser.add_argument('--xslt-threads', dest='xsltthreads', type=int,
+                        help='How many threads BuildSite runs transforms on (default: xsltthreads in '
+                        'build_config.xml; 0 means one per CPU)')
+    parser.add_argument('--html-renderer', dest='htmlrenderer', choices=RENDERERS, default='xslt',
+                        help='How to render HTML: with the XSLT in BuildSite, in Python (which needs no Java), '
+                        'or with both, failing the build if their HTML differs. The Python renderer '
+                        "can't be combined with --worker.")
+    parser.add_argument('--watch', dest='watch', action='store_true',
+                        help='Keep running, and rebuild whatever is affected when inputs change. '
+                        'Best combined with --worker.')
+    parser.add_argument('--profile', dest='profile', action='store_true',
+                        help='Record how long each step of the build takes, writing a Chrome trace '
+                        '(see profiletrace in build_config.xml) and logging a summary')
     parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', help='Verbose output')
 
     ns = parser.parse_args(args[1:])
@@ -105,6 +198,11 @@ def getConfig(args) -> Config:
         parser.error('Cannot set dist directory to root!')
     if config.builddir == '/':
         parser.error('Cannot set build directory to root!')
+    if os.path.abspath(config.stagingdir) == os.path.abspath(config.distdir):
+        parser.error('Cannot stage the build in the dist directory itself!')
+    stageOutput(config)
+    if config.worker and config.htmlrenderer != 'xslt':
+        parser.error('--worker only works with --html-renderer xslt')
 
     # Fill in defaults for external tool locations if necessary.
     try:
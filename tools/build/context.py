@@ -1,8 +1,12 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import logging
 
 from .config import Config
 from .cache import XMLDocumentCache
+from .manifest import BuildManifest
+from .profile import Profiler
+from .publish import AssetPublisher
+from .worker import BuildSiteWorker
 from .xmltoolbox import XMLToolbox
 
 log = logging.getLogger(__name__)
@@ -13,3 +17,8 @@ class Context:
     config: Config
     cache: XMLDocumentCache
     toolbox: XMLToolbox
+    manifest: BuildManifest
+    publisher: AssetPublisher
+    worker: BuildSiteWorker = None
+    profiler: Profiler = field(default_factory=Profiler)
+    pages: dict = field(default_factory=dict)  # page href -> PageInfo, for the current build
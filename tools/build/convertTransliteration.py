@@ -8,70 +8,81 @@ by Doğu Kaan Eraslan <kaaneraslan@gmail.com> and released under a MIT license
 here for performance reasons – importing CLTK is expensive!
 """
 
-import io
-import re
+import functools
 import sys
 from xml import sax
 from xml.sax import saxutils
 
 
-def mdcToUnicode(string, q_kopf=True):
+# The MdC -> Unicode mapping, as in CLTK (cltk.alphabet.egy.mdc_unicode).
+# Several MdC characters have alternative ASCII and Latin-1 forms.
+MDC_TO_UNICODE = {
+    # lettres miniscules/lower case letters/küçük harfler
+    'A': '\ua723',  # ꜣ
+    'a': '\ua725',  # ꜥ
+    'H': '\u1e25',  # ḥ
+    'x': '\u1e2b',  # ḫ
+    'X': '\u1e96',  # ẖ
+    'V': '\u0068\u032d',  # h̭
+    'S': '\u0161',  # š
+    'c': '\u015b',  # ś
+    'T': '\u1e6f',  # ṯ
+    'v': '\u1e71',  # ṱ
+    'D': '\u1e0f',  # ḏ
+    '=': '\u2e17',  # ⸗
+    '<': '\u2329',  # 〈
+    '>': '\u232a',  # 〉
+    # LETTRES MAJUSCULES/ UPPER CASE LETTERS/ BÜYÜK HARFLER
+    '\u00a1': '\u1e24', '@': '\u1e24',  # ¡|@ -> Ḥ
+    '#': '\u1e2a', '\u00a2': '\u1e2a',  # #|¢ -> Ḫ
+    '$': '\u0048\u0331', '\u00a3': '\u0048\u0331',  # $|£ -> H̱
+    '\u00a5': '\u0160', '^': '\u0160',  # ¥|^ -> Š
+    '*': '\u1e6e', '\u00a7': '\u1e6e',  # *|§ -> Ṯ
+    '\u00a9': '\u1e0e', '+': '\u1e0e',  # ©|+ -> Ḏ
+    'C': '\u015a',  # Ś
+}
+
+# Yod has several representations. Ours displays a bit nicer, in our opinion.
+# There are, as of Mar 2019, new canonical Unicode characters for these that
+# we should be using, but the fonts haven't quite caught up yet.
+YOD_PROFILES = {
+    'viewer': {'i': '\u1ec9', 'I': '\u1ec8'},  # ỉ, Ỉ
+    'cltk': {'i': '\u0069\u0486'},  # i҆ (CLTK doesn't handle I)
+}
+
+# Qoph is q and Q in the q_kopf convention, and ḳ and Ḳ otherwise.
+Q_KOPF_PROFILES = {
+    True: {},
+    False: {'q': '\u1e33', 'Q': '\u1e32'},  # ḳ, Ḳ
+}
+
+
+@functools.lru_cache(maxsize=None)
+def translationTable(q_kopf=True, yod='viewer'):
+    """Return the str.translate table for a mapping profile."""
+    mapping = dict(MDC_TO_UNICODE)
+    mapping.update(YOD_PROFILES[yod])
+    mapping.update(Q_KOPF_PROFILES[q_kopf])
+    return str.maketrans(mapping)
+
+
+@functools.lru_cache(maxsize=4096)
+def mdcToUnicode(string, q_kopf=True, yod='viewer'):
     """
     Convert the given MdC transliteration to Unicode text.
 
-    This reproduces CLTK's transliteration mapping and code
-    (cltk.alphabet.egy.mdc_unicode),  but chooses an alternative
-    representation for Yod (i and I) that displays a bit nicer in our
-    opinion.
-
-    There are, as of Mar 2019, new canonical Unicode characters for
-    these that we should be using, but the fonts haven't quite caught
-    up yet.
+    This reproduces CLTK's transliteration mapping (see MDC_TO_UNICODE),
+    but by default chooses an alternative representation for Yod (i and
+    I); see YOD_PROFILES.
 
     If q_kopf is True, we retain the use of q and Q; otherwise we use
     ḳ and Ḳ.
-    """
 
-    # lettres miniscules/lower case letters/küçük harfler
-    alef = string.replace("\u0041", "\ua723")  # A -> ꜣ
-    ayin = alef.replace("\u0061", "\ua725")  # a -> ꜥ
-    h_dot = ayin.replace("\u0048", "\u1e25")  # H -> ḥ
-    h_breve = h_dot.replace("\u0078", "\u1e2b")  # x -> ḫ
-    h_line = h_breve.replace("\u0058", "\u1e96")  # X -> ẖ
-    h_circum_below = h_line.replace("\u0056", "\u0068" + "\u032d")  # V -> 
-    shin = h_circum_below.replace("\u0053", "\u0161")  # S -> š
-    s_acute = shin.replace("\u0063", "\u015b")  # c -> ś
-    tche = s_acute.replace("\u0054", "\u1e6f")  # T -> ṯ
-    t_circum_below = tche.replace("\u0076", "\u1e71")  # v -> ṱ
-    djed = t_circum_below.replace("\u0044", "\u1e0f")  # D -> ḏ
-    # LOWER CASE YOD
-    # original: egy_yod = djed.replace("\u0069", "\u0069" + "\u0486")  # i -> i҆
-    egy_yod = djed.replace("\u0069", "\u1ec9")  # i -> ỉ
-    # END LOWEr CASE YOD
-    equal = egy_yod.replace("\u003d", "\u2e17")  # = -> ⸗
-    left_brackets = equal.replace("\u003c", "\u2329")  # < -> 〈
-    right_brackets = left_brackets.replace("\u003e", "\u232a")  # > -> 〉
-
-    if q_kopf is False:
-        kopf = right_brackets.replace("\u0071", "\u1e33")  # q -> ḳ
-        kopf_capital = kopf.replace("\u0051", "\u1e32")  # Q -> Ḳ
-    else:
-        kopf_capital = right_brackets
-
-    # LETTRES MAJUSCULES/ UPPER CASE LETTERS/ BÜYÜK HARFLER
-    h2_capital = re.sub("[\u00a1\u0040]", "\u1e24", kopf_capital)  # ¡|@ -> Ḥ
-    h3_capital = re.sub("[\u0023\u00a2]", "\u1e2a", h2_capital)  # #|¢ -> Ḫ
-    h4_capital = re.sub("[\u0024\u00a3]", "\u0048" + "\u0331", h3_capital)  # $|£ -> H̱
-    shin_capital = re.sub("[\u00a5\u005e]", "\u0160", h4_capital)  # ¥|^ -> Š
-    tche_capital = re.sub("[\u002a\u00a7]", "\u1e6e", shin_capital)  # *|§ -> Ṯ
-    djed_capital = re.sub("[\u00a9\u002b]", "\u1e0e", tche_capital)  # ©|+ -> Ḏ
-    # UPPER CASE YOD
-    # original: not handled!
-    egy_yod_capital = djed_capital.replace('\u0049', '\u1ec8')  # I -> Ỉ
-    # END UPPER CASE YOD
-    unicode_text = egy_yod_capital.replace("\u0043", "\u015a")  # C -> Ś
-
-    return unicode_text
+    Every MdC sign is a single character, so the conversion is a single
+    str.translate pass. Transliterations repeat a lot (think of all those
+    wsir), so we memoize the results too.
+    """
+    return string.translate(translationTable(q_kopf, yod))
 
 
 class Converter(saxutils.XMLGenerator):
@@ -91,34 +102,34 @@ class Converter(saxutils.XMLGenerator):
     generally span several SAX handler method calls. Here's how our
     implementation works:
 
-    - When we start conversion, we create a StringIO to hold the converted
-      markup. We also create a standalone XMLGenerator that wraps that
-      StringIO, and we use it to copy, or write transformed, markup to the
-      StringIO. Note that we don't use the full SAX interface when driving
-      the standalone XML generator; we only use the part of it that is
-      relevant to our conversion.
+    - When we start conversion, we start collecting the converted markup
+      in a list of strings, which we reuse for each <al> element. We
+      serialize the markup ourselves, the same way XMLGenerator does;
+      there's little enough of it that we don't need a second generator.
     - As we convert, we continue to process our XML output as normal, which
       copies data to the output.
     - As we see text that we want to convert, we concatenate it until we
       see something else (e.g. a start or end tag). We then convert the
-      text all at once from MdC -> Unicode and write it to the standalone
-      generator. We do this extra concatenation to make sure we don't
-      have to worry about character sequence splits across chunks.
+      text all at once from MdC -> Unicode and add it to the converted
+      markup. We do this extra concatenation to make sure we don't have
+      to worry about character sequence splits across chunks.
     - As we see other markup within the context of conversion, we copy it
-      to the standalone XML generator by invoking the corresonding SAX
-      handler methods on the standalone XML generator.
+      to the converted markup too.
     - Once we have closed off the <al> tag that we were converting, we
-      write the end of the tag as usual, then take all the work we did on
-      the side to create the converted <al> element, collect it from the
-      StringIO buffer, and immediately write that out.
+      write the end of the tag as usual, then immediately write out the
+      converted <al> element that we collected on the side.
+
+    Only the markup of one <al> element is held in memory at a time, so
+    memory use doesn't grow with the size of the page.
     """
-    def __init__(self, out):
+    def __init__(self, out, annotate=None):
         super(Converter, self).__init__(out, encoding='utf-8', short_empty_elements=True)
+        self.annotate = annotate
         self.indent = 0
         self.converting = False
-        self.convert_io = None
-        self.convert_gen = None
-        self.convet_pending_text = None
+        self.convert_parts = []
+        self.convert_pending_start = False  # whether we're in a start tag that might be short
+        self.convert_pending_text = None
         self.convert_begin_indent = None
 
     def _copyAttrsToDict(self, attrs):
@@ -127,52 +138,74 @@ class Converter(saxutils.XMLGenerator):
             out_attrs[k] = v
         return out_attrs
 
-    def _copyStartElementToConversion(self, name, attrs):
+    def _closeConvertedStartTag(self):
+        if self.convert_pending_start:
+            self.convert_parts.append('>')
+            self.convert_pending_start = False
+
+    def _copyStartTagToConversion(self, qname, attrs):
         self._writePendingTextToConversion()
-        self.convert_gen.startElement(name, attrs)
+        self._closeConvertedStartTag()
+        self.convert_parts.append('<' + qname)
+        for k, v in attrs:
+            self.convert_parts.append(' %s=%s' % (k, saxutils.quoteattr(v)))
+        self.convert_pending_start = True
+
+    def _copyStartElementToConversion(self, name, attrs):
+        self._copyStartTagToConversion(name, attrs.items())
 
     def _copyStartElementWithNSToConversion(self, name, qname, attrs):
+        self._copyStartTagToConversion(self._qname(name), ((self._qname(k), v) for k, v in attrs.items()))
+
+    def _copyEndTagToConversion(self, qname):
         self._writePendingTextToConversion()
-        self.convert_gen.startElementNS(name, qname, attrs)
+        if self.convert_pending_start:
+            self.convert_parts.append('/>')
+            self.convert_pending_start = False
+        else:
+            self.convert_parts.append('</%s>' % qname)
 
     def _copyEndElementToConversion(self, name):
-        self._writePendingTextToConversion()
-        self.convert_gen.endElement(name)
+        self._copyEndTagToConversion(name)
 
     def _copyEndElementWithNSToConversion(self, name, qname):
-        self._writePendingTextToConversion()
-        self.convert_gen.endElementNS(name, qname)
+        self._copyEndTagToConversion(self._qname(name))
 
     def _writePendingTextToConversion(self):
         if not self.convert_pending_text:
             return
         converted = mdcToUnicode(self.convert_pending_text)
-        self.convert_gen.characters(converted)
+        self._closeConvertedStartTag()
+        self.convert_parts.append(saxutils.escape(converted))
         self.convert_pending_text = None
 
     def _startConversion(self):
         self.converting = True
         self.convert_begin_indent = self.indent
-        self.convert_io = io.StringIO()
-        self.convert_gen = saxutils.XMLGenerator(
-            out=self.convert_io, encoding=self._encoding, short_empty_elements=self._short_empty_elements
-        )
-        self.convert_gen._ns_contexts.append(self._current_context.copy())
+        self.convert_parts.clear()
+        self.convert_pending_start = False
         self.convert_pending_text = None
 
     def _endConversion(self):
-        if self.converting:
-            self.convert_gen._flush()
-            output = self.convert_io.getvalue()
-            if output:
-                self._write(output)
+        if self.converting and self.convert_parts:
+            self._write(''.join(self.convert_parts))
         self.converting = False
         self.convert_begin_indent = None
-        self.convert_io = None
-        self.convert_gen = None
+        self.convert_parts.clear()
+        self.convert_pending_start = False
         self.convert_pending_text = None
 
+    def _annotatedAttrs(self, name, attrs):
+        """Add any extra attributes the build wants on this element."""
+        extra = self.annotate(name, attrs) if self.annotate else None
+        if not extra:
+            return attrs
+        new_attrs = self._copyAttrsToDict(attrs)
+        new_attrs.update(extra)
+        return new_attrs
+
     def startElement(self, name, attrs):
+        attrs = self._annotatedAttrs(name, attrs)
         super(Converter, self).startElement(name, attrs)
         self.indent += 1
         if name == 'al':
@@ -192,10 +225,10 @@ class Converter(saxutils.XMLGenerator):
         if name[0] is None and name[1] == 'al':
             if self.converting:
                 raise RuntimeError("Can't nest an <al> element inside an <al> element")
-            elif attrs.get('encoding') == 'mdc':
+            elif attrs.get((None, 'encoding')) == 'mdc':
                 self._startConversion()
                 new_attrs = self._copyAttrsToDict(attrs)
-                new_attrs['encoding'] = 'unicode'
+                new_attrs[(None, 'encoding')] = 'unicode'
                 self._copyStartElementWithNSToConversion(name, qname, new_attrs)
         elif self.converting:
             self._copyStartElementWithNSToConversion(name, qname, attrs)
@@ -228,19 +261,17 @@ class Converter(saxutils.XMLGenerator):
         super(Converter, self).ignorableWhitespace(content)
         if self.converting:
             self._writePendingTextToConversion()
-            self.convert_gen.ignorableWhitespace(content)
-
-    def startPrefixMapping(self, prefix, url):
-        if self.converting:
-            self.convert_gen.startPrefixMapping(prefix, url)
+            self._closeConvertedStartTag()
+            self.convert_parts.append(content)
 
-    def endPrefixMapping(self, prefix):
-        if self.converting:
-            self.convert_gen.endPrefixMapping(prefix)
 
+def transform(infile, outfile, annotate=None):
+    """Convert the page XML in infile, writing it to outfile.
 
-def transform(infile, outfile):
-    handler = Converter(out=outfile)
+    annotate, if given, is called with the name and attributes of each
+    element, and returns a dict of attributes to add to it (or None).
+    """
+    handler = Converter(out=outfile, annotate=annotate)
     sax.parse(infile, handler)
 
 
@@ -1,6 +1,7 @@
 import logging
 import os
 import shutil
+import threading
 
 log = logging.getLogger(__name__)
 
@@ -18,3 +19,24 @@ def cleanDirectory(dirpath):
             os.unlink(os.path.join(root, f))
         for d in dirs:
             shutil.rmtree(os.path.join(root, d))
+
+
+def writeFile(path, data, mtime_ns=None):
+    """Write a file by renaming it into place, so as not to disturb what might be linked there.
+
+    data is bytes. If mtime_ns is given, the file is given that
+    modification time. The temporary file's name is unique to the thread,
+    so that threads writing the same file don't trip each other up, and it
+    ends in .tmp, so that it's never published.
+    """
+    tmppath = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmppath, 'wb') as f:
+            f.write(data)
+        if mtime_ns is not None:
+            os.utime(tmppath, ns=(mtime_ns, mtime_ns))
+        os.replace(tmppath, path)
+    except BaseException:
+        if os.path.exists(tmppath):
+            os.unlink(tmppath)
+        raise
@@ -0,0 +1,141 @@
+"""fingerprint gives published assets content-hashed names (e.g.
+js/main.js -> js/main.1a2b3c4d5e.js), so that web servers can tell browsers
+to cache them forever: when an asset changes, so does its name.
+
+The fingerprinted copy is published next to the original, which stays
+where it was. The asset manifest maps each original path to its
+fingerprinted one, both relative to the dist directory, and page2html.xsl
+uses it to refer to the fingerprinted copies.
+
+Assets that refer to other assets are rewritten to refer to their
+fingerprinted copies, before they're fingerprinted themselves: url()s in
+CSS, source maps named by scripts, and buffer and image URIs in glTF
+models.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import re
+from urllib.parse import unquote, urlsplit
+
+from .fileutil import writeFile
+
+log = logging.getLogger(__name__)
+
+HASH_LENGTH = 10
+
+# Files that aren't assets, or that we don't fingerprint.
+EXCLUDED_EXTENSIONS = {'.html', '.gz', '.tmp'}
+
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+_JS_SOURCE_MAP = re.compile(r'^(//[#@]\s*sourceMappingURL=)(\S+)', re.M)
+
+
+def fingerprintedPath(path, digest):
+    base, ext = posixpath.splitext(path)
+    return f'{base}.{digest[:HASH_LENGTH]}{ext}'
+
+
+def loadManifest(path):
+    """Load an asset manifest, returning an empty one if there isn't one."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def saveManifest(path, assets):
+    writeFile(path, json.dumps(assets, indent=1, sort_keys=True).encode('utf-8'))
+
+
+def resolveReference(ref, frompath):
+    """Resolve a URL in the asset at frompath to a dist-relative path, or None if it's external."""
+    if not ref or ref.startswith('#'):
+        return None
+    url = urlsplit(ref)
+    if url.scheme or url.netloc or not url.path:
+        return None
+    if url.path.startswith('/'):
+        return posixpath.normpath(unquote(url.path).lstrip('/'))
+    return posixpath.normpath(posixpath.join(posixpath.dirname(frompath), unquote(url.path)))
+
+
+def rewriteReference(ref, frompath, assets):
+    """Rewrite a URL in the asset at frompath to refer to its target's fingerprinted copy."""
+    path = resolveReference(ref, frompath)
+    if path not in assets:
+        return ref
+    url = urlsplit(ref)
+    if url.path.startswith('/'):
+        newpath = '/' + assets[path]
+    else:
+        newpath = posixpath.relpath(assets[path], posixpath.dirname(frompath) or '.')
+    return url._replace(path=newpath).geturl()
+
+
+def rewriteCss(data: bytes, path, assets) -> bytes:
+    def replace(m):
+        quote, ref = m.group(1), m.group(2).strip()
+        return f'url({quote}{rewriteReference(ref, path, assets)}{quote})'
+    return _CSS_URL.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+
+def rewriteJs(data: bytes, path, assets) -> bytes:
+    def replace(m):
+        return m.group(1) + rewriteReference(m.group(2), path, assets)
+    return _JS_SOURCE_MAP.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+
+def rewriteGltf(data: bytes, path, assets) -> bytes:
+    doc = json.loads(data)
+    for item in doc.get('buffers', []) + doc.get('images', []):
+        if 'uri' in item and not item['uri'].startswith('data:'):
+            item['uri'] = rewriteReference(item['uri'], path, assets)
+    return json.dumps(doc, separators=(',', ':')).encode('utf-8')
+
+
+# Rewriters for assets that refer to other assets, by extension.
+REWRITERS = {
+    '.css': rewriteCss,
+    '.gltf': rewriteGltf,
+    '.js': rewriteJs,
+}
+
+
+def assetFiles(distdir, exclude=()):
+    """List the assets in the dist directory, as dist-relative paths.
+
+    exclude lists files to skip, such as the fingerprinted copies that are
+    already there.
+    """
+    paths = []
+    for dirpath, dirs, files in os.walk(distdir):
+        for f in files:
+            path = os.path.relpath(os.path.join(dirpath, f), distdir).replace(os.sep, '/')
+            if os.path.splitext(f)[1].lower() in EXCLUDED_EXTENSIONS or path in exclude:
+                continue
+            paths.append(path)
+    return sorted(paths)
+
+
+def isRewritable(path):
+    return posixpath.splitext(path)[1].lower() in REWRITERS
+
+
+def rewriteAsset(src, path, assets):
+    """Read the asset at src (whose dist-relative path is path), rewriting its references.
+
+    Returns the rewritten contents, and their hash.
+    """
+    with open(src, 'rb') as f:
+        data = f.read()
+    rewriter = REWRITERS[posixpath.splitext(path)[1].lower()]
+    try:
+        data = rewriter(data, path, assets)
+    except (UnicodeDecodeError, ValueError) as e:
+        log.warning("Couldn't rewrite the references in %s, so fingerprinting it as it is: %s", src, e)
+    return data, hashlib.sha256(data).hexdigest()
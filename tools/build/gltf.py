@@ -0,0 +1,352 @@
+"""gltf reads and writes glTF 2.0 models, for the build stages that optimise
+our models or extract information from them.
+
+We only implement what those stages need: reading accessors into NumPy
+arrays, resolving node transforms, and writing a model back out as a single
+binary GLB file. See https://www.khronos.org/registry/glTF/specs/2.0/glTF-2.0.html
+"""
+
+import base64
+import json
+import logging
+import os
+import struct
+import urllib.parse
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+BYTE = 5120
+UNSIGNED_BYTE = 5121
+SHORT = 5122
+UNSIGNED_SHORT = 5123
+UNSIGNED_INT = 5125
+FLOAT = 5126
+
+COMPONENT_DTYPES = {
+    BYTE: np.dtype('<i1'),
+    UNSIGNED_BYTE: np.dtype('<u1'),
+    SHORT: np.dtype('<i2'),
+    UNSIGNED_SHORT: np.dtype('<u2'),
+    UNSIGNED_INT: np.dtype('<u4'),
+    FLOAT: np.dtype('<f4'),
+}
+
+TYPE_SIZES = {'SCALAR': 1, 'VEC2': 2, 'VEC3': 3, 'VEC4': 4, 'MAT2': 4, 'MAT3': 9, 'MAT4': 16}
+TYPES_BY_SIZE = {1: 'SCALAR', 2: 'VEC2', 3: 'VEC3', 4: 'VEC4', 16: 'MAT4'}
+
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+TRIANGLES = 4
+
+GLB_MAGIC = 0x46546C67  # 'glTF'
+GLB_JSON_CHUNK = 0x4E4F534A  # 'JSON'
+GLB_BIN_CHUNK = 0x004E4942  # 'BIN\0'
+
+MIME_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg'}
+
+
+class GltfError(Exception):
+    """A model couldn't be read, or couldn't be processed the way we wanted."""
+    def __init__(self, message):
+        self.message = message
+
+
+def componentType(dtype):
+    for ctype, ctypedtype in COMPONENT_DTYPES.items():
+        if ctypedtype == np.dtype(dtype).newbyteorder('<'):
+            return ctype
+    raise GltfError(f'No glTF component type for {dtype}')
+
+
+def denormalize(array):
+    """Convert a normalized integer array to the floats it represents."""
+    if array.dtype.kind == 'f':
+        return array.astype(np.float64)
+    info = np.iinfo(array.dtype)
+    return np.maximum(array.astype(np.float64) / info.max, -1.0)
+
+
+def decodeDataUri(uri):
+    header, _, data = uri.partition(',')
+    if header.endswith(';base64'):
+        return base64.b64decode(data)
+    return urllib.parse.unquote_to_bytes(data)
+
+
+def quaternionMatrix(q):
+    """Return the 3x3 rotation matrix for a glTF (x, y, z, w) quaternion."""
+    x, y, z, w = q
+    return np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ])
+
+
+def nodeMatrix(node):
+    """Return a node's local transform as a 4x4 matrix."""
+    if 'matrix' in node:
+        # glTF matrices are column-major.
+        return np.array(node['matrix'], dtype=np.float64).reshape(4, 4).T
+    matrix = np.identity(4)
+    scale = np.array(node.get('scale', [1, 1, 1]), dtype=np.float64)
+    matrix[:3, :3] = quaternionMatrix(node.get('rotation', [0, 0, 0, 1])) * scale
+    matrix[:3, 3] = node.get('translation', [0, 0, 0])
+    return matrix
+
+
+def setNodeMatrix(node, matrix):
+    """Set a node's local transform from a 4x4 matrix."""
+    for key in ['translation', 'rotation', 'scale']:
+        node.pop(key, None)
+    node['matrix'] = [float(v) for v in matrix.T.ravel()]
+
+
+def transformPoints(matrix, points):
+    return points @ matrix[:3, :3].T + matrix[:3, 3]
+
+
+class Gltf:
+    """A glTF model, loaded from a .gltf or .glb file.
+
+    json is the parsed glTF JSON, and buffers holds the contents of each of
+    its buffers.
+    """
+
+    def __init__(self, json, buffers, basedir):
+        self.json = json
+        self.buffers = buffers
+        self.basedir = basedir
+
+    @classmethod
+    def load(cls, path, buffers=True):
+        """Load a model. If buffers is False, only the JSON is loaded."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        basedir = os.path.dirname(path)
+        binchunk = None
+        if len(data) >= 12 and struct.unpack_from('<I', data)[0] == GLB_MAGIC:
+            doc, binchunk = cls._parseGlb(data, path)
+        else:
+            try:
+                doc = json.loads(data.decode('utf-8'))
+            except ValueError as e:
+                raise GltfError(f'{path}: not a glTF file: {e}')
+
+        asset = doc.get('asset') if isinstance(doc, dict) else None
+        if not isinstance(asset, dict) or not str(asset.get('version', '')).startswith('2.'):
+            raise GltfError(f'{path}: only glTF 2.0 models are supported')
+
+        if not buffers:
+            return cls(doc, [], basedir)
+        buffers = []
+        for i, buffer in enumerate(doc.get('buffers', [])):
+            uri = buffer.get('uri')
+            if uri is None:
+                if i != 0 or binchunk is None:
+                    raise GltfError(f'{path}: buffer {i} has no data')
+                buffers.append(binchunk)
+            elif uri.startswith('data:'):
+                buffers.append(decodeDataUri(uri))
+            else:
+                with open(os.path.join(basedir, urllib.parse.unquote(uri)), 'rb') as f:
+                    buffers.append(f.read())
+        return cls(doc, buffers, basedir)
+
+    @staticmethod
+    def _parseGlb(data, path):
+        _, version, length = struct.unpack_from('<III', data)
+        if version != 2:
+            raise GltfError(f'{path}: unsupported GLB version {version}')
+        offset = 12
+        doc = None
+        binchunk = None
+        while offset < length:
+            chunklength, chunktype = struct.unpack_from('<II', data, offset)
+            chunk = data[offset + 8:offset + 8 + chunklength]
+            if chunktype == GLB_JSON_CHUNK:
+                try:
+                    doc = json.loads(chunk.decode('utf-8'))
+                except ValueError as e:
+                    raise GltfError(f'{path}: bad JSON chunk: {e}')
+            elif chunktype == GLB_BIN_CHUNK and binchunk is None:
+                binchunk = chunk
+            offset += 8 + chunklength
+        if doc is None:
+            raise GltfError(f'{path}: GLB file has no JSON chunk')
+        return doc, binchunk
+
+    def bufferViewBytes(self, index):
+        view = self.json['bufferViews'][index]
+        start = view.get('byteOffset', 0)
+        return memoryview(self.buffers[view['buffer']])[start:start + view['byteLength']]
+
+    def _readView(self, viewindex, offset, dtype, count, ncomp):
+        view = self.json['bufferViews'][viewindex]
+        data = self.bufferViewBytes(viewindex)
+        stride = view.get('byteStride') or dtype.itemsize * ncomp
+        array = np.ndarray((count, ncomp), dtype=dtype, buffer=data, offset=offset,
+                           strides=(stride, dtype.itemsize))
+        return array.copy()
+
+    def readAccessor(self, index):
+        """Read an accessor's data, as stored, into a (count, components) array."""
+        accessor = self.json['accessors'][index]
+        dtype = COMPONENT_DTYPES[accessor['componentType']]
+        ncomp = TYPE_SIZES[accessor['type']]
+        count = accessor['count']
+        if 'bufferView' in accessor:
+            array = self._readView(accessor['bufferView'], accessor.get('byteOffset', 0), dtype, count, ncomp)
+        else:
+            array = np.zeros((count, ncomp), dtype=dtype)
+
+        sparse = accessor.get('sparse')
+        if sparse:
+            indexinfo = sparse['indices']
+            indices = self._readView(indexinfo['bufferView'], indexinfo.get('byteOffset', 0),
+                                     COMPONENT_DTYPES[indexinfo['componentType']], sparse['count'], 1)
+            valueinfo = sparse['values']
+            values = self._readView(valueinfo['bufferView'], valueinfo.get('byteOffset', 0),
+                                    dtype, sparse['count'], ncomp)
+            array[indices.ravel()] = values
+        return array
+
+    def readAccessorFloat(self, index):
+        """Read an accessor's data as the floating point values it represents."""
+        array = self.readAccessor(index)
+        if self.json['accessors'][index].get('normalized'):
+            return denormalize(array)
+        return array.astype(np.float64)
+
+    def readIndices(self, primitive):
+        """Read a primitive's vertex indices, making them up if it has none."""
+        if 'indices' in primitive:
+            return self.readAccessor(primitive['indices']).ravel().astype(np.uint32)
+        count = self.json['accessors'][primitive['attributes']['POSITION']]['count']
+        return np.arange(count, dtype=np.uint32)
+
+    def imageBytes(self, index):
+        """Return the encoded data and MIME type of an image."""
+        image = self.json['images'][index]
+        if 'bufferView' in image:
+            return bytes(self.bufferViewBytes(image['bufferView'])), image.get('mimeType')
+        uri = image['uri']
+        if uri.startswith('data:'):
+            mimetype = uri[5:].split(';', 1)[0].split(',', 1)[0]
+            return decodeDataUri(uri), mimetype
+        path = urllib.parse.unquote(uri)
+        with open(os.path.join(self.basedir, path), 'rb') as f:
+            return f.read(), MIME_TYPES.get(os.path.splitext(path)[1].lower())
+
+    def sceneRoots(self):
+        """Return the root nodes of the default scene."""
+        scenes = self.json.get('scenes', [])
+        if not scenes:
+            nodes = self.json.get('nodes', [])
+            children = {c for node in nodes for c in node.get('children', [])}
+            return [i for i in range(len(nodes)) if i not in children]
+        return scenes[self.json.get('scene', 0)].get('nodes', [])
+
+    def worldMatrices(self):
+        """Return the world transform of each node in the default scene, by node index."""
+        nodes = self.json.get('nodes', [])
+        matrices = {}
+        stack = [(root, np.identity(4)) for root in self.sceneRoots()]
+        while stack:
+            index, parent = stack.pop()
+            matrices[index] = parent @ nodeMatrix(nodes[index])
+            stack.extend((child, matrices[index]) for child in nodes[index].get('children', []))
+        return matrices
+
+    def parents(self):
+        """Return the parent of each node that has one, by node index."""
+        return {child: i for i, node in enumerate(self.json.get('nodes', [])) for child in node.get('children', [])}
+
+
+class GltfWriter:
+    """Accumulates the binary data for a new model, and writes it out as GLB.
+
+    Each accessor gets its own buffer view, all in a single buffer.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.bufferViews = []
+        self.accessors = []
+
+    def addBufferView(self, data, target=None, byteStride=None):
+        while len(self.data) % 4:
+            self.data.append(0)
+        view = {'buffer': 0, 'byteOffset': len(self.data), 'byteLength': len(data)}
+        if target is not None:
+            view['target'] = target
+        if byteStride is not None:
+            view['byteStride'] = byteStride
+        self.data.extend(data)
+        self.bufferViews.append(view)
+        return len(self.bufferViews) - 1
+
+    def addAccessor(self, array, normalized=False, target=None, accessortype=None, minmax=False):
+        """Add an accessor for a (count, components) array, returning its index.
+
+        Vertex attribute elements must be aligned to 4 bytes, so we pad
+        them out with a byte stride if necessary.
+        """
+        array = np.ascontiguousarray(array)
+        if array.ndim == 1:
+            array = array.reshape(-1, 1)
+        count, ncomp = array.shape
+        array = array.astype(array.dtype.newbyteorder('<'), copy=False)
+        rowbytes = array.dtype.itemsize * ncomp
+        byteStride = None
+        if target == ARRAY_BUFFER and rowbytes % 4:
+            byteStride = rowbytes + (4 - rowbytes % 4)
+            padded = np.zeros((count, byteStride), dtype=np.uint8)
+            padded[:, :rowbytes] = array.view(np.uint8).reshape(count, rowbytes)
+            data = padded.tobytes()
+        else:
+            data = array.tobytes()
+
+        accessor = {
+            'bufferView': self.addBufferView(data, target=target, byteStride=byteStride),
+            'componentType': componentType(array.dtype),
+            'count': count,
+            'type': accessortype or TYPES_BY_SIZE[ncomp],
+        }
+        if normalized:
+            accessor['normalized'] = True
+        if minmax and count:
+            cast = float if array.dtype.kind == 'f' else int
+            accessor['min'] = [cast(v) for v in array.min(axis=0)]
+            accessor['max'] = [cast(v) for v in array.max(axis=0)]
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+    def toGlb(self, doc):
+        """Return GLB file contents for the given glTF JSON, using our binary data."""
+        doc = dict(doc)
+        doc['accessors'] = self.accessors
+        doc['bufferViews'] = self.bufferViews
+        doc['buffers'] = [{'byteLength': len(self.data)}] if self.data else []
+        if not doc['accessors']:
+            del doc['accessors']
+        if not doc['bufferViews']:
+            del doc['bufferViews']
+        if not doc['buffers']:
+            del doc['buffers']
+
+        jsonchunk = json.dumps(doc, separators=(',', ':')).encode('utf-8')
+        jsonchunk += b' ' * (-len(jsonchunk) % 4)
+        binchunk = bytes(self.data) + b'\0' * (-len(self.data) % 4)
+        length = 12 + 8 + len(jsonchunk)
+        if binchunk:
+            length += 8 + len(binchunk)
+
+        out = bytearray(struct.pack('<III', GLB_MAGIC, 2, length))
+        out += struct.pack('<II', len(jsonchunk), GLB_JSON_CHUNK) + jsonchunk
+        if binchunk:
+            out += struct.pack('<II', len(binchunk), GLB_BIN_CHUNK) + binchunk
+        return bytes(out)
@@ -0,0 +1,493 @@
+"""htmlrender renders the site's HTML in Python, without Java: it makes the
+same HTML from the converted site and page XML as site2html.xsl and
+page2html.xsl do (see --html-renderer). Each function here that renders
+part of a page names the template it stands in for, so any change to the
+stylesheets has to be made here too. --html-renderer compare runs both and
+checks that they agree.
+
+Pages are rendered to a small tree of Elements, which is written out the
+way Saxon's HTML serializer does: void elements have no end tag, script
+contents aren't escaped, and elements that hold only other (block)
+elements are indented. Whitespace in the page XML is kept as it is.
+
+compareHtml compares two renderings of a page after normalising away what
+a browser ignores: whitespace between elements and within text, the order
+of attributes, and how empty elements and entities are written.
+"""
+
+import difflib
+import html.parser
+import math
+import re
+from decimal import Decimal
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+XML_NS = 'http://www.w3.org/XML/1998/namespace'
+
+# Elements that never have content or an end tag.
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param',
+                 'source', 'track', 'wbr'}
+
+# Elements whose contents aren't escaped.
+RAW_TEXT_ELEMENTS = {'script', 'style'}
+
+# Elements that flow with the text around them, so can't be indented.
+INLINE_ELEMENTS = {'a', 'abbr', 'b', 'button', 'code', 'em', 'i', 'img', 'input', 'label', 'small', 'span',
+                   'strong', 'sub', 'sup', 'svg', 'use'}
+
+INDENT = '   '
+
+# The most lines of differences to report for a file.
+MAX_DIFF_LINES = 40
+
+_PREFIXES = {XLINK_NS: 'xlink', XML_NS: 'xml'}
+
+
+class RenderMismatch(Exception):
+    """The Python renderer's HTML differs from BuildSite's."""
+    def __init__(self, mismatches):
+        # Maps each file to the lines of a diff between the two.
+        self.mismatches = mismatches
+
+    @property
+    def message(self) -> str:
+        lines = [f'{len(self.mismatches)} file(s) rendered differently by XSLT and Python:']
+        for path, diff in sorted(self.mismatches.items()):
+            lines.append(f'  {path}')
+            lines.extend(f'    {line}' for line in diff)
+        return '\n'.join(lines)
+
+
+class Raw(str):
+    """Text that's written as it is, like xsl:text with disable-output-escaping."""
+
+
+class Element:
+    """An element of the HTML we're rendering."""
+    __slots__ = ('tag', 'attrs', 'children')
+
+    def __init__(self, tag, attrs=None, *children):
+        self.tag = tag
+        self.attrs = dict(attrs or {})
+        self.children = list(children)
+
+    def append(self, child):
+        self.children.append(child)
+        return child
+
+
+def _name(qname):
+    """The name to write for an ElementTree tag or attribute name."""
+    if not qname.startswith('{'):
+        return qname
+    ns, local = qname[1:].split('}', 1)
+    return f'{_PREFIXES[ns]}:{local}' if ns in _PREFIXES else local
+
+
+def fromEtree(e) -> Element:
+    """Copy an ElementTree element (without its tail) and its contents, like xsl:copy-of."""
+    element = Element(_name(e.tag), {_name(k): v for k, v in e.attrib.items()})
+    if e.text:
+        element.append(e.text)
+    for child in e:
+        element.append(fromEtree(child))
+        if child.tail:
+            element.append(child.tail)
+    return element
+
+
+def _escapeText(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _escapeAttr(value):
+    return _escapeText(value).replace('"', '&quot;')
+
+
+def _isBlock(element):
+    """Whether element's children can go on lines of their own: they're all block elements."""
+    return (element.tag not in INLINE_ELEMENTS and element.tag not in RAW_TEXT_ELEMENTS and
+            bool(element.children) and
+            all(isinstance(c, Element) and c.tag not in INLINE_ELEMENTS for c in element.children))
+
+
+def _write(out, element, level):
+    out.append('<' + element.tag)
+    for name, value in element.attrs.items():
+        out.append(f' {name}="{_escapeAttr(value)}"')
+    out.append('>')
+    if element.tag in VOID_ELEMENTS:
+        return
+    block = _isBlock(element)
+    for child in element.children:
+        if block:
+            out.append('\n' + INDENT * (level + 1))
+        if isinstance(child, Element):
+            _write(out, child, level + 1)
+        elif isinstance(child, Raw) or element.tag in RAW_TEXT_ELEMENTS:
+            out.append(child)
+        else:
+            out.append(_escapeText(child))
+    if block:
+        out.append('\n' + INDENT * level)
+    out.append(f'</{element.tag}>')
+
+
+def serialize(root: Element) -> str:
+    """Write out an HTML document, as Saxon's HTML serializer (with indent="yes", version="5.0") does."""
+    out = ['<!DOCTYPE HTML>\n']
+    _write(out, root, 0)
+    out.append('\n')
+    return ''.join(out)
+
+
+def _string(element):
+    return ''.join(element.itertext()) if element is not None else ''
+
+
+def _value(parent, tag):
+    """The string value of parent's tag children, as xsl:value-of gives it."""
+    return ' '.join(_string(e) for e in parent.findall(tag))
+
+
+def _head(title):
+    """The start of every page's head. Saxon adds the content type."""
+    return Element('head', None,
+                   Element('meta', {'http-equiv': 'Content-Type', 'content': 'text/html; charset=UTF-8'}),
+                   title)
+
+
+# JSON, as xml-to-json writes it.
+
+_JSON_ESCAPES = {'"': '\\"', '\\': '\\\\', '/': '\\/', '\b': '\\b', '\f': '\\f', '\n': '\\n', '\r': '\\r',
+                 '\t': '\\t'}
+_JSON_ESCAPED = re.compile('["\\\\/\x00-\x1f\x7f-\x9f]')
+
+
+def jsonString(text):
+    return '"' + _JSON_ESCAPED.sub(lambda m: _JSON_ESCAPES.get(m.group(), '\\u%04X' % ord(m.group())), text) + '"'
+
+
+def jsonNumber(text):
+    """Write a number as xml-to-json does: as xs:string(xs:double(text))."""
+    value = float(text)
+    if math.isnan(value) or math.isinf(value):
+        raise ValueError(f'Not a JSON number: {text}')
+    if value == 0:
+        return '-0' if math.copysign(1, value) < 0 else '0'
+    decimal = Decimal(repr(value))
+    if 1e-6 <= abs(value) < 1e6:
+        text = format(decimal, 'f')
+        return text.rstrip('0').rstrip('.') if '.' in text else text
+    sign, digits, exponent = decimal.as_tuple()
+    mantissa = str(digits[0]) + '.' + (''.join(map(str, digits[1:])).rstrip('0') or '0')
+    return ('-' if sign else '') + f'{mantissa}E{exponent + len(digits) - 1}'
+
+
+def jsonArray(items):
+    return '[' + ','.join(items) + ']'
+
+
+def jsonVector(vector):
+    """A vector attribute (numbers separated by spaces), as a JSON array: vector-codegen."""
+    return jsonArray(jsonNumber(n) for n in vector.split())
+
+
+# page2html.xsl
+
+_LINK_VECTORS = ('center', 'min', 'max', 'normal')
+
+_MODEL_SCRIPT = """
+      document.addEventListener('DOMContentLoaded', () => {{
+        const gModelName = {name};
+        const gModelLinks = {links};
+        const gModelLods = {lods};
+        const gTextureSizes = {textures};
+        const gModelBvh = {bvh};
+        const gModelOffset = {offset};
+        const gController = new ModelController(gModelName, gModelLinks, gModelLods, gTextureSizes, gModelBvh,
+                                                gModelOffset);
+        gController.run();
+      }});
+    """
+
+_CONTROLS = [
+    """
+                 Hold the Alt (Option on a mac) key and left-click an area to highlight a text and see its \
+translation in the panel to the right.
+              """,
+    'Left click and drag to rotate.',
+    """
+                Shift+click or right click and drag to pan right and left.
+                The arrow keys on your keyboard will also pan.
+              """,
+    """
+                To dolly or zoom, you can use the middle mouse button,
+              or you can pinch two fingers on your Mac mouse or trackpad.
+              """,
+]
+
+
+class PageRenderer:
+    """Renders a page's converted XML, as page2html.xsl does.
+
+    assets is the asset manifest (see local:asset), and load loads XML
+    from a path relative to the build directory (the stylesheet's
+    srcdir).
+    """
+
+    def __init__(self, assets, load):
+        self.assets = assets
+        self.load = load
+
+    def asset(self, path):
+        """The path to refer to an asset by: local:asset."""
+        return self.assets.get(path, path)
+
+    def render(self, page) -> Element:
+        """The page template."""
+        name = _value(page, 'name')
+        creator = _value(page, 'creator')
+        title = Element('title', None, Raw('3D Coffins' + ' ' * 97 + '&ndash;'), name)
+        head = _head(title)
+        head.children += [
+            Element('meta', {'name': 'DC.Creator', 'value': creator}),
+            Element('link', {'rel': 'schema.DC', 'href': 'http://purl.org/DC/elements/1.0/'}),
+            Element('link', {'rel': 'stylesheet', 'type': 'text/css', 'href': self.asset('css/viewer.min.css')}),
+            Element('script', {'defer': 'defer', 'src': self.asset('js/viewer.js')}),
+        ]
+        body = Element('body')
+        sprites = self.inlineSprites(page)
+        if sprites is not None:
+            body.append(sprites)
+        body.append(Element('div', {'id': 'nav_container'}, Element('nav', None, Element('ul', None, Element(
+            'li', None, Element('button', {'id': 'control_button', 'onclick': 'overlay_show()', 'alt': 'Control Help'}))))))
+        body.append(Element('div', {'id': 'controls_overlay', 'onclick': 'overlay_hide()'}, Element(
+            'div', {'id': 'controls_container'},
+            Element('h1', None, 'Controls'),
+            Element('ul', None, *(Element('li', None, text) for text in _CONTROLS)))))
+        body.append(Element('div', {'id': 'left'}, Element('div', {'id': 'loading'}), Element('div', {'id': 'viewer'})))
+
+        top = Element('div', {'id': 'right-top'},
+                      Element('h1', {'class': 'page_title'}, name),
+                      Element('h4', {'class': 'author'}, creator))
+        for tag in ('description', 'texts'):
+            p = top.append(Element('p'))
+            for e in page.findall(tag):
+                self.apply(e, p, [])
+        footnotes = Element('div', {'id': 'footnotes'})
+        for e in page.findall('footnotes'):
+            self.apply(e, footnotes, [])
+        body.append(Element('div', {'id': 'right'}, top, Element('div', {'id': 'right-bottom'}, footnotes)))
+        for model in page.findall('model'):
+            body.append(self.modelScript(model))
+        return Element('html', None, head, body)
+
+    def inlineSprites(self, page):
+        """An inlined sprite sheet, which the build left in the build directory: inline-sprites."""
+        sprites = next((e.get('inline-sprite') for e in page.iter('himg') if e.get('inline-sprite')), None)
+        if not sprites:
+            return None
+        svg = Element('svg', {'xmlns': SVG_NS, 'width': '0', 'height': '0', 'style': 'position: absolute',
+                              'aria-hidden': 'true'})
+        svg.children += [fromEtree(e) for e in self.load(sprites)]
+        return svg
+
+    def modelScript(self, model):
+        """The model's script, which starts the viewer: the model template, in codegen mode."""
+        links = []
+        for link in model.findall('link'):
+            items = [f'"name":{jsonString(link.get("name", ""))}', f'"ref":{jsonString(link.get("ref", ""))}']
+            if link.get('node') is not None:
+                items.append(f'"node":{jsonNumber(link.get("node"))}')
+            items += [f'{jsonString(k)}:{jsonVector(v)}' for k, v in link.attrib.items() if k in _LINK_VECTORS]
+            links.append('{' + ','.join(items) + '}')
+        model_name = model.get('packed') if model.get('packed') is not None else model.get('dest', '')
+        script = _MODEL_SCRIPT.format(
+            name=jsonString(self.asset(model_name)),
+            links=jsonArray(links),
+            lods=jsonArray(jsonString(self.asset(lod)) for lod in model.get('lods', '').split()),
+            textures=jsonArray(jsonNumber(size) for size in model.get('textures', '').split()),
+            bvh=jsonString(self.asset(model.get('bvh'))) if model.get('bvh') is not None else 'null',
+            offset=jsonVector(model.get('offset')) if model.get('offset') is not None else 'null',
+        )
+        return Element('script', None, script)
+
+    def apply(self, e, out, numbers, inTexts=False, inContents=False):
+        """Render e (an element of the page) into out, as xsl:apply-templates does.
+
+        numbers is the xsl:number of e's nearest text or fragment, within
+        texts.
+        """
+        tag = e.tag
+        if tag in ('desc', 'hi'):
+            return
+        if tag == 'al' and e.get('encoding') == 'mdc':
+            return
+        if tag in ('p', 'div', 'a', 'em', 'span'):
+            # xsl:copy, which leaves the attributes behind.
+            out = out.append(Element(tag))
+        elif tag == 'fnref':
+            num = e.get('num', '')
+            out.append(Element('a', {'id': f'fnref{num}', 'href': f'#fn{num}', 'class': 'footnote-ref'},
+                               Element('sup', None, num)))
+            return
+        elif tag == 'footnotes':
+            out.append(Element('h2', None, 'Notes'))
+            out = out.append(Element('ul'))
+        elif tag == 'fn':
+            num = e.get('num', '')
+            li = out.append(Element('li', {'id': f'fn{num}', 'class': 'footnote'}, Element('sup', None, num), ' '))
+            self.applyChildren(e, li, numbers, inTexts, inContents)
+            li.children += [' ', Element('a', {'href': f'#fnref{num}'}, '↩')]
+            return
+        elif tag == 'texts':
+            out.append(Element('h2', None, 'Texts'))
+            numbers = []
+            inTexts = True
+        elif tag in ('text', 'frag'):
+            id = e.get('id', '')
+            div = out.append(Element('div', {'class': 'text' if tag == 'text' else 'text-fragment', 'id': id}))
+            if tag == 'frag' or e.find('frag') is None:
+                div.append(Element('a', {'class': 'model-link', 'data-text-id': id, 'href': '#'},
+                                   '.'.join(map(str, numbers)) + '.'))
+            out = div
+        elif tag == 'himg':
+            out.append(self.image(e))
+            return
+        elif tag == 'al' and e.get('encoding') == 'unicode' and (inTexts or inContents):
+            out = out.append(Element('p' if inTexts else 'span', {'class': 'al'}))
+        elif tag == 'tr':
+            out = out.append(Element('p', {'class': 'tr', 'xml:lang': e.get('{%s}lang' % XML_NS, '')}))
+        elif tag == 'contents':
+            inContents = True
+        self.applyChildren(e, out, numbers, inTexts, inContents)
+
+    def applyChildren(self, e, out, numbers, inTexts, inContents):
+        if e.text:
+            out.append(e.text)
+        count = 0
+        for child in e:
+            childnumbers = numbers
+            if child.tag in ('text', 'frag'):
+                count += 1
+                childnumbers = numbers + [count]
+            self.apply(child, out, childnumbers, inTexts, inContents)
+            if child.tail:
+                out.append(child.tail)
+
+    def image(self, himg):
+        """A hieroglyph image: the himg templates."""
+        if himg.get('symbol') is None:
+            return Element('div', {'class': 'hi-container'},
+                           Element('img', {'class': 'hi', 'src': self.asset(himg.get('dest', ''))}))
+        svg = Element('svg', {'xmlns': SVG_NS, 'class': 'hi', 'viewBox': himg.get('viewBox', '')})
+        svg.attrs.update((k, v) for k, v in himg.attrib.items() if k in ('width', 'height'))
+        sprite = self.asset(himg.get('sprite')) if himg.get('sprite') is not None else ''
+        svg.append(Element('use', {'href': f'{sprite}#{himg.get("symbol")}'}))
+        return Element('div', {'class': 'hi-container'}, svg)
+
+
+def renderPage(page, assets, load) -> str:
+    """Render the HTML for a page, given its converted XML. See PageRenderer."""
+    return serialize(PageRenderer(assets, load).render(page))
+
+
+# site2html.xsl
+
+_SEARCH_SCRIPT = """
+          document.addEventListener('DOMContentLoaded', () => {
+            const gSearchBox = new SearchBox(document.getElementById('search'),
+              document.getElementById('search-results'), new SearchIndex('%s'));
+          });
+        """
+
+
+def renderSite(site, assets, load) -> str:
+    """Render the site index, as site2html.xsl does, given the converted site XML.
+
+    assets is the asset manifest, and load loads each page's converted
+    XML, from its path relative to the build directory.
+    """
+    head = _head(Element('title', None, 'The Book of the Dead in 3D'))
+    head.children += [
+        Element('meta', {'description': 'Translations of texts on 3D models of coffins.'}),
+        Element('script', {'defer': 'defer', 'src': assets.get('js/search.js', 'js/search.js')}),
+    ]
+    pages = Element('ul')
+    for page in site.findall('page'):
+        doc = load(page.get('href', ''))
+        pages.append(Element('li', None, Element('a', {'href': doc.get('dest', '')}, _value(doc, 'name'))))
+    body = Element('body', None,
+                   Element('div', {'class': 'search'},
+                           Element('input', {'type': 'search', 'id': 'search', 'autocomplete': 'off',
+                                             'placeholder': 'Search translations, transliterations and signs',
+                                             'aria-label': 'Search'}),
+                           Element('ul', {'id': 'search-results'})),
+                   Element('script', None, _SEARCH_SCRIPT % assets.get('search/index.json', 'search/index.json')),
+                   Element('div', {'class': 'main-contents'}, pages))
+    return serialize(Element('html', None, head, body))
+
+
+# Comparing renderings.
+
+class _Normaliser(html.parser.HTMLParser):
+    """Reduces HTML to a list of lines: a tag or a run of text on each, indented by depth."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self.text = []
+        self.depth = 0
+
+    def _flush(self):
+        text = ' '.join(''.join(self.text).split())
+        self.text = []
+        if text:
+            self.lines.append('  ' * self.depth + text)
+
+    def handle_decl(self, decl):
+        self._flush()
+        self.lines.append(f'<!{decl.lower()}>')
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        attrs = sorted((k, k if v is None else v) for k, v in attrs if k != 'xmlns' and not k.startswith('xmlns:'))
+        self.lines.append('  ' * self.depth + '<' + tag + ''.join(f' {k}="{v}"' for k, v in attrs) + '>')
+        if tag not in VOID_ELEMENTS:
+            self.depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in VOID_ELEMENTS:
+            return
+        self._flush()
+        self.depth -= 1
+        self.lines.append('  ' * self.depth + f'</{tag}>')
+
+    def handle_data(self, data):
+        self.text.append(data)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def normalise(text):
+    """Reduce HTML to lines that are the same for any two renderings a browser can't tell apart."""
+    normaliser = _Normaliser()
+    normaliser.feed(text)
+    normaliser.close()
+    return normaliser.lines
+
+
+def compareHtml(expected, actual, fromfile='expected', tofile='actual'):
+    """Compare two renderings of a page, returning the lines of a diff between them (or [] if they agree)."""
+    diff = list(difflib.unified_diff(normalise(expected), normalise(actual), fromfile, tofile, lineterm=''))
+    if len(diff) > MAX_DIFF_LINES:
+        diff = diff[:MAX_DIFF_LINES] + [f'... and {len(diff) - MAX_DIFF_LINES} more line(s)']
+    return diff
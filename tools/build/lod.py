@@ -0,0 +1,306 @@
+"""lod makes levels of detail (LODs) for a model: packed copies of it (see
+packmodel) whose meshes have been simplified to a fraction of their
+triangles. The viewer loads the coarsest first, so that the model can be
+looked at and clicked on as soon as possible, and swaps in finer ones as
+they arrive.
+
+Meshes are simplified by quadric error metric edge collapse (Garland and
+Heckbert, "Surface Simplification Using Quadric Error Metrics", 1997),
+which repeatedly merges the pair of neighbouring vertices that moves the
+surface least. Collapsing edges one at a time is far too slow in Python
+for photogrammetry meshes, so we collapse them in batches, NumPy-style:
+each pass collapses every edge that's the cheapest of all the edges
+around both of its vertices, so no two collapses in a pass touch the same
+vertex. Each collapse keeps one of its vertices, with its attributes, so
+there's nothing to interpolate.
+
+We don't move the edges of a mesh, nor the seams where its texture is cut
+(where vertices share a position, but not texture coordinates), so that
+holes and cracks don't open up, and we don't touch the meshes of the nodes
+that page links refer to, so hitboxes stay exactly where they were. Nodes
+are never added, removed or renamed, so links work the same on every LOD.
+"""
+
+import logging
+import os
+
+import numpy as np
+
+from . import gltf
+from .fileutil import writeFile
+from .packmodel import ModelPacker
+
+log = logging.getLogger(__name__)
+
+# The fraction of each simplified mesh's triangles that each LOD keeps,
+# finest first.
+LOD_RATIOS = [0.25, 0.05]
+
+# Don't bother making an LOD with fewer triangles than this to simplify.
+MIN_TRIANGLES = 5000
+
+# How much more it costs to move the edge of a mesh than its surface.
+BOUNDARY_WEIGHT = 1000.0
+
+# Don't collapse an edge if it turns a triangle by more than this (the cosine of 60 degrees).
+MAX_TURN = 0.5
+
+# How many passes a vertex sits out after its collapse is rejected.
+BLOCKED_PASSES = 3
+
+# How many times to look for more edges to collapse in each pass.
+MATCHING_ROUNDS = 4
+
+# Give up once a pass collapses fewer than this fraction of the edges it needs to.
+MIN_PROGRESS = 0.01
+
+
+def lodPath(dest, level):
+    """Where the given LOD of a model published at dest goes. Higher levels are coarser."""
+    return f'{os.path.splitext(dest)[0]}.lod{level}.glb'
+
+
+def _triangleCounts(model, keepmeshes):
+    """Count the triangles in each primitive we'd simplify, by (mesh index, primitive index)."""
+    counts = {}
+    accessors = model.json.get('accessors', [])
+    for i, mesh in enumerate(model.json.get('meshes', [])):
+        if i in keepmeshes:
+            continue
+        for j, primitive in enumerate(mesh['primitives']):
+            if primitive.get('mode', gltf.TRIANGLES) != gltf.TRIANGLES or primitive.get('targets'):
+                continue
+            if 'indices' in primitive:
+                counts[(i, j)] = accessors[primitive['indices']]['count'] // 3
+            elif 'POSITION' in primitive['attributes']:
+                counts[(i, j)] = accessors[primitive['attributes']['POSITION']]['count'] // 3
+    return counts
+
+
+def _keptMeshes(model, keepnodes):
+    nodes = model.json.get('nodes', [])
+    return {nodes[i]['mesh'] for i in keepnodes if i < len(nodes) and 'mesh' in nodes[i]}
+
+
+def lodLevels(src, keepnodes=()):
+    """Decide which LODs to make for the model at src, returning their levels (from 1, finest first).
+
+    Only the model's JSON is read, so this is cheap.
+    """
+    model = gltf.Gltf.load(src, buffers=False)
+    triangles = sum(_triangleCounts(model, _keptMeshes(model, keepnodes)).values())
+    return [level for level, ratio in enumerate(LOD_RATIOS, 1) if triangles * ratio >= MIN_TRIANGLES]
+
+
+def _faceQuadrics(points, tris):
+    """Return each triangle's area-weighted plane quadric, as a (n, 4, 4) array."""
+    a, b, c = points[tris[:, 0]], points[tris[:, 1]], points[tris[:, 2]]
+    normals = np.cross(b - a, c - a)
+    doublearea = np.linalg.norm(normals, axis=1)
+    normals /= np.maximum(doublearea, 1e-30)[:, None]
+    planes = np.hstack([normals, -np.einsum('ij,ij->i', normals, a)[:, None]])
+    return np.einsum('ni,nj->nij', planes, planes) * (doublearea / 2)[:, None, None]
+
+
+def _edges(tris):
+    """List each triangle's edges, as (n * 3, 2) vertex pairs, the lower vertex first."""
+    edges = np.concatenate([tris[:, [0, 1]], tris[:, [1, 2]], tris[:, [2, 0]]])
+    edges.sort(axis=1)
+    return edges
+
+
+def _boundaryQuadrics(points, tris, nvertices):
+    """Return quadrics that make moving the edges of the mesh expensive, summed by vertex.
+
+    For each edge that only one triangle uses, there's a plane through the
+    edge, perpendicular to the triangle.
+    """
+    edges = np.concatenate([tris[:, [0, 1]], tris[:, [1, 2]], tris[:, [2, 0]]])
+    others = np.concatenate([tris[:, 2], tris[:, 0], tris[:, 1]])
+    _, inverse, counts = np.unique(np.sort(edges, axis=1), axis=0, return_inverse=True, return_counts=True)
+    boundary = counts[inverse.reshape(-1)] == 1
+    edges, others = edges[boundary], others[boundary]
+
+    quadrics = np.zeros((nvertices, 4, 4))
+    if not len(edges):
+        return quadrics
+    a, b, c = points[edges[:, 0]], points[edges[:, 1]], points[others]
+    direction = b - a
+    facenormal = np.cross(direction, c - a)
+    normals = np.cross(direction, facenormal)
+    normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-30)[:, None]
+    planes = np.hstack([normals, -np.einsum('ij,ij->i', normals, a)[:, None]])
+    weights = BOUNDARY_WEIGHT * np.einsum('ij,ij->i', direction, direction)
+    edgequadrics = np.einsum('ni,nj->nij', planes, planes) * weights[:, None, None]
+    np.add.at(quadrics, edges[:, 0], edgequadrics)
+    np.add.at(quadrics, edges[:, 1], edgequadrics)
+    return quadrics
+
+
+def _quadricCost(quadrics, points):
+    homogeneous = np.hstack([points, np.ones((len(points), 1))])
+    return np.einsum('ni,nij,nj->n', homogeneous, quadrics, homogeneous)
+
+
+def _faceNormals(points, tris):
+    return np.cross(points[tris[:, 1]] - points[tris[:, 0]], points[tris[:, 2]] - points[tris[:, 0]])
+
+
+def _turned(points, before, after):
+    """Check whether triangles turned further than MAX_TURN, or collapsed to nothing."""
+    old = _faceNormals(points, before)
+    new = _faceNormals(points, after)
+    dot = np.einsum('ij,ij->i', old, new)
+    return dot <= MAX_TURN * np.linalg.norm(old, axis=1) * np.linalg.norm(new, axis=1)
+
+
+def _degenerate(tris):
+    return (tris[:, 0] == tris[:, 1]) | (tris[:, 1] == tris[:, 2]) | (tris[:, 2] == tris[:, 0])
+
+
+def _independentEdges(a, b, order, nvertices):
+    """Choose edges to collapse together, no two of which share a vertex.
+
+    a and b are the edges' vertices, and order lists the edges to choose
+    from, cheapest first. We choose the edges that are the cheapest around
+    both their ends, then do the same with the edges that don't touch
+    those, and so on for a few rounds.
+    """
+    chosen = []
+    used = np.zeros(nvertices, dtype=bool)
+    for _ in range(MATCHING_ROUNDS):
+        order = order[~(used[a[order]] | used[b[order]])]
+        if not len(order):
+            break
+        # Ranks break ties, so each vertex has exactly one cheapest edge.
+        rank = np.arange(len(order))
+        best = np.full(nvertices, len(order))
+        np.minimum.at(best, a[order], rank)
+        np.minimum.at(best, b[order], rank)
+        picked = order[(best[a[order]] == rank) & (best[b[order]] == rank)]
+        used[a[picked]] = True
+        used[b[picked]] = True
+        chosen.append(picked)
+    return np.concatenate(chosen) if chosen else order[:0]
+
+
+def simplify(positions, vertexkeys, indices, ratio):
+    """Simplify a triangle mesh by quadric edge collapse, to about ratio of its triangles.
+
+    positions are the vertex positions, and vertexkeys a (vertices, n)
+    array of anything else that distinguishes them (their attributes, as
+    bytes): vertices whose keys and positions both match are one and the
+    same. Returns new indices into the same vertices.
+    """
+    if len(indices) == 0:
+        return indices
+    # Find the distinct vertices, and which of them share positions (along seams).
+    rows = np.hstack([np.ascontiguousarray(positions, dtype=np.float64).view(np.uint8).reshape(len(positions), -1),
+                      vertexkeys])
+    _, first, inverse = np.unique(rows, axis=0, return_index=True, return_inverse=True)
+    points = positions[first].astype(np.float64)
+    tris = inverse.reshape(-1)[indices].reshape(-1, 3)
+    tris = tris[~_degenerate(tris)]
+    _, positionids, sharing = np.unique(points, axis=0, return_inverse=True, return_counts=True)
+    locked = sharing[positionids.reshape(-1)] > 1
+
+    quadrics = np.zeros((len(points), 4, 4))
+    facequadrics = _faceQuadrics(points, tris)
+    for k in range(3):
+        np.add.at(quadrics, tris[:, k], facequadrics)
+    quadrics += _boundaryQuadrics(points, tris, len(points))
+
+    # Vertices whose collapse would have turned a triangle over sit out the
+    # next few passes, so that the surface around them has a chance to change.
+    blocked = np.zeros(len(points), dtype=np.int64)
+    target = max(int(len(tris) * ratio), 1)
+    passes = 0
+    while len(tris) > target:
+        passes += 1
+        fixed = locked | (blocked > passes)
+        edges = np.unique(_edges(tris), axis=0)
+        a, b = edges[:, 0], edges[:, 1]
+        combined = quadrics[a] + quadrics[b]
+        # Collapse each edge towards whichever end moves the surface least.
+        tob = np.where(fixed[a], np.inf, _quadricCost(combined, points[b]))
+        toa = np.where(fixed[b], np.inf, _quadricCost(combined, points[a]))
+        cost = np.minimum(tob, toa)
+        keep = np.where(tob <= toa, b, a)
+        remove = np.where(tob <= toa, a, b)
+        candidates = np.flatnonzero(np.isfinite(cost))
+        if not len(candidates):
+            break
+
+        # Only consider the cheaper half of the edges each pass, so that the
+        # batches don't stray far from collapsing the cheapest edges first.
+        order = candidates[np.argsort(cost[candidates], kind='stable')]
+        order = order[:max(len(order) // 2, 1)]
+        chosen = _independentEdges(a, b, order, len(points))
+        # Each collapse removes about two triangles; don't overshoot.
+        chosen = chosen[np.argsort(cost[chosen], kind='stable')][:max((len(tris) - target) // 2, 1)]
+
+        # Don't collapse anything that would turn a triangle (too far) over.
+        for _ in range(MATCHING_ROUNDS):
+            remap = np.arange(len(points))
+            remap[remove[chosen]] = keep[chosen]
+            newtris = remap[tris]
+            moved = np.flatnonzero((newtris != tris).any(axis=1) & ~_degenerate(newtris))
+            flipped = moved[_turned(points, tris[moved], newtris[moved])]
+            if not len(flipped):
+                break
+            undo = np.intersect1d(tris[flipped].ravel(), remove[chosen])
+            chosen = chosen[~np.isin(remove[chosen], undo)]
+            blocked[undo] = passes + BLOCKED_PASSES
+        else:
+            break
+        if len(chosen) < MIN_PROGRESS * (len(tris) - target) / 2:
+            break
+
+        np.add.at(quadrics, keep[chosen], quadrics[remove[chosen]])
+        tris = newtris[~_degenerate(newtris)]
+
+    return first[tris].reshape(-1).astype(np.uint32)
+
+
+def _primitiveKeys(model, primitive):
+    """The bytes of every attribute but the position, for each of a primitive's vertices."""
+    count = model.json['accessors'][primitive['attributes']['POSITION']]['count']
+    keys = [np.ascontiguousarray(model.readAccessor(index)).view(np.uint8).reshape(count, -1)
+            for name, index in sorted(primitive['attributes'].items()) if name != 'POSITION']
+    return np.hstack(keys) if keys else np.zeros((count, 0), dtype=np.uint8)
+
+
+def makeLods(src, dests, keepnodes=(), images=None, offset=None):
+    """Make LODs of the model at src, writing them to dests (finest first).
+
+    dests must have as many entries as lodLevels returned. The meshes of
+    the nodes in keepnodes are left alone. images and offset are as for
+    ModelPacker.
+    Returns the number of triangles in each LOD.
+    """
+    model = gltf.Gltf.load(src)
+    counts = _triangleCounts(model, _keptMeshes(model, keepnodes))
+    indices = {}
+    for (i, j) in counts:
+        primitive = model.json['meshes'][i]['primitives'][j]
+        indices[(i, j)] = model.readIndices(primitive)
+    simplified = {key: len(value) // 3 for key, value in indices.items()}
+
+    triangles = []
+    ratio = 1.0
+    for dest, lodratio in zip(dests, LOD_RATIOS):
+        # Each LOD is simplified from the one before, which is quicker than
+        # starting again from the full model, and just as good.
+        for (i, j), current in list(indices.items()):
+            primitive = model.json['meshes'][i]['primitives'][j]
+            if counts[(i, j)] * lodratio < 1 or 'POSITION' not in primitive['attributes']:
+                continue
+            positions = model.readAccessorFloat(primitive['attributes']['POSITION'])
+            indices[(i, j)] = simplify(positions, _primitiveKeys(model, primitive), current, lodratio / ratio)
+            simplified[(i, j)] = len(indices[(i, j)]) // 3
+        ratio = lodratio
+        writeFile(dest, ModelPacker(model, indices, images, offset).pack())
+        total = sum(simplified.values())
+        log.info('Made LOD %s: %d of %d triangles', dest, total, sum(counts.values()))
+        triangles.append(total)
+    return triangles
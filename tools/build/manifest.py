@@ -0,0 +1,134 @@
+"""manifest records what went into each stage of a successful build, so that
+an incremental build can skip the stages whose inputs haven't changed.
+
+Each stage is identified by a key (e.g. 'convert:src/iwefaa.xml'), and is
+described by its input files, optionally the output files it produces, and
+optionally some JSON-serializable parameters that also affect its output.
+A stage is stale if the combined hash of its inputs differs from the one
+recorded in the last successful build, or if any of its outputs is missing.
+
+The manifest is written to the build directory as JSON. Alongside the stage
+digests, it remembers the size, mtime and hash of every input file it has
+seen, so that unchanged files don't need to be rehashed on every build.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+from .fileutil import writeFile
+
+log = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def hashFile(path) -> str:
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BuildManifest:
+    """Content hashes of build inputs, keyed by build stage.
+
+    Typical use:
+
+        if manifest.isStale(key, inputs=[src], outputs=[dest]):
+            doTheWork(src, dest)
+            manifest.record(key)
+
+    Only stages that are recorded make it into the saved manifest, so a
+    stage that fails will be rerun by the next build.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files = {}  # path -> [size, mtime_ns, digest]
+        self.stages = {}  # stage key -> digest of inputs
+        self.pending = {}  # stage key -> digest of inputs, not yet recorded
+
+    def load(self):
+        """Load the manifest of the last successful build, if there is one."""
+        if not os.path.exists(self.path):
+            log.debug('No build manifest at %s', self.path)
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning('Ignoring unreadable build manifest %s: %s', self.path, e)
+            return
+        if data.get('version') != MANIFEST_VERSION:
+            log.info('Build manifest version changed; rebuilding everything.')
+            return
+        self.files = data.get('files', {})
+        self.stages = data.get('stages', {})
+
+    def save(self):
+        """Write the manifest out, replacing the old one atomically."""
+        log.debug('Writing build manifest: %s', self.path)
+        data = {'version': MANIFEST_VERSION, 'files': self.files, 'stages': self.stages}
+        writeFile(self.path, json.dumps(data, indent=1, sort_keys=True).encode('utf-8'))
+
+    def reset(self):
+        """Forget all recorded stages, so that every stage is considered stale.
+
+        File hashes are kept, since they are still valid.
+        """
+        self.stages = {}
+        self.pending = {}
+
+    def fileDigest(self, path: str) -> str:
+        """Return the hash of a file, reusing the last one if it looks unchanged."""
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.files.pop(path, None)
+            return 'missing'
+
+        entry = self.files.get(path)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return entry[2]
+
+        digest = hashFile(path)
+        self.files[path] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def inputsDigest(self, inputs, params=None) -> str:
+        """Return a single hash representing the contents of all the given files, and params."""
+        digest = hashlib.sha256()
+        if params is not None:
+            digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+            digest.update(b'\n')
+        for path in sorted(os.path.abspath(p) for p in inputs):
+            digest.update(path.encode('utf-8'))
+            digest.update(b'\0')
+            digest.update(self.fileDigest(path).encode('ascii'))
+            digest.update(b'\n')
+        return digest.hexdigest()
+
+    def isStale(self, key: str, inputs, outputs=(), params=None) -> bool:
+        """Determine whether the stage identified by key needs to be rerun."""
+        digest = self.inputsDigest(inputs, params)
+        self.pending[key] = digest
+        if self.stages.get(key) != digest:
+            return True
+        return not all(os.path.exists(p) for p in outputs)
+
+    def record(self, key: str):
+        """Record that the stage identified by key completed successfully.
+
+        The stage must have been checked with isStale first.
+        """
+        self.stages[key] = self.pending.pop(key)
+
+    def forget(self, prefix: str):
+        """Forget the recorded stages whose keys start with prefix, so that they'll be rerun."""
+        for key in [k for k in self.stages if k.startswith(prefix)]:
+            del self.stages[key]
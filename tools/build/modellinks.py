@@ -0,0 +1,48 @@
+"""modellinks helps resolve the <link name="..."> elements of each page against
+the nodes of the page's model, so that broken links fail the build instead of
+turning up as console warnings in the browser.
+
+Each link is annotated with the index of the node it refers to (@node), which
+the page passes on to the viewer. The viewer can then fetch hitboxes from
+GLTFLoader by index, rather than searching the scene for them by name. See
+resolveLink in build.py.
+"""
+
+import functools
+import logging
+import re
+
+from . import gltf
+
+log = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s')
+_RESERVED = re.compile(r'[\[\].:/]')
+
+
+def sanitizeNodeName(name):
+    """Munge a node name the way three.js does (THREE.PropertyBinding.sanitizeNodeName).
+
+    GLTFLoader names each object after its node, sanitized thus.
+    """
+    return _RESERVED.sub('', _WHITESPACE.sub('_', name))
+
+
+@functools.lru_cache(maxsize=32)
+def nodeIndex(path, digest):
+    """Map the sanitized names of the nodes in a model's default scene to their indices.
+
+    Where names clash, the last node in scene order wins, as it always has
+    in the viewer. digest is the model file's content hash, so that we
+    reread the model when it changes.
+    """
+    model = gltf.Gltf.load(path, buffers=False)
+    nodes = model.json.get('nodes', [])
+    index = {}
+    stack = list(reversed(model.sceneRoots()))
+    while stack:
+        i = stack.pop()
+        if 'name' in nodes[i]:
+            index[sanitizeNodeName(nodes[i]['name'])] = i
+        stack.extend(reversed(nodes[i].get('children', [])))
+    return index
@@ -0,0 +1,299 @@
+"""packmodel optimises a glTF model for the web, packing it into a single GLB
+file that's smaller and quicker to load than the model we author.
+
+- Vertex attributes are quantized, using KHR_mesh_quantization: positions to
+  16-bit integers, normals and tangents to 8-bit, and texture coordinates to
+  16-bit where they fit in [0, 1].
+- Duplicate vertices (which photogrammetry exports are full of) are merged,
+  and vertices are reordered into the order the triangles first use them,
+  which is kinder to the GPU's vertex cache.
+- Anything the model doesn't use (accessors, buffer views, external buffers)
+  is dropped, and images are embedded in the GLB (unless they're published
+  on their own; see tools.build.textures).
+
+Nodes are never added, removed or renamed, so the hitbox names that page XML
+links refer to stay valid. The root nodes may be moved, to centre the model
+(see tools.build.bounds).
+
+Quantized positions are stored as plain (unnormalized) integers, with the
+scale and offset that map them back to model coordinates folded into the
+transform of each node that uses the mesh. three.js reads geometry as-is when
+raycasting and computing bounding boxes, so this keeps those in the right
+coordinate system, so long as they're done in world space.
+"""
+
+import copy
+import logging
+import os
+
+import numpy as np
+
+from . import gltf
+from .fileutil import writeFile
+from .bounds import recenter
+
+log = logging.getLogger(__name__)
+
+EXTENSION = 'KHR_mesh_quantization'
+
+# Quantized positions use the full range of a signed 16-bit integer, bar -32768,
+# so that the range is symmetrical.
+POSITION_RANGE = 32767
+
+# Extensions that we can't pack, because they refer to data we'd have to understand.
+UNSUPPORTED_EXTENSIONS = {'KHR_draco_mesh_compression', 'EXT_meshopt_compression'}
+
+
+def packedModelPath(dest):
+    """Where the packed version of a model published at dest goes."""
+    return os.path.splitext(dest)[0] + '.glb'
+
+
+def quantizeUnit(values, dtype):
+    """Quantize values in [-1, 1] (or [0, 1], for unsigned types) to a normalized integer type."""
+    info = np.iinfo(dtype)
+    return np.round(np.clip(values, info.min / info.max, 1.0) * info.max).astype(dtype)
+
+
+class ModelPacker:
+    """Packs a single model. Use packModel.
+
+    indices, if given, replaces the vertex indices of some of the model's
+    triangle primitives, by (mesh index, primitive index). The vertices
+    they no longer use are dropped. tools.build.lod uses it to pack
+    simplified meshes.
+
+    images, if given, maps the index of each image that's published on its
+    own to the URI to refer to it by, instead of embedding it.
+
+    offset, if given, is subtracted from the model's positions, by moving
+    its root nodes, to centre it.
+    """
+
+    def __init__(self, model: gltf.Gltf, indices=None, images=None, offset=None):
+        self.model = model
+        self.indices = indices or {}
+        self.images = images or {}
+        self.offset = offset
+        self.json = copy.deepcopy(model.json)
+        self.writer = gltf.GltfWriter()
+        self.accessors = {}  # source accessor index -> packed accessor index
+        self.quantized = False
+
+    def copyAccessor(self, index):
+        """Copy an accessor to the packed model as it is, returning its new index."""
+        if index not in self.accessors:
+            accessor = self.model.json['accessors'][index]
+            self.accessors[index] = self.writer.addAccessor(
+                self.model.readAccessor(index), normalized=accessor.get('normalized', False),
+                accessortype=accessor['type'], minmax='min' in accessor)
+        return self.accessors[index]
+
+    def unquantizableMeshes(self):
+        """Find the meshes whose positions we can't quantize.
+
+        Quantization changes the transforms of the nodes that use each mesh,
+        and of their children, so it's out for anything that's animated.
+        It's also out for skinned and morphed meshes, whose vertices are
+        moved by more than the node transform.
+        """
+        nodes = self.json.get('nodes', [])
+        animated = set()
+        for animation in self.json.get('animations', []):
+            for channel in animation.get('channels', []):
+                if 'node' in channel.get('target', {}):
+                    animated.add(channel['target']['node'])
+
+        meshes = set()
+        for i, node in enumerate(nodes):
+            if 'mesh' not in node:
+                continue
+            children = set(node.get('children', []))
+            if 'skin' in node or node.get('weights') or i in animated or children & animated:
+                meshes.add(node['mesh'])
+        for i, mesh in enumerate(self.json.get('meshes', [])):
+            for primitive in mesh['primitives']:
+                if primitive.get('targets') or primitive.get('mode', gltf.TRIANGLES) != gltf.TRIANGLES:
+                    meshes.add(i)
+        return meshes
+
+    def dequantization(self, mesh):
+        """Choose the (offset, scale) to quantize a mesh's positions with.
+
+        The scale is uniform, so that it commutes with node rotations.
+        """
+        positions = [self.model.readAccessorFloat(p['attributes']['POSITION'])
+                     for p in mesh['primitives'] if 'POSITION' in p['attributes']]
+        if not positions:
+            return None
+        positions = np.concatenate(positions)
+        lo = positions.min(axis=0)
+        hi = positions.max(axis=0)
+        offset = (lo + hi) / 2
+        extent = (hi - lo).max() / 2
+        scale = extent / POSITION_RANGE if extent > 0 else 1.0
+        return offset, scale
+
+    def quantizeAttribute(self, name, index, dequant):
+        """Return (array, normalized) for an attribute in its packed form."""
+        accessor = self.model.json['accessors'][index]
+        if name == 'POSITION' and dequant is not None:
+            offset, scale = dequant
+            values = (self.model.readAccessorFloat(index) - offset) / scale
+            return np.round(values).clip(-POSITION_RANGE, POSITION_RANGE).astype(np.int16), False
+        if name in ('NORMAL', 'TANGENT'):
+            return quantizeUnit(self.model.readAccessorFloat(index), np.int8), True
+        if name.startswith('TEXCOORD_'):
+            values = self.model.readAccessorFloat(index)
+            if values.size and values.min() >= 0 and values.max() <= 1:
+                return quantizeUnit(values, np.uint16), True
+            return values.astype(np.float32), False
+        # Anything else (colors, joints, weights...) goes through unchanged.
+        return self.model.readAccessor(index), accessor.get('normalized', False)
+
+    def packPrimitive(self, primitive, dequant, indices=None):
+        attributes = {name: self.quantizeAttribute(name, index, dequant)
+                      for name, index in primitive['attributes'].items()}
+        if dequant is not None and 'POSITION' in attributes:
+            self.quantized = True
+
+        if primitive.get('mode', gltf.TRIANGLES) == gltf.TRIANGLES and not primitive.get('targets'):
+            indices, order = self.optimiseVertices(primitive, attributes, indices)
+            attributes = {name: (array[order], normalized) for name, (array, normalized) in attributes.items()}
+        else:
+            indices = self.model.readIndices(primitive) if 'indices' in primitive else None
+            for target in primitive.get('targets', []):
+                for name, index in target.items():
+                    target[name] = self.copyAccessor(index)
+
+        for name, (array, normalized) in attributes.items():
+            primitive['attributes'][name] = self.writer.addAccessor(
+                array, normalized=normalized, target=gltf.ARRAY_BUFFER, minmax=(name == 'POSITION'))
+        if indices is not None:
+            dtype = np.uint16 if len(indices) == 0 or indices.max() < 0xffff else np.uint32
+            primitive['indices'] = self.writer.addAccessor(indices.astype(dtype), target=gltf.ELEMENT_ARRAY_BUFFER)
+
+    def optimiseVertices(self, primitive, attributes, indices=None):
+        """Merge duplicate vertices, and order vertices by first use.
+
+        Returns the new indices, and the source vertex for each new vertex.
+        Vertices that no triangle uses are dropped. Vertices are compared
+        after quantization, so those that only differed by less than the
+        quantization step are merged too.
+        """
+        if indices is None:
+            indices = self.model.readIndices(primitive)
+        count = len(next(iter(attributes.values()))[0])
+        if count == 0:
+            return indices, np.arange(0)
+        rows = np.hstack([np.ascontiguousarray(array).view(np.uint8).reshape(count, -1)
+                          for array, _ in attributes.values()])
+        _, first, inverse = np.unique(rows, axis=0, return_index=True, return_inverse=True)
+        indices = inverse.reshape(-1)[indices]
+
+        used, firstuse = np.unique(indices, return_index=True)
+        order = used[np.argsort(firstuse)]
+        remap = np.zeros(len(first), dtype=np.uint32)
+        remap[order] = np.arange(len(order), dtype=np.uint32)
+        return remap[indices], first[order]
+
+    def packMeshes(self):
+        """Pack every mesh, returning the dequantization for each one whose positions are quantized."""
+        unquantizable = self.unquantizableMeshes()
+        dequantizations = {}
+        for i, mesh in enumerate(self.json.get('meshes', [])):
+            dequant = None if i in unquantizable else self.dequantization(mesh)
+            if dequant is not None:
+                dequantizations[i] = dequant
+            for j, primitive in enumerate(mesh['primitives']):
+                self.packPrimitive(primitive, dequant, self.indices.get((i, j)))
+        return dequantizations
+
+    def applyDequantizations(self, dequantizations):
+        """Fold the dequantization of each quantized mesh into the nodes that use it.
+
+        A node's transform becomes T * D, where D maps quantized positions
+        back to model coordinates. Its children are left where they were by
+        transforming them by D's inverse.
+        """
+        nodes = self.json.get('nodes', [])
+        for node in nodes:
+            if node.get('mesh') not in dequantizations:
+                continue
+            offset, scale = dequantizations[node['mesh']]
+            if 'matrix' in node:
+                dequant = np.identity(4)
+                dequant[:3, :3] *= scale
+                dequant[:3, 3] = offset
+                gltf.setNodeMatrix(node, gltf.nodeMatrix(node) @ dequant)
+            else:
+                nodescale = np.array(node.get('scale', [1, 1, 1]), dtype=np.float64)
+                rotation = gltf.quaternionMatrix(node.get('rotation', [0, 0, 0, 1]))
+                translation = np.array(node.get('translation', [0, 0, 0]), dtype=np.float64)
+                node['translation'] = (translation + rotation @ (nodescale * offset)).tolist()
+                node['scale'] = (nodescale * scale).tolist()
+
+            for child in node.get('children', []):
+                childnode = nodes[child]
+                if 'matrix' in childnode:
+                    inverse = np.identity(4)
+                    inverse[:3, :3] /= scale
+                    inverse[:3, 3] = -offset / scale
+                    gltf.setNodeMatrix(childnode, inverse @ gltf.nodeMatrix(childnode))
+                else:
+                    translation = np.array(childnode.get('translation', [0, 0, 0]), dtype=np.float64)
+                    childscale = np.array(childnode.get('scale', [1, 1, 1]), dtype=np.float64)
+                    childnode['translation'] = ((translation - offset) / scale).tolist()
+                    childnode['scale'] = (childscale / scale).tolist()
+
+    def packOthers(self):
+        """Copy over the accessors that aren't mesh data, and embed (or refer to) the images."""
+        for skin in self.json.get('skins', []):
+            if 'inverseBindMatrices' in skin:
+                skin['inverseBindMatrices'] = self.copyAccessor(skin['inverseBindMatrices'])
+        for animation in self.json.get('animations', []):
+            for sampler in animation.get('samplers', []):
+                sampler['input'] = self.copyAccessor(sampler['input'])
+                sampler['output'] = self.copyAccessor(sampler['output'])
+        for i, image in enumerate(self.json.get('images', [])):
+            if i in self.images:
+                image.pop('bufferView', None)
+                image['uri'] = self.images[i]
+                continue
+            data, mimetype = self.model.imageBytes(i)
+            image.pop('uri', None)
+            image['bufferView'] = self.writer.addBufferView(data)
+            if mimetype:
+                image['mimeType'] = mimetype
+
+    def pack(self) -> bytes:
+        used = set(self.json.get('extensionsUsed', [])) & UNSUPPORTED_EXTENSIONS
+        if used:
+            raise gltf.GltfError(f"Can't pack models that use {', '.join(sorted(used))}")
+
+        dequantizations = self.packMeshes()
+        self.applyDequantizations(dequantizations)
+        if self.offset is not None:
+            recenter(self.json, np.asarray(self.offset, dtype=np.float64))
+        self.packOthers()
+
+        if self.quantized:
+            for key in ['extensionsUsed', 'extensionsRequired']:
+                extensions = self.json.setdefault(key, [])
+                if EXTENSION not in extensions:
+                    extensions.append(EXTENSION)
+        self.json.setdefault('asset', {})['generator'] = '3dViewer build.py'
+        return self.writer.toGlb(self.json)
+
+
+def packModel(src, dest, images=None, offset=None):
+    """Pack the glTF model at src into an optimised GLB file at dest.
+
+    images and offset are as for ModelPacker.
+    """
+    model = gltf.Gltf.load(src)
+    data = ModelPacker(model, images=images, offset=offset).pack()
+    writeFile(dest, data)
+    srcsize = os.path.getsize(src) + sum(len(b) for b, buf in zip(model.buffers, model.json.get('buffers', []))
+                                         if 'uri' in buf and not buf['uri'].startswith('data:'))
+    log.info('Packed %s: %d -> %d bytes (%.0f%%)', dest, srcsize, len(data), 100 * len(data) / max(srcsize, 1))
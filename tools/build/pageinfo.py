@@ -0,0 +1,181 @@
+"""pageinfo processes page XML in a single streaming pass: it converts the
+page's transliterations (see convertTransliteration), and at the same time
+collects a compact record of what the page refers to (PageInfo) and does
+cheap structural checks that don't need the full RelaxNG schema.
+
+The build uses the PageInfo instead of parsing the page again, and keeps it
+in the build directory, so that unchanged pages need not be parsed at all.
+"""
+
+from dataclasses import asdict, dataclass, field
+import json
+import logging
+from typing import List, Optional
+from xml import sax
+
+from .convertTransliteration import Converter
+from .fileutil import writeFile
+
+log = logging.getLogger(__name__)
+
+PAGEINFO_VERSION = 1
+
+
+class PageError(Exception):
+    """Pages have problems, which are listed one per line in the message."""
+    def __init__(self, problems):
+        self.problems = problems  # list of (page, description)
+
+    @property
+    def message(self):
+        lines = [f'{len(self.problems)} problem(s) in page XML:']
+        lines.extend(f'  {page}: {problem}' for page, problem in self.problems)
+        return '\n'.join(lines)
+
+
+@dataclass
+class LinkRef:
+    name: str
+    ref: str
+    node: Optional[int] = None  # index of the glTF node, once resolved
+
+
+@dataclass
+class ModelRef:
+    src: str
+    dest: str
+    links: List[LinkRef] = field(default_factory=list)
+
+
+@dataclass
+class AssetRef:
+    src: str
+    dest: str
+
+
+@dataclass
+class PageInfo:
+    """What a page refers to, and what the build published for it."""
+    src: str
+    dest: str = None  # where the page's HTML goes, relative to the dist directory
+    name: str = None
+    models: List[ModelRef] = field(default_factory=list)
+    images: List[AssetRef] = field(default_factory=list)
+    ids: List[str] = field(default_factory=list)  # text and fragment IDs
+    outputs: List[str] = field(default_factory=list)  # files published for the page, relative to dist
+    problems: List[str] = field(default_factory=list)
+
+    def assets(self):
+        """List the src attributes of the assets the page refers to."""
+        return [m.src for m in self.models] + [i.src for i in self.images]
+
+    def save(self, path):
+        data = asdict(self)
+        data['version'] = PAGEINFO_VERSION
+        writeFile(path, json.dumps(data, indent=1).encode('utf-8'))
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved PageInfo, returning None if there isn't a usable one."""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.pop('version', None) != PAGEINFO_VERSION:
+            return None
+        data['models'] = [ModelRef(m['src'], m['dest'], [LinkRef(**link) for link in m['links']])
+                          for m in data['models']]
+        data['images'] = [AssetRef(**i) for i in data['images']]
+        return cls(**data)
+
+
+class PageProcessor(Converter):
+    """A Converter that also collects the page's PageInfo.
+
+    annotate, if given, is called as annotate(info, name, attrs) for each
+    element, after the element has been recorded in info, and returns a
+    dict of attributes to add to the element (or None). The build uses it
+    to publish assets as soon as the page refers to them.
+    """
+
+    def __init__(self, out, src, annotate=None):
+        super(PageProcessor, self).__init__(out, annotate=self._recordElement)
+        self.info = PageInfo(src=src)
+        self.pageAnnotate = annotate
+        self.depth = 0
+        self.inName = False
+        self.nameParts = []
+
+    def _require(self, name, attrs, attrname):
+        value = attrs.get(attrname)
+        if not value:
+            self.info.problems.append(f'<{name}> has no {attrname} attribute')
+        return value or ''
+
+    def _recordElement(self, name, attrs):
+        info = self.info
+        if self.depth == 0:
+            if name != 'page':
+                info.problems.append(f'root element is <{name}>, not <page>')
+            info.dest = self._require(name, attrs, 'dest')
+        elif name == 'name' and self.depth == 1:
+            self.inName = True
+        elif name == 'model':
+            info.models.append(ModelRef(self._require(name, attrs, 'src'), self._require(name, attrs, 'dest')))
+        elif name == 'link':
+            if not info.models:
+                info.problems.append('<link> outside a <model>')
+            else:
+                info.models[-1].links.append(LinkRef(self._require(name, attrs, 'name'),
+                                                     self._require(name, attrs, 'ref')))
+        elif name == 'himg':
+            info.images.append(AssetRef(self._require(name, attrs, 'src'), self._require(name, attrs, 'dest')))
+        elif name in ('text', 'frag'):
+            info.ids.append(self._require(name, attrs, 'id'))
+
+        if self.pageAnnotate:
+            return self.pageAnnotate(info, name, attrs)
+        return None
+
+    def startElement(self, name, attrs):
+        super(PageProcessor, self).startElement(name, attrs)
+        self.depth += 1
+
+    def endElement(self, name):
+        super(PageProcessor, self).endElement(name)
+        self.depth -= 1
+        if self.inName and self.depth == 1:
+            self.inName = False
+            self.info.name = ''.join(self.nameParts).strip()
+
+    def characters(self, data):
+        super(PageProcessor, self).characters(data)
+        if self.inName:
+            self.nameParts.append(data)
+
+    def endDocument(self):
+        super(PageProcessor, self).endDocument()
+        info = self.info
+        ids = set()
+        for id in info.ids:
+            if id in ids:
+                info.problems.append(f'duplicate ID "{id}"')
+            ids.add(id)
+        for model in info.models:
+            for link in model.links:
+                if link.ref not in ids:
+                    info.problems.append(f'link "{link.name}" refers to "{link.ref}", which is not a text or frag ID')
+
+
+def processPage(infile, outfile, src, annotate=None) -> PageInfo:
+    """Convert the page XML in infile to outfile, returning its PageInfo.
+
+    src is the page's path, for the record. See PageProcessor for annotate.
+    """
+    handler = PageProcessor(out=outfile, src=src, annotate=annotate)
+    try:
+        sax.parse(infile, handler)
+    except sax.SAXParseException as e:
+        handler.info.problems.append(f'not well-formed: {e}')
+    return handler.info
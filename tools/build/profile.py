@@ -0,0 +1,137 @@
+"""profile records where a build spends its time, for build.py --profile.
+
+Each stage of the build, each per-page step, and each external tool we run
+is recorded as a span, with its wall time, CPU time and (where it makes
+sense) the number of bytes it read or wrote. At the end of the build, the
+spans are written out as a Chrome trace-event file, which can be opened in
+chrome://tracing or https://ui.perfetto.dev, and summarised in the log.
+
+CPU time covers the whole build process (including any threads running at
+the time) plus the external tools that finished during the span. The
+BuildSite worker keeps running between transforms, so its CPU time isn't
+included.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import resource
+import threading
+import time
+
+from .fileutil import writeFile
+
+log = logging.getLogger(__name__)
+
+
+def cpuTime():
+    """CPU time used so far by this process, and by the child processes it has waited for."""
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def fileBytes(paths):
+    """Total up the sizes of the given files, skipping any that don't exist."""
+    return sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+
+
+class Profiler:
+    """Records spans for a build. A profiler that isn't enabled records nothing."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget what was recorded, e.g. before a rebuild."""
+        self.events = []
+        self.threads = {}  # thread ident or name -> (tid, name)
+        self.start = time.perf_counter()
+        self.wallstart = time.time()
+
+    def _tid(self, thread=None):
+        """Get the trace's ID for a thread: ours, by default, or a named external one."""
+        key = thread if thread is not None else threading.get_ident()
+        with self.lock:
+            if key not in self.threads:
+                name = thread if thread is not None else threading.current_thread().name
+                self.threads[key] = (len(self.threads) + 1, name)
+            return self.threads[key][0]
+
+    def fromEpoch(self, seconds):
+        """Convert a time.time() timestamp (e.g. from another process) to a time.perf_counter() one."""
+        return self.start + (seconds - self.wallstart)
+
+    @contextlib.contextmanager
+    def span(self, name, category='build', **args):
+        """Record the time spent in a with block.
+
+        Yields the dict of args recorded with the span, so that the block
+        can add to them, e.g. args['bytes'] = len(data).
+        """
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter()
+        cpustart = cpuTime()
+        try:
+            yield args
+        finally:
+            self.addEvent(name, category, start, time.perf_counter() - start, cpu=cpuTime() - cpustart, **args)
+
+    def addEvent(self, name, category, start, duration, cpu=None, thread=None, **args):
+        """Record a span that was timed some other way.
+
+        start is a time.perf_counter() value, and duration and cpu are in
+        seconds. thread names the external thread that did the work, if it
+        wasn't one of ours.
+        """
+        if not self.enabled:
+            return
+        args = {k: v for k, v in args.items() if v is not None}
+        if cpu is not None:
+            args['cpu_ms'] = round(cpu * 1000, 3)
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start - self.start) * 1e6),
+            'dur': round(duration * 1e6),
+            'pid': os.getpid(),
+            'tid': self._tid(thread),
+            'args': args,
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def writeTrace(self, path):
+        """Write what we recorded as a Chrome trace-event JSON file."""
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                    for tid, name in self.threads.values()]
+        writeFile(path, json.dumps({'traceEvents': metadata + self.events, 'displayTimeUnit': 'ms'}).encode('utf-8'))
+        log.info('Wrote build profile: %s', path)
+
+    def summary(self):
+        """Total up the spans by name, returning (name, count, wall s, cpu s, bytes), slowest first."""
+        totals = {}
+        for event in self.events:
+            total = totals.setdefault(event['name'], [0, 0.0, 0.0, 0])
+            total[0] += 1
+            total[1] += event['dur'] / 1e6
+            total[2] += event['args'].get('cpu_ms', 0) / 1000
+            total[3] += event['args'].get('bytes', 0)
+        rows = [(name,) + tuple(total) for name, total in totals.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def logSummary(self):
+        """Log a table of where the time went. Times include the time spent in nested spans."""
+        rows = self.summary()
+        if not rows:
+            return
+        width = max(len('step'), max(len(row[0]) for row in rows))
+        log.info('Build profile (times include nested steps):')
+        log.info('  %-*s %7s %10s %10s %12s', width, 'step', 'count', 'wall (s)', 'cpu (s)', 'bytes')
+        for name, count, wall, cpu, nbytes in rows:
+            log.info('  %-*s %7d %10.3f %10.3f %12s', width, name, count, wall, cpu, nbytes or '')
@@ -0,0 +1,212 @@
+"""publish puts assets into the output directory as cheaply as it can.
+
+Rather than copying every file on every build, the publisher:
+
+- skips files that are already up to date at the destination,
+- publishes files with the same content only once, linking the rest to it,
+- and links rather than copies where the filesystem allows it.
+
+It keeps count of the bytes it copied, and of those it avoided copying.
+
+Published files may share their storage with the source files (that's the
+point!), so they must never be modified in place. Everything that writes to
+the output directory should write a new file and rename it into place.
+
+The build writes its output to a staging directory, and the publisher then
+syncs that to the dist directory (see AssetPublisher.sync), so that a
+server never sees the dist directory half-built.
+"""
+
+import errno
+import logging
+import os
+import shutil
+import sys
+
+log = logging.getLogger(__name__)
+
+# From <linux/fs.h>: clone a whole file, sharing its extents copy-on-write.
+FICLONE = 0x40049409
+
+# Files that are still being written, which we never publish.
+TEMP_SUFFIXES = ('.publishing', '.tmp')
+
+
+class PublishError(Exception):
+    """The build output can't be published."""
+    def __init__(self, message):
+        self.message = message
+
+
+def formatBytes(n):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if n < 1024 or unit == 'GiB':
+            break
+        n /= 1024
+    return f'{n:.1f} {unit}' if unit != 'B' else f'{n} B'
+
+
+def reflink(src, dest):
+    """Make dest a copy-on-write clone of src. Raises OSError if the filesystem can't."""
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, 'reflinks are only supported on Linux')
+    import fcntl
+    with open(src, 'rb') as infile, open(dest, 'wb') as outfile:
+        fcntl.ioctl(outfile.fileno(), FICLONE, infile.fileno())
+    shutil.copystat(src, dest)
+
+
+class AssetPublisher:
+    """Publishes files to the output directory.
+
+    mode is one of config.LINK_MODES. 'auto' tries a reflink, then a hard link,
+    then falls back to copying. Symbolic links are only made on request,
+    since they don't survive being copied into a Docker image.
+
+    digest is a function that returns the content hash of a file.
+    """
+
+    def __init__(self, digest, mode='auto'):
+        self.digest = digest
+        self.mode = mode
+        self.reset()
+
+    def reset(self):
+        """Start afresh for a new build."""
+        self.published = {}  # content digest -> first dest published with it
+        self.bytescopied = 0
+        self.byteslinked = 0
+        self.bytesunchanged = 0
+        self.duplicates = 0
+
+    def _isUpToDate(self, src, dest, srcdigest):
+        try:
+            srcstat = os.stat(src)
+            deststat = os.stat(dest)
+        except FileNotFoundError:
+            return False
+        if os.path.samestat(srcstat, deststat):
+            return True
+        if srcstat.st_size != deststat.st_size:
+            return False
+        if srcstat.st_mtime_ns == deststat.st_mtime_ns:
+            return True
+        return self.digest(dest) == srcdigest
+
+    def _link(self, src, tmppath):
+        """Try to link tmppath to src without copying. Returns True if that worked."""
+        modes = ['reflink', 'hardlink'] if self.mode == 'auto' else [self.mode]
+        for mode in modes:
+            try:
+                if mode == 'reflink':
+                    reflink(src, tmppath)
+                elif mode == 'hardlink':
+                    os.link(src, tmppath)
+                elif mode == 'symlink':
+                    os.symlink(os.path.abspath(src), tmppath)
+                else:
+                    return False
+                return True
+            except OSError as e:
+                log.debug("Couldn't %s %s: %s", mode, src, e)
+                if os.path.lexists(tmppath):
+                    os.unlink(tmppath)
+        return False
+
+    def publish(self, src, dest):
+        """Publish src at dest, unless it's already there. Returns whether it wasn't."""
+        srcdigest = self.digest(src)
+        size = os.path.getsize(src)
+        if self._isUpToDate(src, dest, srcdigest):
+            log.debug('Up to date: %s', dest)
+            self.bytesunchanged += size
+            self.published.setdefault(srcdigest, dest)
+            return False
+
+        # If we've already published the same content elsewhere, link to
+        # that instead of making yet another copy of it.
+        original = self.published.get(srcdigest)
+        if original and original != dest:
+            log.debug('Same content as %s: %s', original, dest)
+            self.duplicates += 1
+            linksrc = original
+        else:
+            self.published[srcdigest] = dest
+            linksrc = src
+
+        # Never write over dest in place: it may be linked to a source file.
+        tmppath = dest + '.publishing'
+        if os.path.lexists(tmppath):
+            os.unlink(tmppath)
+        if self._link(linksrc, tmppath):
+            log.debug('Linked: %s -> %s', linksrc, dest)
+            self.byteslinked += size
+        else:
+            log.debug('Copying: %s -> %s', src, dest)
+            shutil.copy2(src, tmppath)
+            self.bytescopied += size
+        os.replace(tmppath, dest)
+        return True
+
+    @staticmethod
+    def _makeDirectory(path):
+        """Make a directory, replacing any file in its way."""
+        if os.path.lexists(path) and not os.path.isdir(path):
+            os.unlink(path)
+        os.makedirs(path, exist_ok=True)
+
+    def sync(self, srcdir, destdir):
+        """Make destdir the same as srcdir, writing only the files that differ.
+
+        Each file is published (so replaced atomically), and files that
+        aren't in srcdir are removed. New files go first, then changed
+        ones, so a page never refers to a file that isn't there yet, and
+        removals go last. destdir itself is kept, never replaced.
+
+        Returns the number of files added, updated, and removed.
+        """
+        self._makeDirectory(destdir)
+        srcfiles = set()
+        srcdirs = set()
+        new = []
+        existing = []
+        for root, dirs, files in os.walk(srcdir):
+            reldir = os.path.relpath(root, srcdir)
+            for d in dirs:
+                srcdirs.add(os.path.normpath(os.path.join(reldir, d)))
+                self._makeDirectory(os.path.join(destdir, reldir, d))
+            for f in files:
+                if f.endswith(TEMP_SUFFIXES):
+                    continue
+                path = os.path.normpath(os.path.join(reldir, f))
+                srcfiles.add(path)
+                dest = os.path.join(destdir, path)
+                if os.path.isdir(dest) and not os.path.islink(dest):
+                    shutil.rmtree(dest)
+                (existing if os.path.lexists(dest) else new).append(path)
+
+        added = sum(self.publish(os.path.join(srcdir, path), os.path.join(destdir, path)) for path in new)
+        updated = sum(self.publish(os.path.join(srcdir, path), os.path.join(destdir, path)) for path in existing)
+
+        removed = 0
+        for root, dirs, files in os.walk(destdir, topdown=False):
+            reldir = os.path.relpath(root, destdir)
+            for f in files:
+                if os.path.normpath(os.path.join(reldir, f)) not in srcfiles:
+                    log.debug('Removing: %s', os.path.join(root, f))
+                    os.unlink(os.path.join(root, f))
+                    removed += 1
+            for d in dirs:
+                path = os.path.join(root, d)
+                if os.path.islink(path):
+                    os.unlink(path)
+                    removed += 1
+                elif os.path.normpath(os.path.join(reldir, d)) not in srcdirs and not os.listdir(path):
+                    os.rmdir(path)
+        return added, updated, removed
+
+    def logStats(self):
+        avoided = self.byteslinked + self.bytesunchanged
+        log.info('Published assets: %s copied, %s avoided (%s linked, %s unchanged, %d duplicate file(s))',
+                 formatBytes(self.bytescopied), formatBytes(avoided), formatBytes(self.byteslinked),
+                 formatBytes(self.bytesunchanged), self.duplicates)
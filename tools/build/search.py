@@ -0,0 +1,220 @@
+"""search builds a full-text search index of the site, which the site index
+page queries in the browser (see src/search.js), so that searching needs
+no server.
+
+Each page is split into documents: the page itself (its name and
+description), and each of its texts and text fragments, which have IDs to
+link to. The words in each document's fields (see FIELDS) are normalised
+(see terms) and indexed. Transliterations are indexed both as written, in
+MdC, and as converted to Unicode, and hieroglyphs by their MdC sign codes
+(A40, Htp, ...), so any of them can be searched for.
+
+The index is an inverted index: for each term, the documents it's in, and
+in which of their fields. Its terms are split into shards by prefix, so
+that a query only fetches the shards its words fall in: while a shard is
+bigger than SHARD_SIZE, it's split into shards for each next character.
+
+SEARCH_DIR/INDEX_NAME lists the pages, the documents, and the shards, by
+prefix. Shards are named by a hash of their contents, so that web servers
+can let browsers cache them for good. A shard is a little-endian binary
+file:
+
+- A header of three uint32s: MAGIC, VERSION, and the number of terms.
+- Each term, in sorted order, front-coded: the number of leading UTF-8
+  bytes it shares with the previous term, the number of bytes that
+  follow, and those bytes. Then the number of documents it's in, and for
+  each, the difference between its number and the previous one's (or
+  its number, for the first), and a bitmask of the fields it's in.
+
+Every number after the header is an unsigned LEB128 varint.
+"""
+
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import struct
+import unicodedata
+
+from .convertTransliteration import mdcToUnicode
+from .fileutil import writeFile
+
+log = logging.getLogger(__name__)
+
+MAGIC = 0x31584953  # b'SIX1', read as a little-endian uint32
+VERSION = 1
+
+# Where the index goes, relative to the dist directory, and its name there.
+SEARCH_DIR = 'search'
+INDEX_NAME = 'index.json'
+
+# The fields of a document, and their bits in a posting's field mask.
+FIELDS = {
+    'name': 1,  # the page's name
+    'description': 2,  # the page's description
+    'desc': 4,  # a text's description
+    'tr': 8,  # translations
+    'al': 16,  # transliterations
+    'hi': 32,  # hieroglyphs, as MdC sign codes
+}
+
+# Split shards bigger than this many bytes.
+SHARD_SIZE = 32 * 1024
+
+# Length of the digest in shard names.
+HASH_LENGTH = 16
+
+# A word: a run of letters and digits. src/search.js has the same.
+_WORD = re.compile(r'[^\W_]+')
+
+
+def terms(text):
+    """Split text into the terms we index it by.
+
+    Terms are lower case, without accents or diacritics, so that ḥtp and
+    Htp both come out as htp. src/search.js does the same to queries.
+    """
+    decomposed = unicodedata.normalize('NFD', text)
+    stripped = ''.join(c for c in decomposed if unicodedata.category(c) != 'Mn')
+    return _WORD.findall(stripped.lower())
+
+
+def _text(element):
+    return ' '.join(''.join(element.itertext()).split())
+
+
+def _fieldTexts(element):
+    """List the (field, text) pairs for the fields directly in a text or fragment."""
+    fields = []
+    for child in element:
+        text = _text(child)
+        if child.tag == 'al':
+            fields.append(('al', text))
+            if child.get('encoding') == 'mdc':
+                fields.append(('al', mdcToUnicode(text)))
+        elif child.tag == 'hi':
+            fields.append(('hi', text))
+        elif child.tag in ('tr', 'desc'):
+            fields.append((child.tag, text))
+    return fields
+
+
+def pageDocuments(root, name):
+    """List the documents in a page (its parsed XML), as (ID, label, [(field, text)]).
+
+    The page itself has the ID ''. A text or fragment is labelled with its
+    text's description, if it has one.
+    """
+    description = root.find('description')
+    docs = [('', name or '', [('name', name or ''), ('description', _text(description) if description is not None else '')])]
+    for text in root.iter('text'):
+        desc = text.find('desc')
+        label = _text(desc) if desc is not None else ''
+        docs.append((text.get('id', ''), label, _fieldTexts(text)))
+        for frag in text.iter('frag'):
+            docs.append((frag.get('id', ''), label, _fieldTexts(frag)))
+    return docs
+
+
+def _varint(value, out):
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def shardBytes(entries) -> bytes:
+    """Encode a shard: entries is a sorted list of (term, {document: field mask})."""
+    out = bytearray(struct.pack('<3I', MAGIC, VERSION, len(entries)))
+    previous = b''
+    for term, postings in entries:
+        encoded = term.encode('utf-8')
+        shared = 0
+        for a, b in zip(previous, encoded):
+            if a != b:
+                break
+            shared += 1
+        _varint(shared, out)
+        _varint(len(encoded) - shared, out)
+        out += encoded[shared:]
+        _varint(len(postings), out)
+        last = 0
+        for doc in sorted(postings):
+            _varint(doc - last, out)
+            _varint(postings[doc], out)
+            last = doc
+        previous = encoded
+    return bytes(out)
+
+
+def _shard(entries, prefix, shards):
+    """Add shards for entries (all of whose terms start with prefix) to shards, by prefix."""
+    data = shardBytes(entries)
+    if len(data) <= SHARD_SIZE:
+        shards[prefix] = data
+        return
+    for key, group in itertools.groupby(entries, key=lambda entry: entry[0][:len(prefix) + 1]):
+        group = list(group)
+        if key == prefix:
+            # The term that's just the prefix. Sorting puts it first.
+            shards[prefix] = shardBytes(group)
+        else:
+            _shard(group, key, shards)
+
+
+def buildIndex(pages):
+    """Build the search index of pages, a list of (href, name, parsed XML).
+
+    Returns the index (what goes in INDEX_NAME, without the shard names)
+    and the shards' contents, by prefix.
+    """
+    index = {'version': VERSION, 'fields': FIELDS, 'pages': [], 'docs': []}
+    postings = {}
+    for pagenum, (href, name, root) in enumerate(pages):
+        index['pages'].append({'href': href, 'name': name})
+        for id, label, fields in pageDocuments(root, name):
+            docnum = len(index['docs'])
+            index['docs'].append([pagenum, id, label])
+            for field, text in fields:
+                for term in terms(text):
+                    docs = postings.setdefault(term, {})
+                    docs[docnum] = docs.get(docnum, 0) | FIELDS[field]
+    shards = {}
+    if postings:
+        _shard(sorted(postings.items()), '', shards)
+    return index, shards
+
+
+def indexFiles(destdir):
+    """List the files of the index in destdir, as it was last written.
+
+    That's just the index, if it can't be read.
+    """
+    path = os.path.join(destdir, INDEX_NAME)
+    try:
+        with open(path) as f:
+            shards = json.load(f)['shards']
+    except (OSError, ValueError, KeyError):
+        return [path]
+    return [path] + [os.path.join(destdir, name) for name in shards.values()]
+
+
+def writeIndex(destdir, index, shards):
+    """Write the index and its shards to destdir, removing any shards it no longer has."""
+    os.makedirs(destdir, exist_ok=True)
+    names = {}
+    for prefix, data in shards.items():
+        names[prefix] = hashlib.sha256(data).hexdigest()[:HASH_LENGTH] + '.bin'
+        path = os.path.join(destdir, names[prefix])
+        if not os.path.exists(path):
+            writeFile(path, data)
+    index = dict(index, shards=names)
+    writeFile(os.path.join(destdir, INDEX_NAME),
+              json.dumps(index, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    keep = set(names.values()) | {INDEX_NAME}
+    for entry in os.listdir(destdir):
+        if entry.endswith('.bin') and entry not in keep:
+            log.debug('Removing old search shard: %s', entry)
+            os.unlink(os.path.join(destdir, entry))
@@ -0,0 +1,233 @@
+"""svgsprite minifies the hieroglyph images that a page refers to, and
+merges them into a single sprite sheet for the page, so that the browser
+fetches one file per page rather than one per text.
+
+Each image becomes a <symbol> in the sheet, which the page draws with
+<svg><use href="sheet.svg#symbol"/></svg>. The sheet can also be inlined
+into the page's HTML, in which case the page refers to its symbols by ID
+alone.
+
+Minifying strips comments, metadata, editor-specific markup, unused IDs
+and insignificant whitespace, and rounds coordinates to PRECISION decimal
+places, which is far finer than the images are ever drawn.
+"""
+
+import logging
+import os
+import re
+import xml.etree.ElementTree as ET
+
+from .fileutil import writeFile
+
+log = logging.getLogger(__name__)
+
+# Where sprite sheets go, relative to the dist directory.
+SPRITE_DIR = 'img/sprites'
+
+PRECISION = 2
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+XML_NS = 'http://www.w3.org/XML/1998/namespace'
+
+ET.register_namespace('', SVG_NS)
+ET.register_namespace('xlink', XLINK_NS)
+
+_SVG = '{%s}' % SVG_NS
+_HREF_ATTRS = ('href', '{%s}href' % XLINK_NS)
+
+# Elements we can drop without changing what's drawn.
+_DROPPED_ELEMENTS = {_SVG + 'metadata', _SVG + 'desc'}
+
+# Elements whose whitespace is significant.
+_TEXT_ELEMENTS = {_SVG + 'text', _SVG + 'tspan', _SVG + 'textPath'}
+
+# Attributes of the root element that a symbol doesn't take: they size or
+# place the image, and the page does that.
+_ROOT_ONLY_ATTRS = {'width', 'height', 'x', 'y', 'viewBox', 'preserveAspectRatio', 'version',
+                    'baseProfile', 'id', 'zoomAndPan', 'contentScriptType', 'contentStyleType'}
+
+# Attributes whose numbers we round.
+_NUMERIC_ATTRS = {
+    'd', 'points', 'transform', 'gradientTransform', 'patternTransform', 'viewBox',
+    'x', 'y', 'x1', 'y1', 'x2', 'y2', 'cx', 'cy', 'r', 'rx', 'ry', 'fx', 'fy',
+    'width', 'height', 'stroke-width', 'font-size', 'dx', 'dy',
+}
+
+_NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_SPACE = re.compile(r'\s+')
+_SPACE_AROUND_PUNCT = re.compile(r'\s*([,()])\s*')
+_SPACE_AROUND_COMMAND = re.compile(r'\s*([A-Za-z])\s*')
+_URL_REF = re.compile(r'url\(\s*#([^)\s]+)\s*\)')
+_LENGTH = re.compile(r'^\s*([0-9.]+)\s*(px)?\s*$')
+
+
+class SvgError(Exception):
+    """An image couldn't be read, or isn't one we can make a symbol of."""
+    def __init__(self, message):
+        self.message = message
+
+
+def spritePath(page):
+    """Where a page's sprite sheet goes, relative to the dist (or, when inlined, build) directory."""
+    return f'{SPRITE_DIR}/{os.path.splitext(os.path.basename(page))[0]}.svg'
+
+
+def formatNumber(value):
+    """Format a number as briefly as we can, to PRECISION decimal places."""
+    text = f'{round(value, PRECISION):.{PRECISION}f}'.rstrip('0').rstrip('.')
+    if text in ('-0', ''):
+        return '0'
+    if text.startswith('0.'):
+        return text[1:]
+    if text.startswith('-0.'):
+        return '-' + text[2:]
+    return text
+
+
+def _roundNumbers(value, name):
+    value = _NUMBER.sub(lambda m: formatNumber(float(m.group())), value)
+    value = _SPACE_AROUND_PUNCT.sub(r'\1', _SPACE.sub(' ', value.strip()))
+    if name == 'd':
+        value = _SPACE_AROUND_COMMAND.sub(r'\1', value)
+    # Numbers are separated by spaces or commas, but a minus sign will do.
+    return re.sub(r'[ ,](?=-)', '', value)
+
+
+def _localName(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _references(root):
+    """Find the IDs that the image refers to."""
+    ids = set()
+    for e in root.iter():
+        for name, value in e.attrib.items():
+            if name in _HREF_ATTRS and value.startswith('#'):
+                ids.add(value[1:])
+            else:
+                ids.update(_URL_REF.findall(value))
+        if e.tag == _SVG + 'style' and e.text:
+            ids.update(_URL_REF.findall(e.text))
+    return ids
+
+
+def _minifyElement(e, referenced):
+    for child in list(e):
+        if not isinstance(child.tag, str) or child.tag in _DROPPED_ELEMENTS or not child.tag.startswith(_SVG):
+            e.remove(child)
+            continue
+        _minifyElement(child, referenced)
+
+    for name in list(e.attrib):
+        if name.startswith('{') and not name.startswith(('{%s}' % XLINK_NS, '{%s}' % XML_NS)):
+            del e.attrib[name]  # e.g. inkscape: and sodipodi: attributes
+        elif name == 'id' and e.attrib[name] not in referenced:
+            del e.attrib[name]
+        elif name in _NUMERIC_ATTRS:
+            e.attrib[name] = _roundNumbers(e.attrib[name], name)
+
+    if e.tag not in _TEXT_ELEMENTS:
+        if e.text and not e.text.strip():
+            e.text = None
+        for child in e:
+            if child.tail and not child.tail.strip():
+                child.tail = None
+
+
+def minifySvg(data: bytes) -> ET.Element:
+    """Parse and minify an SVG image, returning its root element."""
+    try:
+        root = ET.fromstring(data)  # drops comments, processing instructions and the DOCTYPE
+    except ET.ParseError as e:
+        raise SvgError(f'not well-formed: {e}')
+    if root.tag != _SVG + 'svg':
+        raise SvgError(f'root element is <{_localName(root.tag)}>, not an SVG <svg>')
+    _minifyElement(root, _references(root))
+    return root
+
+
+def _prefixIds(root, prefix):
+    """Prefix the IDs in an image, and the references to them, so they can't clash with another's."""
+    def replaceUrl(m):
+        return f'url(#{prefix}{m.group(1)})'
+
+    for e in root.iter():
+        for name, value in e.attrib.items():
+            if name == 'id':
+                e.attrib[name] = prefix + value
+            elif name in _HREF_ATTRS and value.startswith('#'):
+                e.attrib[name] = '#' + prefix + value[1:]
+            elif 'url(' in value:
+                e.attrib[name] = _URL_REF.sub(replaceUrl, value)
+        if e.tag == _SVG + 'style' and e.text:
+            e.text = _URL_REF.sub(replaceUrl, e.text)
+
+
+def _viewBox(root):
+    """Get an image's viewBox, making one from its size if it hasn't got one."""
+    if root.get('viewBox'):
+        return root.get('viewBox')
+    width = _LENGTH.match(root.get('width', ''))
+    height = _LENGTH.match(root.get('height', ''))
+    if not (width and height):
+        raise SvgError('no viewBox, and no size in pixels to make one from')
+    return f'0 0 {formatNumber(float(width.group(1)))} {formatNumber(float(height.group(1)))}'
+
+
+class SpriteSheet:
+    """A page's sprite sheet, to which we add the page's images one by one."""
+
+    def __init__(self):
+        self.root = ET.Element(_SVG + 'svg')
+        self.symbols = {}  # source path -> symbol attributes for the page
+
+    def __bool__(self):
+        return bool(self.symbols)
+
+    def _symbolId(self, dest):
+        base = re.sub(r'[^A-Za-z0-9_-]', '_', os.path.splitext(os.path.basename(dest))[0])
+        symbol = 'hi-' + base
+        ids = {attrs['symbol'] for attrs in self.symbols.values()}
+        n = 1
+        while symbol in ids:
+            n += 1
+            symbol = f'hi-{base}-{n}'
+        return symbol
+
+    def add(self, src, dest):
+        """Add the image at src to the sheet (if it isn't already there).
+
+        dest is where the image would be published on its own, which we
+        name the symbol after. Returns the attributes for the page's himg
+        element: the symbol's ID, its viewBox, and the image's size.
+        """
+        if src in self.symbols:
+            return self.symbols[src]
+        with open(src, 'rb') as f:
+            image = minifySvg(f.read())
+        symbol = self._symbolId(dest)
+        attrs = {'symbol': symbol, 'viewBox': _viewBox(image)}
+        for name in ('width', 'height'):
+            if image.get(name):
+                attrs[name] = image.get(name)
+
+        _prefixIds(image, symbol + '-')
+        element = ET.SubElement(self.root, _SVG + 'symbol', id=symbol, viewBox=attrs['viewBox'])
+        if image.get('preserveAspectRatio'):
+            element.set('preserveAspectRatio', image.get('preserveAspectRatio'))
+        styles = {k: v for k, v in image.attrib.items() if k not in _ROOT_ONLY_ATTRS}
+        if styles:
+            # The image's own presentation attributes apply to all of it.
+            element = ET.SubElement(element, _SVG + 'g', styles)
+        element.extend(list(image))
+
+        self.symbols[src] = attrs
+        return attrs
+
+    def tobytes(self):
+        return ET.tostring(self.root, encoding='utf-8', xml_declaration=False)
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        writeFile(path, self.tobytes())
@@ -0,0 +1,133 @@
+"""textures makes smaller copies ("variants") of the images in a model, so
+that the viewer can fetch textures no bigger than the device can use,
+rather than the photogrammetry originals.
+
+Each image is published once, next to the model, under a name made from a
+hash of its contents (textures/<digest>.jpg), with a variant for each of
+TEXTURE_SIZES (textures/<digest>.1024.jpg and so on), scaled down to fit
+within that many pixels. Every size has a variant, so the viewer can pick
+one without knowing how big the original is: where the original already
+fits, the variant is a copy of it. Models that refer to their images this
+way (see packmodel) share them, so the LODs of a model (see lod) don't
+fetch its textures again.
+
+Variants are kept in a cache directory under the same names, so they're
+only ever made once for each image, however often the build runs.
+"""
+
+import concurrent.futures
+import hashlib
+import io
+import logging
+import os
+from dataclasses import dataclass, field, replace
+from typing import Dict
+
+from PIL import Image
+
+from .fileutil import writeFile
+
+log = logging.getLogger(__name__)
+
+# The sizes of the variants we make, in pixels along the longer side.
+TEXTURE_SIZES = [1024, 2048, 4096]
+
+# Where images go, relative to the model that refers to them.
+TEXTURE_DIR = 'textures'
+
+EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png'}
+
+JPEG_QUALITY = 85
+
+# Length of the digest in texture names.
+HASH_LENGTH = 16
+
+
+class TextureError(Exception):
+    """An image couldn't be read, or scaled down."""
+    def __init__(self, message):
+        self.message = message
+
+
+def textureName(digest, ext, size=None):
+    """The name of an image, or of one of its variants, under TEXTURE_DIR."""
+    if size is None:
+        return f'{digest}{ext}'
+    return f'{digest}.{size}{ext}'
+
+
+@dataclass
+class Texture:
+    """An image in a model, and its variants."""
+    index: int  # of the image in the model
+    name: str  # of the original, under TEXTURE_DIR
+    files: Dict[str, str] = field(default_factory=dict)  # name under TEXTURE_DIR -> path in the cache
+
+    @property
+    def uri(self):
+        """What the model should refer to the image as."""
+        return f'{TEXTURE_DIR}/{self.name}'
+
+
+def _scaleDown(image, size, ext):
+    """Scale an image down to fit in size x size pixels, returning it encoded."""
+    scale = size / max(image.size)
+    scaled = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                          Image.LANCZOS)
+    out = io.BytesIO()
+    if ext == '.jpg':
+        scaled.convert('RGB').save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        scaled.save(out, 'PNG', optimize=True)
+    return out.getvalue()
+
+
+def makeTexture(index, data, mimetype, cachedir) -> Texture:
+    """Make the variants of an image (given its encoded data), unless they're already in the cache."""
+    ext = EXTENSIONS.get(mimetype)
+    if ext is None:
+        raise TextureError(f'image {index} is {mimetype or "of an unknown type"}, not JPEG or PNG')
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    texture = Texture(index=index, name=textureName(digest, ext))
+    original = os.path.join(cachedir, texture.name)
+    if not os.path.exists(original):
+        writeFile(original, data)
+    texture.files[texture.name] = original
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            for size in TEXTURE_SIZES:
+                name = textureName(digest, ext, size)
+                if max(image.size) <= size:
+                    texture.files[name] = original
+                    continue
+                path = os.path.join(cachedir, name)
+                if not os.path.exists(path):
+                    log.debug('Scaling image %d down to %d: %s', index, size, path)
+                    writeFile(path, _scaleDown(image, size, ext))
+                texture.files[name] = path
+    except (OSError, ValueError) as e:
+        raise TextureError(f"couldn't scale image {index}: {e}")
+    return texture
+
+
+def makeTextures(model, cachedir):
+    """Make the variants of every image in a model (a tools.build.gltf.Gltf), in parallel.
+
+    Returns a list of Textures, in the order of the model's images. An
+    image that the model embeds more than once is only made once, so that
+    no two threads write the same files. Pillow lets go of the GIL while it decodes, scales and encodes
+    images, so threads are enough to keep every core busy.
+    """
+    os.makedirs(cachedir, exist_ok=True)
+    images = [model.imageBytes(i) for i in range(len(model.json.get('images', [])))]
+    if not images:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+        distinct = {}  # (data, mimetype) -> future
+        futures = []
+        for i, image in enumerate(images):
+            if image not in distinct:
+                distinct[image] = executor.submit(makeTexture, i, *image, cachedir)
+            futures.append(distinct[image])
+        return [replace(future.result(), index=i) for i, future in enumerate(futures)]
@@ -0,0 +1,91 @@
+"""watch polls the build's input files for changes, so that build.py --watch
+can rebuild whatever they affect.
+
+We poll rather than use filesystem notifications, so that we don't need any
+libraries or services beyond the standard library. Each poll is one pass of
+os.scandir over the watched directories, plus a stat of each watched file.
+"""
+
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+
+def isIgnored(name):
+    """Ignore hidden files and editor backups, which change all the time."""
+    return name.startswith('.') or name.endswith('~') or name.endswith('.swp')
+
+
+class Watcher:
+    """Polls a set of directories (recursively) and files for changes."""
+
+    def __init__(self, interval=0.1, quiet=0.2):
+        self.interval = interval  # seconds between polls
+        self.quiet = quiet  # seconds without changes before we report them
+        self.dirs = []
+        self.files = []
+        self.state = {}  # path -> (size, mtime_ns)
+
+    def _scanDir(self, dirpath, state):
+        try:
+            entries = os.scandir(dirpath)
+        except FileNotFoundError:
+            return
+        with entries:
+            for entry in entries:
+                if isIgnored(entry.name):
+                    continue
+                if entry.is_dir():
+                    self._scanDir(entry.path, state)
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                state[entry.path] = (st.st_size, st.st_mtime_ns)
+
+    def snapshot(self):
+        state = {}
+        for dirpath in self.dirs:
+            self._scanDir(dirpath, state)
+        for path in self.files:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            state[path] = (st.st_size, st.st_mtime_ns)
+        return state
+
+    def setPaths(self, dirs, files):
+        """Set what to watch.
+
+        Paths that weren't previously watched are taken as they are now,
+        rather than being reported as changed.
+        """
+        self.dirs = list(dirs)
+        self.files = list(files)
+        current = self.snapshot()
+        for path in current.keys() - self.state.keys():
+            self.state[path] = current[path]
+
+    def wait(self):
+        """Block until something changes, and return the set of changed paths.
+
+        Editors often save a file in several steps, and authors often save
+        several files at once, so once we see a change we keep collecting
+        changes until things have been quiet for a moment.
+        """
+        changed = set()
+        lastchange = None
+        while True:
+            time.sleep(self.interval)
+            current = self.snapshot()
+            diff = {p for p in current.keys() | self.state.keys() if current.get(p) != self.state.get(p)}
+            self.state = current
+            if diff:
+                changed |= diff
+                lastchange = time.monotonic()
+            elif changed and time.monotonic() - lastchange >= self.quiet:
+                return changed
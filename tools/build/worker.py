@@ -0,0 +1,175 @@
+"""worker drives a long-lived BuildSite process (see Worker.java), which keeps
+the JVM, Saxon and the compiled stylesheets warm between transforms.
+
+Page XML can be handed to the worker in memory, so that we don't need to
+write intermediate files to the build directory first. The worker runs
+transforms on a pool of threads: transformMany sends it a batch of them at
+once, to run side by side. The worker is
+restarted whenever the stylesheets (or the BuildSite JAR, or the asset
+manifest that the stylesheets read) change.
+"""
+
+import glob
+import hashlib
+import logging
+import os
+import subprocess
+
+from .config import Config
+from .manifest import hashFile
+from .profile import Profiler, fileBytes
+from .xmltoolbox import buildSiteOptions
+
+log = logging.getLogger(__name__)
+
+
+class WorkerError(Exception):
+    """The BuildSite worker failed, or couldn't be started."""
+    def __init__(self, message):
+        self.message = message
+
+
+class BuildSiteWorker:
+    """A client for a BuildSite worker process."""
+
+    def __init__(self, config: Config, profiler: Profiler = None):
+        self.profiler = profiler or Profiler()
+        self.java = config.javapath
+        self.buildsite = config.buildsitejarpath
+        self.stylesheetdir = config.stylesheetdir
+        self.assetmanifest = config.assetmanifest
+        self.xsltthreads = int(config.xsltthreads)
+        self.process = None
+        self.digest = None
+        self.documents = {}  # absolute path -> digest of what we sent
+
+    def _stylesheetsDigest(self):
+        digest = hashlib.sha256()
+        paths = [self.buildsite] + sorted(glob.glob(os.path.join(self.stylesheetdir, '*.xsl')))
+        for path in paths:
+            digest.update(path.encode('utf-8'))
+            digest.update(hashFile(path).encode('ascii'))
+        if os.path.exists(self.assetmanifest):
+            digest.update(hashFile(self.assetmanifest).encode('ascii'))
+        return digest.hexdigest()
+
+    def _readResponse(self):
+        line = self.process.stdout.readline().decode('utf-8').rstrip('\r\n')
+        if not line:
+            self.stop()
+            raise WorkerError('BuildSite worker exited unexpectedly')
+        fields = line.split('\t')
+        if fields[0] == 'ERROR':
+            raise WorkerError('BuildSite worker: ' + '\t'.join(fields[1:]))
+        if fields[0] != 'OK':
+            raise WorkerError('Unexpected response from BuildSite worker: ' + line)
+        return fields[1:]
+
+    def _send(self, fields, payload=None):
+        if self.process is None:
+            self.start()
+        header = '\t'.join(fields) + '\n'
+        self.process.stdin.write(header.encode('utf-8'))
+        if payload is not None:
+            self.process.stdin.write(payload)
+
+    def _request(self, fields, payload=None):
+        self._send(fields, payload)
+        self.process.stdin.flush()
+        return self._readResponse()
+
+    def start(self):
+        # JARs that predate worker mode would ignore --worker, and build the whole site.
+        if '--worker' not in buildSiteOptions(self.buildsite):
+            raise WorkerError(f'{self.buildsite} does not support worker mode; rebuild it with build_jar.py')
+        log.info('Starting BuildSite worker...')
+        self.digest = self._stylesheetsDigest()
+        self.documents = {}
+        cmd = [self.java, '-jar', self.buildsite, '--worker']
+        if '--threads' in buildSiteOptions(self.buildsite):
+            cmd.extend(['--threads', str(self.xsltthreads)])
+        with self.profiler.span('worker start', 'tool'):
+            self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            line = self.process.stdout.readline().decode('utf-8').rstrip('\r\n')
+        if line != 'READY':
+            self.stop()
+            raise WorkerError(f'{self.buildsite} does not support worker mode; rebuild it with build_jar.py')
+
+    def stop(self):
+        if self.process is None:
+            return
+        log.debug('Stopping BuildSite worker')
+        process, self.process = self.process, None
+        try:
+            process.stdin.write(b'QUIT\n')
+            process.stdin.close()
+        except OSError:
+            pass
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def ensureCurrent(self):
+        """Restart the worker if the stylesheets (or what they read) have changed since it started."""
+        if self.process is not None and self.digest != self._stylesheetsDigest():
+            log.info('Stylesheets changed; restarting BuildSite worker.')
+            self.stop()
+
+    def hasDocument(self, path, digest):
+        """Check whether the worker already holds the given version of a document."""
+        return self.process is not None and self.documents.get(os.path.abspath(path)) == digest
+
+    def put(self, path, data: bytes, digest):
+        """Hand the worker an XML document, to use in place of the file at path."""
+        path = os.path.abspath(path)
+        log.debug('Sending %s to BuildSite worker (%d bytes)', path, len(data))
+        with self.profiler.span('worker put', 'tool', path=path, bytes=len(data)):
+            self._request(['PUT', path, str(len(data))], data)
+        self.documents[path] = digest
+
+    def transform(self, stylesheet, src, dest):
+        """Transform src (a file, or a document we put) to dest, returning the time taken in ms."""
+        log.info('Transforming (%s): %s -> %s', stylesheet, src, dest)
+        with self.profiler.span('transform', 'xslt', stylesheet=stylesheet, src=src, dest=dest) as args:
+            fields = self._request(['TRANSFORM', stylesheet, os.path.abspath(src), os.path.abspath(dest)])
+            args['worker_ms'] = int(fields[0])
+            if self.profiler.enabled:
+                args['bytes'] = fileBytes([dest])
+        return int(fields[0])
+
+    def transformMany(self, jobs):
+        """Run a batch of transforms, each a (stylesheet, src, dest), side by side.
+
+        All of the requests are sent before any answer is read, so the
+        worker can run them on as many threads as it has. Each transform is
+        recorded in the profile on the worker thread that ran it. Raises a
+        WorkerError for the first that failed, once they've all finished.
+        """
+        if not jobs:
+            return
+        for stylesheet, src, dest in jobs:
+            log.info('Transforming (%s): %s -> %s', stylesheet, src, dest)
+        with self.profiler.span('transforms', 'xslt', count=len(jobs)):
+            for stylesheet, src, dest in jobs:
+                self._send(['TRANSFORM', stylesheet, os.path.abspath(src), os.path.abspath(dest)])
+            self.process.stdin.flush()
+            error = None
+            for stylesheet, src, dest in jobs:
+                try:
+                    fields = self._readResponse()
+                except WorkerError as e:
+                    if self.process is None:
+                        raise
+                    error = error or e
+                    continue
+                # Workers that predate threads only say how long it took.
+                if self.profiler.enabled and len(fields) >= 3:
+                    millis, started, thread = fields[:3]
+                    self.profiler.addEvent(
+                        'transform', 'xslt', self.profiler.fromEpoch(int(started) / 1000), int(millis) / 1000,
+                        thread='BuildSite ' + thread, stylesheet=stylesheet, src=src, dest=dest,
+                        bytes=fileBytes([dest]))
+        if error is not None:
+            raise error
@@ -1,16 +1,68 @@
+import concurrent.futures
 import logging
 import os
 import subprocess
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
 
 from .config import Config
+from .profile import Profiler, fileBytes
 
 log = logging.getLogger(__name__)
 
+# Don't bother splitting validation across processes for fewer files than this
+# per process; the cost of compiling the schema again would outweigh the gain.
+MIN_FILES_PER_VALIDATION = 8
+
+
+class ValidationError(Exception):
+    """One or more XML files failed validation."""
+    def __init__(self, failures):
+        # Maps each invalid file to a list of error messages.
+        self.failures = failures
+
+    @property
+    def message(self) -> str:
+        lines = [f'{len(self.failures)} file(s) failed validation:']
+        for target, errors in sorted(self.failures.items()):
+            lines.append(f'  {target}')
+            lines.extend(f'    {error}' for error in errors)
+        return '\n'.join(lines)
+
+
+def buildSiteOptions(jarpath):
+    """List the command-line options that the given BuildSite JAR understands.
+
+    The JAR's manifest names them on its BuildSite-Options line (see
+    tools/java/META-INF/MANIFEST.MF). JARs built before BuildSite took any
+    options don't have that line, and ignore their arguments.
+    """
+    try:
+        with zipfile.ZipFile(jarpath) as jar:
+            manifest = jar.read('META-INF/MANIFEST.MF').decode('utf-8')
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return frozenset()
+    # Long manifest lines go on over lines that start with a space.
+    manifest = manifest.replace('\r\n', '\n').replace('\n ', '')
+    for line in manifest.splitlines():
+        name, _, value = line.partition(':')
+        if name.strip() == 'BuildSite-Options':
+            return frozenset(value.split())
+    return frozenset()
+
+
+# The paths in build_config.xml that BuildSite JARs which predate --distdir read.
+LEGACY_BUILDSITE_PATHS = ['sourcedir', 'builddir', 'distdir', 'buildsitexml', 'distindexhtml',
+                          'site2html', 'page2html']
+
 
 class XMLToolbox:
     """An interface to external tools doing XML validation and XSL transformations."""
 
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, profiler: Profiler = None):
+        self.profiler = profiler or Profiler()
         self.verbose = config.verbose
         self.stylesheetdir = config.stylesheetdir
         self.verbose = config.verbose
@@ -18,16 +70,102 @@ class XMLToolbox:
         self.saxon = config.saxonjarpath
         self.xmlstarlet = config.xmlstarletpath
         self.buildsite = config.buildsitejarpath
+        self.builddir = config.builddir
+        self.distdir = config.distdir
+        # The paths a BuildSite JAR reads from build_config.xml.
+        self.buildsitepaths = {key: getattr(config, key) for key in LEGACY_BUILDSITE_PATHS}
+        self.xsltthreads = int(config.xsltthreads)
+        self.warned = set()
+
+    def supports(self, option):
+        """Check whether our BuildSite JAR understands the given option, warning (once) if not."""
+        if option in buildSiteOptions(self.buildsite):
+            return True
+        if option not in self.warned:
+            log.warning('%s predates BuildSite %s; rebuild it with build_jar.py (see BUILD_JAR.md).',
+                        self.buildsite, option)
+            self.warned.add(option)
+        return False
 
-    def transformSite(self):
+    def transformSite(self, pages=None):
         """Use a Java tool to transform all the site and page XML to HTML.
 
         We're using our own tool to run all of the XSLT processing in one
         program run, for much better performance than if we ran them through
         the Saxon CLI one at a time.
+
+        If pages is given, it is a list of page hrefs (as found in site.xml),
+        and only those pages are transformed, along with the site index.
+        (JARs that predate --pages transform every page regardless.)
+
+        BuildSite runs the transforms on xsltthreads threads (0 for one per
+        CPU). JARs that predate --threads run them one at a time.
+
+        The HTML is written to our distdir, which is the staging directory
+        (see tools.build.config.stageOutput), never to the dist directory.
         """
-        cmd = [self.java, '-jar', self.buildsite]
-        subprocess.run(cmd, check=True)
+        cmd = [os.path.abspath(self.java), '-jar', os.path.abspath(self.buildsite)]
+        if pages is not None and self.supports('--pages'):
+            cmd.append('--pages')
+            cmd.extend(pages)
+        if self.supports('--threads'):
+            cmd.extend(['--threads', str(self.xsltthreads)])
+        with self.profiler.span('BuildSite', 'tool', pages=len(pages) if pages is not None else None):
+            if self.supports('--distdir'):
+                self._runBuildSite(cmd + ['--distdir', self.distdir])
+            else:
+                with tempfile.TemporaryDirectory(prefix='buildsite-') as workdir:
+                    self._prepareLegacyWorkdir(workdir)
+                    self._runBuildSite(cmd, cwd=workdir)
+
+    def _prepareLegacyWorkdir(self, workdir):
+        """Set up a working directory for a BuildSite JAR that predates --distdir.
+
+        Such a JAR reads build_config.xml from its working directory, and
+        writes the HTML to the distdir there. So we give it one of its own,
+        with every path made absolute and the HTML going to our distdir. It
+        also passes the stylesheets build, in its working directory, as
+        srcdir, so that links to our build directory.
+        """
+        root = ET.Element('buildConfig')
+        site = ET.SubElement(root, 'site')
+        for key, path in self.buildsitepaths.items():
+            ET.SubElement(site, key).text = os.path.abspath(path)
+        ET.ElementTree(root).write(os.path.join(workdir, 'build_config.xml'), encoding='utf-8',
+                                   xml_declaration=True)
+        os.symlink(os.path.abspath(self.builddir), os.path.join(workdir, 'build'), target_is_directory=True)
+
+    def _runBuildSite(self, cmd, cwd=None):
+        if self.profiler.enabled and self.supports('--timings'):
+            self._runBuildSiteWithTimings(cmd, cwd)
+        else:
+            subprocess.run(cmd, check=True, cwd=cwd)
+
+    def _runBuildSiteWithTimings(self, cmd, cwd=None):
+        """Run BuildSite, recording the time each of its transforms takes in our profile.
+
+        With --timings, BuildSite reports each transform on a line of its own:
+        TIMING, then the start time (ms since the epoch), the time taken (ms),
+        the stylesheet, the source, the destination, and the thread it ran
+        on, separated by tabs. (Older JARs leave out the thread.) Everything
+        else it prints is passed on. (With a JAR that predates --timings, we
+        don't ask, and the profile just shows the whole run.)
+        """
+        process = subprocess.Popen(cmd + ['--timings'], stdout=subprocess.PIPE, text=True, cwd=cwd)
+        for line in process.stdout:
+            fields = line.rstrip('\r\n').split('\t')
+            if fields[0] != 'TIMING' or len(fields) not in (6, 7):
+                sys.stdout.write(line)
+                continue
+            _, started, millis, stylesheet, src, dest = fields[:6]
+            thread = 'BuildSite ' + fields[6] if len(fields) == 7 else 'BuildSite'
+            self.profiler.addEvent(
+                'transform', 'xslt', self.profiler.fromEpoch(int(started) / 1000), int(millis) / 1000,
+                thread=thread, stylesheet=stylesheet, src=src, dest=dest,
+                bytes=fileBytes([dest]))
+        returncode = process.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
 
     def transform(self, stylesheet, src, dest, includes=False):
         """Use XSLT to transform one input file to an output file.
@@ -49,7 +187,8 @@ class XMLToolbox:
         destdir = os.path.dirname(dest)
         if destdir:
             cmd.append('destdir=' + destdir)
-        subprocess.run(cmd, check=True)
+        with self.profiler.span('saxon', 'tool', src=src):
+            subprocess.run(cmd, check=True)
 
     def validateSchema(self, schema, target):
         """Use XML Schema to validate an XML file.
@@ -58,7 +197,8 @@ class XMLToolbox:
         the paid version of their tool.
         """
         log.debug('Validating XML against schema %s: %s', schema, target)
-        subprocess.run([self.xmlstarlet, 'val', '-q', '-e', '-s', schema, target], check=True)
+        with self.profiler.span('xmlstarlet', 'tool', schema=schema, target=target):
+            subprocess.run([self.xmlstarlet, 'val', '-q', '-e', '-s', schema, target], check=True)
 
     def validateNGSchema(self, schema, target):
         """Use a RelaxNG schema to validate an XML file.
@@ -66,7 +206,8 @@ class XMLToolbox:
         We use XML Starlet for this.
         """
         log.debug('Validating XML against schema %s: %s', schema, target)
-        subprocess.run([self.xmlstarlet, 'val', '-q', '-e', '-r', schema, target], check=True)
+        with self.profiler.span('xmlstarlet', 'tool', schema=schema, target=target):
+            subprocess.run([self.xmlstarlet, 'val', '-q', '-e', '-r', schema, target], check=True)
 
     def validate(self, target):
         """Check an XML file for well-formedness.
@@ -74,4 +215,53 @@ class XMLToolbox:
         We use XML Starlet for this for convenience.
         """
         log.debug('Validating well-formed XML: %s', target)
-        subprocess.run([self.xmlstarlet, 'val', '-q', '-e', target], check=True)
+        with self.profiler.span('xmlstarlet', 'tool', target=target):
+            subprocess.run([self.xmlstarlet, 'val', '-q', '-e', target], check=True)
+
+    def _validateNGSchemaChunk(self, schema, targets):
+        """Validate several XML files against a RelaxNG schema in one XML Starlet run.
+
+        Returns a dict mapping each invalid file to its error messages.
+        """
+        log.debug('Validating %d file(s) against schema %s', len(targets), schema)
+        cmd = [self.xmlstarlet, 'val', '-b', '-e', '-r', schema] + list(targets)
+        with self.profiler.span('xmlstarlet', 'tool', schema=schema, files=len(targets),
+                                bytes=fileBytes(targets)):
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        invalid = [line.strip() for line in result.stdout.splitlines() if line.strip()]
+        if result.returncode != 0 and not invalid:
+            # Something went wrong other than an invalid file, e.g. a broken schema.
+            invalid = [schema]
+
+        if not invalid:
+            return {}
+
+        failures = {target: [] for target in invalid}
+        for line in result.stderr.splitlines():
+            target = line.split(':', 1)[0]
+            if target not in failures:
+                target = invalid[0]
+            failures[target].append(line)
+        return failures
+
+    def validateNGSchemaBatch(self, schema, targets):
+        """Use a RelaxNG schema to validate many XML files.
+
+        Unlike validateNGSchema, this doesn't stop at the first invalid
+        file. The schema is compiled once per XML Starlet run, and large
+        batches are split across parallel runs. Schema validation implies
+        well-formedness, so there's no need to call validate separately.
+
+        Returns a dict mapping each invalid file to its error messages,
+        which is empty if everything is valid.
+        """
+        targets = list(targets)
+        if not targets:
+            return {}
+        nchunks = max(1, min(os.cpu_count() or 1, len(targets) // MIN_FILES_PER_VALIDATION))
+        chunks = [targets[i::nchunks] for i in range(nchunks)]
+        failures = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nchunks) as executor:
+            for result in executor.map(lambda chunk: self._validateNGSchemaChunk(schema, chunk), chunks):
+                failures.update(result)
+        return failures
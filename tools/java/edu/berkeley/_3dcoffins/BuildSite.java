@@ -1,12 +1,27 @@
 package edu.berkeley._3dcoffins;
 
 import java.io.File;
+import java.io.PrintStream;
 import java.util.AbstractMap;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.Collections;
 import java.util.HashMap;
+import java.util.HashSet;
+import java.util.LinkedList;
 import java.util.List;
 import java.util.Map;
+import java.util.Set;
+import java.util.concurrent.Callable;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.ExecutionException;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.Future;
+import java.util.concurrent.atomic.AtomicInteger;
 import java.util.stream.Collectors;
 import javax.xml.transform.Source;
+import javax.xml.transform.URIResolver;
 import javax.xml.transform.stream.StreamSource;
 import net.sf.saxon.s9api.Destination;
 import net.sf.saxon.s9api.Processor;
@@ -21,16 +36,97 @@ import net.sf.saxon.s9api.XsltExecutable;
 
 /**
  * The main tool for building the site HTML.
+ *
+ * Transforms can run on several threads at once. Each stylesheet is
+ * compiled once, and shared; each thread has a transformer of its own for
+ * it, since transformers can't be shared.
  */
 public class BuildSite {
     private Processor saxon;
     private XsltCompiler compiler;
-    private Map<File, Xslt30Transformer> transformers;
+    private File assetManifest;
+    private Map<File, XsltExecutable> executables;
+    private ThreadLocal<Map<File, Xslt30Transformer>> transformers;
+    private List<Xslt30Transformer> allTransformers;
+    private volatile URIResolver resolver;
+    private PrintStream log;
+    private PrintStream timings;
 
     public BuildSite() {
         this.saxon = new Processor(false);
         this.compiler = saxon.newXsltCompiler();
-        this.transformers = new HashMap<>();
+        this.executables = new ConcurrentHashMap<>();
+        this.transformers = ThreadLocal.withInitial(HashMap::new);
+        this.allTransformers = Collections.synchronizedList(new ArrayList<>());
+        this.log = System.out;
+    }
+
+    /**
+     * How long a transform took, and which thread it ran on.
+     */
+    static class Timing {
+        public final long started; // ms since the epoch
+        public final long millis;
+        public final String thread;
+
+        Timing(long started, long millis, String thread) {
+            this.started = started;
+            this.millis = millis;
+            this.thread = thread;
+        }
+    }
+
+    /**
+     * A transform to run: a stylesheet, and the source and destination files.
+     */
+    static class Transform {
+        public final File stylesheet;
+        public final File src;
+        public final File dest;
+
+        Transform(File stylesheet, File src, File dest) {
+            this.stylesheet = stylesheet;
+            this.src = src;
+            this.dest = dest;
+        }
+    }
+
+    /**
+     * Resolve documents loaded by the stylesheets (e.g. with document())
+     * using the given resolver, before falling back to the filesystem.
+     */
+    void setURIResolver(URIResolver resolver) {
+        this.resolver = resolver;
+        synchronized (allTransformers) {
+            for (Xslt30Transformer transformer : allTransformers) {
+                transformer.setURIResolver(resolver);
+            }
+        }
+    }
+
+    /**
+     * Have the stylesheets read the asset manifest from the given file
+     * (see local:asset in page2html.xsl).
+     */
+    void setAssetManifest(File assetManifest) {
+        this.assetManifest = assetManifest;
+    }
+
+    /**
+     * Write progress messages to the given stream, rather than stdout.
+     */
+    void setLog(PrintStream log) {
+        this.log = log;
+    }
+
+    /**
+     * Report how long each transform takes to the given stream, for
+     * build.py --profile. Each transform gets a line with TIMING, its start
+     * time (ms since the epoch), its duration (ms), the stylesheet, the
+     * source, the destination and the thread it ran on, separated by tabs.
+     */
+    void setTimings(PrintStream timings) {
+        this.timings = timings;
     }
 
     /**
@@ -60,23 +156,44 @@ public class BuildSite {
         File distDir = new File("dist");
         map.put("srcdir", buildDir.getAbsolutePath());
         map.put("destdir", buildDir.getAbsolutePath());
+        if (assetManifest != null) {
+            map.put("assetmanifest", assetManifest.getAbsolutePath());
+        }
         return map;
     }
 
     /**
-     * Create a Saxon API transformer that represents the given stylesheet.
+     * Get the compiled form of the given stylesheet, compiling it the
+     * first time it's asked for. Compiled stylesheets are shared by all
+     * the threads, for as long as we run.
+     *
+     * @throws SaxonApiException if the stylesheet can't be compiled.
+     */
+    private synchronized XsltExecutable getExecutable(File stylesheetPath) throws SaxonApiException {
+        XsltExecutable executable = executables.get(stylesheetPath);
+        if (executable != null) {
+            return executable;
+        }
+        executable = compiler.compile(new StreamSource(stylesheetPath));
+        executables.put(stylesheetPath, executable);
+        return executable;
+    }
+
+    /**
+     * Create a Saxon API transformer that represents the given stylesheet,
+     * for the current thread.
      *
      * @throws SaxonApiException if we could not construct the transformer
      *     (e.g. the stylesheet parsing fails).
      */
     private Xslt30Transformer makeTransformer(File stylesheetPath) throws SaxonApiException {
-        Xslt30Transformer transformer = transformers.get(stylesheetPath);
+        Map<File, Xslt30Transformer> threadTransformers = transformers.get();
+        Xslt30Transformer transformer = threadTransformers.get(stylesheetPath);
         if (transformer != null) {
             return transformer;
         }
 
-        XsltExecutable stylesheet = compiler.compile(new StreamSource(stylesheetPath));
-        transformer = stylesheet.load30();
+        transformer = getExecutable(stylesheetPath).load30();
 
         /*
          * The Saxon API interface for parameters is a bit unwieldly,
@@ -92,7 +209,13 @@ public class BuildSite {
             .collect(Collectors.toMap(Map.Entry::getKey, Map.Entry::getValue));
 
         transformer.setStylesheetParameters(stylesheetParams);
-        transformers.put(stylesheetPath, transformer);
+        synchronized (allTransformers) {
+            if (resolver != null) {
+                transformer.setURIResolver(resolver);
+            }
+            allTransformers.add(transformer);
+        }
+        threadTransformers.put(stylesheetPath, transformer);
         return transformer;
     }
 
@@ -103,15 +226,114 @@ public class BuildSite {
      * @throws SaxonApiException if either the pipeline construction or
      *    transformation fails.
      */
-    private void transform(File stylesheetPath, File srcPath, File destPath) throws SaxonApiException {
-        Source src = makeXmlSource(srcPath);
+    private Timing transform(File stylesheetPath, File srcPath, File destPath) throws SaxonApiException {
+        return transform(stylesheetPath, makeXmlSource(srcPath), destPath);
+    }
+
+    /**
+     * Like transform(File, File, File), but takes the XML source as a Saxon
+     * API source, which need not come from a file. It can be called from
+     * several threads at once. Returns how long the transform took.
+     */
+    Timing transform(File stylesheetPath, Source src, File destPath) throws SaxonApiException {
         Destination dest = makeHtmlSink(destPath);
         Xslt30Transformer transformer = makeTransformer(stylesheetPath);
-        System.out.printf("INFO: Transforming (%s): %s -> %s\n", stylesheetPath, srcPath, destPath);
+        log.printf("INFO: Transforming (%s): %s -> %s\n", stylesheetPath, src.getSystemId(), destPath);
+        long started = System.currentTimeMillis();
+        long start = System.nanoTime();
         transformer.transform(src, dest);
+        Timing timing = new Timing(started, (System.nanoTime() - start) / 1000000, Thread.currentThread().getName());
+        if (timings != null) {
+            timings.printf("TIMING\t%d\t%d\t%s\t%s\t%s\t%s\n",
+                started, timing.millis, stylesheetPath, src.getSystemId(), destPath, timing.thread);
+        }
+        return timing;
+    }
+
+    /**
+     * Create a pool of the given number of threads to run transforms on,
+     * or as many as there are processors if it's not positive.
+     */
+    static ExecutorService newPool(int threads) {
+        if (threads <= 0) {
+            threads = Runtime.getRuntime().availableProcessors();
+        }
+        AtomicInteger count = new AtomicInteger();
+        return Executors.newFixedThreadPool(threads, (runnable) -> {
+            Thread thread = new Thread(runnable, "xslt-" + count.incrementAndGet());
+            thread.setDaemon(true);
+            return thread;
+        });
+    }
+
+    /**
+     * Run the given transforms on the given pool of threads, and wait for
+     * them all to finish.
+     *
+     * @throws SaxonApiException if any of them fails (the first, if several
+     *     do).
+     */
+    void transformAll(List<Transform> transforms, ExecutorService pool) throws SaxonApiException {
+        List<Callable<Timing>> tasks = new ArrayList<>();
+        for (Transform t : transforms) {
+            tasks.add(() -> transform(t.stylesheet, t.src, t.dest));
+        }
+        List<Future<Timing>> results;
+        try {
+            results = pool.invokeAll(tasks);
+        } catch (InterruptedException e) {
+            Thread.currentThread().interrupt();
+            throw new SaxonApiException(e);
+        }
+        for (Future<Timing> result : results) {
+            try {
+                result.get();
+            } catch (InterruptedException e) {
+                Thread.currentThread().interrupt();
+                throw new SaxonApiException(e);
+            } catch (ExecutionException e) {
+                Throwable cause = e.getCause();
+                if (cause instanceof SaxonApiException) {
+                    throw (SaxonApiException) cause;
+                }
+                if (cause instanceof RuntimeException) {
+                    throw (RuntimeException) cause;
+                }
+                throw new SaxonApiException(cause);
+            }
+        }
+    }
+
+    /**
+     * Remove an option and its value (e.g. "--threads N") from the given
+     * arguments, returning the value, or null if it's not there.
+     */
+    static String takeArgument(List<String> argList, String option) {
+        int i = argList.indexOf(option);
+        if (i < 0 || i + 1 >= argList.size()) {
+            return null;
+        }
+        String value = argList.get(i + 1);
+        argList.subList(i, i + 2).clear();
+        return value;
+    }
+
+    /**
+     * Remove "--threads N" from the given arguments, returning N, or 0 (as
+     * many threads as processors) if it's not there.
+     */
+    static int takeThreadsArgument(List<String> argList) {
+        String threads = takeArgument(argList, "--threads");
+        return threads == null ? 0 : Integer.parseInt(threads);
     }
 
     static public void main(String[] args) {
+        // build.py may instead run us as a long-lived worker process.
+        if (args.length > 0 && args[0].equals("--worker")) {
+            List<String> workerArgs = new LinkedList<>(Arrays.asList(args));
+            System.exit(Worker.runWorker(takeThreadsArgument(workerArgs)));
+        }
+
         Config config = null;
         try {
             config = Config.loadFromFile(new File("build_config.xml"));
@@ -120,29 +342,56 @@ public class BuildSite {
             System.exit(1);
         }
 
-        // Generate index.html
+        // build.py --profile asks for timings. It's always the last argument.
+        // It may also say how many threads to transform pages on, and
+        // where to write the site, since it stages its output rather than
+        // writing straight to distdir.
+        List<String> argList = new LinkedList<>(Arrays.asList(args));
+        boolean reportTimings = argList.remove("--timings");
+        int threads = takeThreadsArgument(argList);
+        String distDir = takeArgument(argList, "--distdir");
+        if (distDir != null) {
+            config.setDistDir(new File(distDir));
+        }
+
         BuildSite build = new BuildSite();
-        Map<String, String> params = build.makeParameters();
-        try {
-            build.transform(config.site2html, config.buildsitexml, config.distindexhtml);
-        } catch (SaxonApiException e) {
-            e.printStackTrace();
-            System.exit(2);
+        build.setAssetManifest(config.assetmanifest);
+        if (reportTimings) {
+            build.setTimings(System.out);
         }
 
-        // Generate page HTML
+        // Generate index.html, and page HTML. build.py may restrict the
+        // pages to those that changed since the last build, by listing
+        // their hrefs after a --pages argument.
+        Set<String> onlyPages = null;
+        if (argList.size() > 0 && argList.get(0).equals("--pages")) {
+            onlyPages = new HashSet<>(argList.subList(1, argList.size()));
+        }
+        List<Transform> transforms = new ArrayList<>();
+        transforms.add(new Transform(config.site2html, config.buildsitexml, config.distindexhtml));
         try {
             PageFactory pageFactory = new PageFactory(config);
-            List<Page> pages = pageFactory.getSitePages();
-            for (Page page : pages) {
-                build.transform(config.page2html, page.getSource(), page.getDestination());
+            for (Page page : pageFactory.getSitePages()) {
+                if (onlyPages == null || onlyPages.contains(page.href)) {
+                    transforms.add(new Transform(config.page2html, page.getSource(), page.getDestination()));
+                }
             }
         } catch (BuildException e) {
             e.printStackTrace();
             System.exit(3);
-        } catch (SaxonApiException e) {
+        }
+
+        if (threads <= 0) {
+            threads = Runtime.getRuntime().availableProcessors();
+        }
+        ExecutorService pool = newPool(Math.min(threads, transforms.size()));
+        try {
+            build.transformAll(transforms, pool);
+        } catch (SaxonApiException | RuntimeException e) {
             e.printStackTrace();
             System.exit(4);
+        } finally {
+            pool.shutdown();
         }
     }
 }
@@ -2,6 +2,7 @@ package edu.berkeley._3dcoffins;
 
 import java.io.File;
 import java.io.IOException;
+import java.nio.file.Path;
 import javax.xml.parsers.DocumentBuilder;
 import javax.xml.parsers.DocumentBuilderFactory;
 import javax.xml.parsers.ParserConfigurationException;
@@ -22,6 +23,7 @@ public class Config {
     public File distindexhtml;
     public File site2html;
     public File page2html;
+    public File assetmanifest;
 
     /**
      * Find the one and only descendent element with the given name.
@@ -67,6 +69,19 @@ public class Config {
         return new File(elem.getTextContent().trim());
     }
 
+    /**
+     * Write the site to the given directory rather than distdir, e.g.
+     * build.py's staging directory. Paths in distdir move along with it.
+     */
+    void setDistDir(File dir) {
+        Path oldDir = distdir.toPath().toAbsolutePath().normalize();
+        Path index = distindexhtml.toPath().toAbsolutePath().normalize();
+        if (index.startsWith(oldDir)) {
+            distindexhtml = dir.toPath().resolve(oldDir.relativize(index)).toFile();
+        }
+        distdir = dir;
+    }
+
     /**
      * Load the config from an XML file.
      */
@@ -93,6 +108,7 @@ public class Config {
         config.distindexhtml = Config.getSubelementAsFile(site, "distindexhtml");
         config.site2html = Config.getSubelementAsFile(site, "site2html");
         config.page2html = Config.getSubelementAsFile(site, "page2html");
+        config.assetmanifest = Config.getSubelementAsFile(site, "assetmanifest");
         return config;
     }
 }
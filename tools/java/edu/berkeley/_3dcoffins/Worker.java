@@ -0,0 +1,263 @@
+package edu.berkeley._3dcoffins;
+
+import java.io.ByteArrayInputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.PrintStream;
+import java.io.UnsupportedEncodingException;
+import java.net.URI;
+import java.net.URISyntaxException;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.Map;
+import java.util.concurrent.BlockingQueue;
+import java.util.concurrent.CompletableFuture;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.ExecutionException;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Future;
+import java.util.concurrent.LinkedBlockingQueue;
+import javax.xml.transform.Source;
+import javax.xml.transform.TransformerException;
+import javax.xml.transform.URIResolver;
+import javax.xml.transform.stream.StreamSource;
+import net.sf.saxon.s9api.SaxonApiException;
+
+/**
+ * Runs BuildSite as a long-lived worker process, so that the JVM, Saxon and
+ * the compiled stylesheets stay warm from one build to the next.
+ *
+ * build.py drives the worker over stdin and stdout. Each request is a
+ * single line of tab-separated fields:
+ *
+ *   PUT systemId length          (followed by length bytes of XML)
+ *   TRANSFORM stylesheet systemId dest
+ *   QUIT
+ *
+ * The worker answers each request with a single line: "OK" (followed by
+ * the transform time in milliseconds, its start time in milliseconds since
+ * the epoch, and the thread it ran on, for TRANSFORM), or "ERROR message".
+ * It writes "READY" when it first starts up.
+ *
+ * Transforms run on a pool of threads, so build.py can send several
+ * TRANSFORM requests without waiting for the answers, to have them run at
+ * once. Answers always come in the order of the requests. A PUT waits for
+ * the transforms before it to finish, so they see the documents they were
+ * sent with.
+ *
+ * Documents sent with PUT are kept in memory, and take the place of the
+ * file at the same absolute path, both as transform sources and when
+ * stylesheets load them with document(). That way, build.py doesn't need
+ * to write its intermediate XML to disk.
+ */
+class Worker implements URIResolver {
+    // Marks the end of the answers.
+    private static final Future<String> END = CompletableFuture.completedFuture(null);
+
+    private BuildSite build;
+    private Map<String, byte[]> documents;
+    private PrintStream out;
+    private ExecutorService pool;
+    private BlockingQueue<Future<String>> answers; // in the order of the requests
+    private List<Future<String>> transforms; // those since the last PUT
+
+    public Worker(BuildSite build, PrintStream out, ExecutorService pool) {
+        this.build = build;
+        this.documents = new ConcurrentHashMap<>();
+        this.out = out;
+        this.pool = pool;
+        this.answers = new LinkedBlockingQueue<>();
+        this.transforms = new ArrayList<>();
+        build.setURIResolver(this);
+    }
+
+    /**
+     * Returns the normalized URI for a file path, which we use to key
+     * our in-memory documents.
+     */
+    private static String toUri(String path) {
+        return new File(path).getAbsoluteFile().toURI().normalize().toString();
+    }
+
+    /**
+     * Returns a source for the given document, preferring one sent to us
+     * with PUT over the file on disk.
+     */
+    private Source makeSource(String uri) {
+        byte[] doc = documents.get(uri);
+        if (doc == null) {
+            return null;
+        }
+        return new StreamSource(new ByteArrayInputStream(doc), uri);
+    }
+
+    @Override
+    public Source resolve(String href, String base) throws TransformerException {
+        try {
+            URI uri = (base == null || base.isEmpty()) ? new URI(href) : new URI(base).resolve(href);
+            if (!uri.isAbsolute()) {
+                uri = new File(href).getAbsoluteFile().toURI();
+            }
+            return makeSource(uri.normalize().toString());
+        } catch (URISyntaxException e) {
+            // Not something we could have been sent; let Saxon deal with it.
+            return null;
+        }
+    }
+
+    /**
+     * Read a single line of the request stream, without its newline.
+     * Returns null at the end of the stream.
+     */
+    private static String readLine(InputStream in) throws IOException {
+        ByteArrayOutputStream line = new ByteArrayOutputStream();
+        int b;
+        while ((b = in.read()) != '\n') {
+            if (b < 0) {
+                return line.size() > 0 ? line.toString("UTF-8") : null;
+            }
+            line.write(b);
+        }
+        return line.toString("UTF-8");
+    }
+
+    private void answer(String line) {
+        answers.add(CompletableFuture.completedFuture(line));
+    }
+
+    private static String errorAnswer(Exception e) {
+        return "ERROR\t" + String.valueOf(e.getMessage()).replace('\n', ' ');
+    }
+
+    private void put(String path, byte[] doc) {
+        for (Future<String> transform : transforms) {
+            try {
+                transform.get();
+            } catch (InterruptedException | ExecutionException e) {
+                // Its answer says what went wrong.
+            }
+        }
+        transforms.clear();
+        documents.put(toUri(path), doc);
+        answer("OK");
+    }
+
+    private void transform(String stylesheet, String path, String dest) {
+        Future<String> transform = pool.submit(() -> {
+            String uri = toUri(path);
+            Source src = makeSource(uri);
+            if (src == null) {
+                src = new StreamSource(uri);
+            }
+            try {
+                BuildSite.Timing timing = build.transform(new File(stylesheet), src, new File(dest));
+                return "OK\t" + timing.millis + "\t" + timing.started + "\t" + timing.thread;
+            } catch (SaxonApiException | RuntimeException e) {
+                e.printStackTrace();
+                return errorAnswer(e);
+            }
+        });
+        transforms.add(transform);
+        answers.add(transform);
+    }
+
+    /**
+     * Write the answers to requests as they're ready, in order, until the
+     * END marker.
+     */
+    private void writeAnswers() {
+        try {
+            Future<String> answer;
+            while ((answer = answers.take()) != END) {
+                try {
+                    out.println(answer.get());
+                } catch (ExecutionException e) {
+                    out.println(errorAnswer(e));
+                }
+            }
+        } catch (InterruptedException e) {
+            Thread.currentThread().interrupt();
+        }
+    }
+
+    /**
+     * Serve requests until we are asked to quit, or the request stream ends.
+     */
+    public void serve(InputStream stream) throws IOException {
+        DataInputStream in = new DataInputStream(stream);
+        out.println("READY");
+        Thread writer = new Thread(this::writeAnswers, "worker-answers");
+        writer.start();
+        try {
+            String line;
+            while ((line = readLine(in)) != null) {
+                String[] fields = line.split("\t");
+                try {
+                    if (fields[0].equals("PUT") && fields.length == 3) {
+                        byte[] doc = new byte[Integer.parseInt(fields[2])];
+                        in.readFully(doc);
+                        put(fields[1], doc);
+                    } else if (fields[0].equals("TRANSFORM") && fields.length == 4) {
+                        transform(fields[1], fields[2], fields[3]);
+                    } else if (fields[0].equals("QUIT")) {
+                        answer("OK");
+                        return;
+                    } else {
+                        answer("ERROR\tBad request: " + line);
+                    }
+                } catch (RuntimeException e) {
+                    e.printStackTrace();
+                    answer(errorAnswer(e));
+                }
+            }
+        } finally {
+            answers.add(END);
+            try {
+                writer.join();
+            } catch (InterruptedException e) {
+                Thread.currentThread().interrupt();
+            }
+        }
+    }
+
+    /**
+     * Run a worker on stdin and stdout, and return the process exit status.
+     */
+    static int runWorker(int threads) {
+        // Our protocol has stdout all to itself. Everything else that would
+        // normally go there (e.g. progress messages) goes to stderr instead.
+        PrintStream out;
+        try {
+            out = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        } catch (UnsupportedEncodingException e) {
+            e.printStackTrace();
+            return 1;
+        }
+        System.setOut(System.err);
+
+        BuildSite build = new BuildSite();
+        build.setLog(System.err);
+        try {
+            Config config = Config.loadFromFile(new File("build_config.xml"));
+            build.setAssetManifest(config.assetmanifest);
+        } catch (ConfigException e) {
+            // We can do without it.
+            e.printStackTrace();
+        }
+        ExecutorService pool = BuildSite.newPool(threads);
+        try {
+            new Worker(build, out, pool).serve(System.in);
+        } catch (IOException e) {
+            e.printStackTrace();
+            return 5;
+        } finally {
+            pool.shutdown();
+        }
+        return 0;
+    }
+}
@@ -2,9 +2,12 @@
 <xsl:stylesheet version="3.0"
   xmlns:xsl="http://www.w3.org/1999/XSL/Transform"
   xmlns:xs="http://www.w3.org/2001/XMLSchema"
-  xmlns:j="http://www.w3.org/2005/xpath-functions">
+  xmlns:j="http://www.w3.org/2005/xpath-functions"
+  xmlns:local="urn:3dviewer:local"
+  exclude-result-prefixes="local">
   <!--
     page2html.xsl generates a page from the page's source XML.
+    tools/build/htmlrender.py does the same in Python; keep the two in step.
   -->
 
   <xsl:output method="html" indent="yes" version="5.0"/>
@@ -12,6 +15,22 @@
   <xsl:param name="srcdir" as="xs:string" required="yes"/>
   <xsl:param name="destdir" as="xs:string" required="yes"/>
 
+  <!--
+    When fingerprinting is on, the build publishes content-hashed copies
+    of the assets, and lists them in the asset manifest, which maps each
+    asset's path to its copy's. BuildSite passes us its path (assetmanifest
+    in build_config.xml); older JARs leave it at the default.
+  -->
+  <xsl:param name="assetmanifest" as="xs:string" required="no" select="concat($srcdir, '/asset-manifest.json')"/>
+  <xsl:variable name="assets" as="map(*)"
+    select="if (unparsed-text-available($assetmanifest)) then json-doc($assetmanifest) else map{}"/>
+
+  <!-- The path to refer to an asset by, relative to the dist directory. -->
+  <xsl:function name="local:asset" as="xs:string">
+    <xsl:param name="path" as="xs:string"/>
+    <xsl:sequence select="($assets($path), $path)[1]"/>
+  </xsl:function>
+
   <xsl:template match="page">
     <html>
       <head>
@@ -21,9 +40,12 @@
         </title>
         <meta name="DC.Creator" value="{creator}"/>
         <link rel="schema.DC" href="http://purl.org/DC/elements/1.0/"/>
-        <link rel="stylesheet" type="text/css" href="css/viewer.css"/>
+        <link rel="stylesheet" type="text/css" href="{local:asset('css/viewer.min.css')}"/>
+        <!-- The build bundles three.js, its loaders and controls, and our own scripts into one. -->
+        <script defer="defer" src="{local:asset('js/viewer.js')}"/>
       </head>
       <body>
+        <xsl:call-template name="inline-sprites"/>
         <div id="nav_container">
           <nav>
             <ul>
@@ -80,11 +102,6 @@
             </div>
           </div>
         </div>
-        <script src="js/three.min.js"/>
-        <script src="js/loaders/GLTFLoader.js"/>
-        <script src="js/controls/OrbitControls.js"/>
-        <script src = "js/main.js"/>
-        <script src = "js/page.js" />
         <xsl:apply-templates select="model" mode="codegen"/>
       </body>
     </html>
@@ -93,7 +110,8 @@
   <xsl:template match="model" mode="codegen">
     <xsl:variable name="model-name">
       <j:string>
-        <xsl:value-of select="@dest"/>
+        <!-- The build adds @packed if it published an optimised copy of the model. -->
+        <xsl:value-of select="local:asset((@packed, @dest)[1])"/>
       </j:string>
     </xsl:variable>
     <xsl:variable name="model-links">
@@ -101,11 +119,59 @@
         <xsl:apply-templates select="link" mode="codegen"/>
       </j:array>
     </xsl:variable>
+    <!-- The build adds @bvh if it built a BVH of the model's hitboxes. -->
+    <xsl:variable name="model-bvh">
+      <xsl:choose>
+        <xsl:when test="@bvh">
+          <j:string><xsl:value-of select="local:asset(@bvh)"/></j:string>
+        </xsl:when>
+        <xsl:otherwise>
+          <j:null/>
+        </xsl:otherwise>
+      </xsl:choose>
+    </xsl:variable>
+    <!-- The build adds @offset, how far to move the model to centre it, if it knows. -->
+    <xsl:variable name="model-offset">
+      <xsl:choose>
+        <xsl:when test="@offset">
+          <xsl:call-template name="vector-codegen">
+            <xsl:with-param name="vector" select="@offset"/>
+          </xsl:call-template>
+        </xsl:when>
+        <xsl:otherwise>
+          <j:null/>
+        </xsl:otherwise>
+      </xsl:choose>
+    </xsl:variable>
+    <!-- With texture variants, the build adds @textures, listing their sizes. -->
+    <xsl:variable name="texture-sizes">
+      <j:array>
+        <xsl:for-each select="tokenize(@textures)">
+          <j:number><xsl:value-of select="."/></j:number>
+        </xsl:for-each>
+      </j:array>
+    </xsl:variable>
+    <!-- With LODs, the build adds @lods, listing them coarsest first. -->
+    <xsl:variable name="model-lods">
+      <j:array>
+        <xsl:for-each select="tokenize(@lods)">
+          <j:string><xsl:value-of select="local:asset(.)"/></j:string>
+        </xsl:for-each>
+      </j:array>
+    </xsl:variable>
+    <!-- The bundle is deferred, so it won't have run until the document is parsed. -->
     <script>
-      const gModelName = <xsl:value-of select="xml-to-json($model-name)"/>;
-      const gModelLinks = <xsl:value-of select="xml-to-json($model-links)"/>;
-      const gController = new ModelController(gModelName, gModelLinks);
-      gController.run();
+      document.addEventListener('DOMContentLoaded', () => {
+        const gModelName = <xsl:value-of select="xml-to-json($model-name)"/>;
+        const gModelLinks = <xsl:value-of select="xml-to-json($model-links)"/>;
+        const gModelLods = <xsl:value-of select="xml-to-json($model-lods)"/>;
+        const gTextureSizes = <xsl:value-of select="xml-to-json($texture-sizes)"/>;
+        const gModelBvh = <xsl:value-of select="xml-to-json($model-bvh)"/>;
+        const gModelOffset = <xsl:value-of select="xml-to-json($model-offset)"/>;
+        const gController = new ModelController(gModelName, gModelLinks, gModelLods, gTextureSizes, gModelBvh,
+                                                gModelOffset);
+        gController.run();
+      });
     </script>
   </xsl:template>
 
@@ -117,9 +183,36 @@
       <j:string key="ref">
         <xsl:value-of select="@ref"/>
       </j:string>
+      <!-- The build adds @node, the index of the glTF node the link refers to. -->
+      <xsl:if test="@node">
+        <j:number key="node">
+          <xsl:value-of select="@node"/>
+        </j:number>
+      </xsl:if>
+      <!-- It adds @center, @min, @max and @normal too, describing the node's hitbox, if it can. -->
+      <xsl:for-each select="@center | @min | @max | @normal">
+        <xsl:call-template name="vector-codegen">
+          <xsl:with-param name="vector" select="."/>
+          <xsl:with-param name="key" select="local-name()"/>
+        </xsl:call-template>
+      </xsl:for-each>
     </j:map>
   </xsl:template>
 
+  <!-- A vector attribute (numbers separated by spaces), as a JSON array. -->
+  <xsl:template name="vector-codegen">
+    <xsl:param name="vector"/>
+    <xsl:param name="key"/>
+    <j:array>
+      <xsl:if test="$key">
+        <xsl:attribute name="key" select="$key"/>
+      </xsl:if>
+      <xsl:for-each select="tokenize($vector)">
+        <j:number><xsl:value-of select="."/></j:number>
+      </xsl:for-each>
+    </j:array>
+  </xsl:template>
+
   <xsl:template match="description" mode="codegen">
     <h2>Description</h2>
     <xsl:apply-templates/>
@@ -180,12 +273,36 @@
     </div>
   </xsl:template>
 
+  <!--
+    The build adds @symbol if it put the image in the page's sprite sheet,
+    along with @sprite if the sheet is a file of its own, or @inline-sprite
+    if it's to be inlined into the page.
+  -->
+  <xsl:template match="himg[@symbol]">
+    <div class="hi-container">
+      <svg xmlns="http://www.w3.org/2000/svg" class="hi" viewBox="{@viewBox}">
+        <xsl:copy-of select="@width|@height"/>
+        <use href="{if (@sprite) then local:asset(@sprite) else ''}#{@symbol}"/>
+      </svg>
+    </div>
+  </xsl:template>
+
   <xsl:template match="himg">
     <div class="hi-container">
-      <img class="hi" src="{@dest}"/>
+      <img class="hi" src="{local:asset(@dest)}"/>
     </div>
   </xsl:template>
 
+  <!-- An inlined sprite sheet, which the build left in the build directory. -->
+  <xsl:template name="inline-sprites">
+    <xsl:variable name="sprites" select="(//himg/@inline-sprite)[1]"/>
+    <xsl:if test="$sprites">
+      <svg xmlns="http://www.w3.org/2000/svg" width="0" height="0" style="position: absolute" aria-hidden="true">
+        <xsl:copy-of select="doc(concat($srcdir, '/', $sprites))/*/*"/>
+      </svg>
+    </xsl:if>
+  </xsl:template>
+
   <xsl:template match="contents//al[@encoding='unicode']">
     <span class="al">
       <xsl:apply-templates/>
@@ -2,9 +2,12 @@
 <xsl:stylesheet version="3.0"
   xmlns:xsl="http://www.w3.org/1999/XSL/Transform"
   xmlns:xs="http://www.w3.org/2001/XMLSchema"
-  xmlns:j="http://www.w3.org/2005/xpath-functions">
+  xmlns:j="http://www.w3.org/2005/xpath-functions"
+  xmlns:local="urn:3dviewer:local"
+  exclude-result-prefixes="local">
   <!--
     site2html.xsl generates index.html from site.xml.
+    tools/build/htmlrender.py does the same in Python; keep the two in step.
   -->
 
   <xsl:output method="html" indent="yes" version="5.0"/>
@@ -12,13 +15,39 @@
   <xsl:param name="srcdir" as="xs:string" required="yes"/>
   <xsl:param name="destdir" as="xs:string" required="yes"/>
 
+  <!-- The asset manifest, as in page2html.xsl. -->
+  <xsl:param name="assetmanifest" as="xs:string" required="no" select="concat($srcdir, '/asset-manifest.json')"/>
+  <xsl:variable name="assets" as="map(*)"
+    select="if (unparsed-text-available($assetmanifest)) then json-doc($assetmanifest) else map{}"/>
+
+  <!-- The path to refer to an asset by, relative to the dist directory. -->
+  <xsl:function name="local:asset" as="xs:string">
+    <xsl:param name="path" as="xs:string"/>
+    <xsl:sequence select="($assets($path), $path)[1]"/>
+  </xsl:function>
+
   <xsl:template match="site">
     <html>
       <head>
         <title>The Book of the Dead in 3D</title>
         <meta description = "Translations of texts on 3D models of coffins."></meta>
+        <!-- search.js searches the index the build makes of every page's texts. -->
+        <script defer="defer" src="{local:asset('js/search.js')}"/>
       </head>
       <body>
+        <div class="search">
+          <input type="search" id="search" autocomplete="off"
+            placeholder="Search translations, transliterations and signs" aria-label="Search"/>
+          <ul id="search-results"></ul>
+        </div>
+        <script><xsl:text>
+          document.addEventListener('DOMContentLoaded', () => {
+            const gSearchBox = new SearchBox(document.getElementById('search'),
+              document.getElementById('search-results'), new SearchIndex('</xsl:text>
+          <xsl:value-of select="local:asset('search/index.json')"/>
+          <xsl:text>'));
+          });
+        </xsl:text></script>
         <div class = "main-contents">
           <ul>
             <xsl:for-each select="page">